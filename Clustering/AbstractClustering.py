@@ -7,14 +7,14 @@ AbstractClustering.py
 """
 
 import abc
-from kshape.core import _ncc_c
 import numpy as np
-import numpy.core.numeric as _nx
-import operator
 from os.path import isfile, normpath as normp
 import pandas as pd
+from tqdm import tqdm
 
+from Clustering.NCCEngine import NCCEngine
 from Datasets.Dataset import Dataset
+from Utils.ArtifactsManifest import ArtifactsManifest
 from Utils.Utils import Utils
 from Utils.SingletonClass import SingletonClass
 
@@ -50,6 +50,10 @@ class AbstractClustering(SingletonClass, metaclass=abc.ABCMeta):
     def _get_cassignment_filename(self, dataset_name):
         pass
 
+    @abc.abstractmethod
+    def _get_cassignments_store(self):
+        pass
+
     def are_clusters_created(self, dataset_name):
         """
         Checks whether the clusters exist or not.
@@ -57,32 +61,59 @@ class AbstractClustering(SingletonClass, metaclass=abc.ABCMeta):
         Keyword arguments: -
         
         Return: 
-        True if the clusters have already been created and saved as CSV, false otherwise.
+        True if the clusters have already been created and saved, false otherwise.
         """
-        cassignment_filename = self._get_cassignment_filename(dataset_name)
-        return isfile(cassignment_filename)
+        self._migrate_cassignment_csv(dataset_name)
+        return self._get_cassignments_store().contains(dataset_name)
+
+    def get_clusters_version(self, dataset_name):
+        """
+        Returns the version of the given data set's clusters. The version changes each time the clusters are saved.
+        
+        Keyword arguments: 
+        dataset_name -- name of the data set to which the clusters belong
+        
+        Return: 
+        Version (int) of the data set's clusters or None if the clusters have not been created yet.
+        """
+        return self._get_cassignments_store().get_version(dataset_name)
+
+    def get_inputs_hash(self, dataset):
+        """
+        Returns the hash of the inputs the data set's clusters are created from: the data set's archive and the clusterer's
+        configuration entries which change the clusters (see INPUTS_CONF_KEYS).
+        
+        Keyword arguments: 
+        dataset -- Dataset object to which the clusters belong
+        
+        Return: 
+        Hash of the clusters' inputs (see ArtifactsManifest.hash_inputs)
+        """
+        return ArtifactsManifest.hash_inputs(dataset.get_archive_sha1(), ArtifactsManifest.get_conf_inputs(self))
 
-    def make_cids_unique(self, datasets):
+    def make_cids_unique(self, datasets, first_cid=0):
         """
-        Iterates over all Datasets and updates their clusters' ID such that they are unique.
+        Iterates over all Datasets and updates their clusters' ID such that they are unique. The clusters of each data set 
+        are numbered by order of appearance, starting after the last ID given to the previous data set's clusters.
         
         Keyword arguments:
         datasets -- list of Dataset objects containing the time series to cluster.
+        first_cid -- ID given to the first cluster of the first data set (default 0). Used to number the clusters after those
+                     of the data sets which are not renumbered.
         
         Return:
         List of Dataset objects containing the time series.
         """
-        next_global_cid = 0
+        # load clusters assignment of each dataset and number its clusters
+        all_clusters_assignments = [dataset.load_cassignment(self) for dataset in datasets]
+        all_codes = [pd.factorize(clusters_assignment['Cluster ID'])[0] for clusters_assignment in all_clusters_assignments]
+        # offset of each data set's cluster ids such that there are no duplicates over all datasets
+        offsets = first_cid + np.cumsum([0] + [codes.max() + 1 if len(codes) > 0 else 0 for codes in all_codes])
+
         updated_datasets = []
-        for dataset in datasets:
-            # load clusters assignment of each dataset
-            clusters_assignment = self.load_clusters(dataset.name)
-            # update cluster ids such that there are no duplicates over all datasets
-            for i, cluster_id in enumerate(clusters_assignment['Cluster ID'].unique()):
-                clusters_assignment['Cluster ID'].replace(cluster_id, '#' + str(i + next_global_cid), inplace=True)
-            clusters_assignment['Cluster ID'] = clusters_assignment['Cluster ID'].map(lambda v: int(v.replace('#', '')))
-            next_global_cid += len(clusters_assignment['Cluster ID'].unique())
-            # save modified assignments to csv
+        for dataset, clusters_assignment, codes, offset in zip(datasets, all_clusters_assignments, all_codes, offsets):
+            clusters_assignment['Cluster ID'] = codes + offset
+            # save modified assignments
             self.save_clusters(dataset, clusters_assignment)
             updated_datasets.append(dataset)
         return updated_datasets
@@ -90,7 +121,7 @@ class AbstractClustering(SingletonClass, metaclass=abc.ABCMeta):
     def apply_constraints(self, datasets, min_nb_ts, max_nb_ts):
         """
         Applies clusters' constraints. Each should have between 5 and 15 (variables defined in config file) time series.
-        Updates the clusters assignment csv files.
+        Updates the saved clusters assignments.
         
         Keyword arguments:
         datasets -- list of Dataset objects containing the time series to cluster.
@@ -125,27 +156,53 @@ class AbstractClustering(SingletonClass, metaclass=abc.ABCMeta):
             all_cids.append(cid)
         return True
 
-    def _get_dataset_mean_ncc_score(self, timeseries):
+    def _migrate_cassignment_csv(self, dataset_name):
+        """
+        Imports in the clusters' assignments store the data set's clusters saved as CSV by previous versions (if any and
+        if they have not been imported yet).
+        
+        Keyword arguments: 
+        dataset_name -- name of the data set to which the clusters belong
+        
+        Return: -
+        """
+        store = self._get_cassignments_store()
+        cassignment_filename = self._get_cassignment_filename(dataset_name)
+        if not store.contains(dataset_name) and isfile(cassignment_filename):
+            store.save(dataset_name, pd.read_csv(cassignment_filename))
+
+    def _get_dataset_mean_ncc_score(self, timeseries, ncc_engine=None):
         """
         Measure the Normalized Cross-Correlation score over all pairs of time series in the data set and return the mean value.
         
         Keyword arguments:
         timeseries -- Pandas DataFrame containing the time series (each row is a time series)
+        ncc_engine -- NCCEngine object of a data set containing the given time series. Scores of pairs already measured by 
+                      this engine are not measured again (default None, if None, creates an engine for the given time series)
         
         Return:
         Average of NCC scores measured for all pairs of time series
         """
         if timeseries.shape[0] > 1: # if there are >1 time series in the data set
-            ncc_score, count = 0, 0
-            for i in range(1, len(timeseries.index)):
-                for j in range(0, i):
-                    values = _ncc_c(timeseries.iloc[i].values, timeseries.iloc[j].values)
-                    ncc_score += values[values.argmax()]
-                    count += 1
-            return ncc_score / count
+            ncc_engine = ncc_engine if ncc_engine is not None else NCCEngine(timeseries)
+            return ncc_engine.get_mean_ncc(timeseries.index)
         else:
             return 1.0
 
+    def _get_avg_ncc(self, within_sums, sizes):
+        """
+        Computes the average NCC score of clusters from the sums of the NCC scores of their pairs of time series.
+        
+        Keyword arguments:
+        within_sums -- Numpy array of the sum of the NCC scores of the distinct pairs of each cluster's time series
+        sizes -- Numpy array of the number of time series of each cluster
+        
+        Return:
+        Numpy array of the average NCC score of each cluster (1.0 for clusters with less than 2 time series)
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(sizes > 1, within_sums / (sizes * (sizes - 1) / 2), 1.0)
+
     def _get_dataset_mean_corr(self, timeseries):
         """
         Measure the average correlation of time series in the data set.
@@ -167,7 +224,9 @@ class AbstractClustering(SingletonClass, metaclass=abc.ABCMeta):
         """
         For each data set, merges the clusters having less than "min_nb_ts" time series to the most similar 
         cluster from the same data set.
-        Updates the clusters assignment csv files.
+        The candidate merges are scored from the sums of the NCC scores within each cluster and between each small cluster 
+        and every other cluster ("block sums"): only these blocks of pairs are measured and the block sums are updated after
+        each merge. All the small clusters of a data set are merged in memory and the assignments are saved once.
         
         Keyword arguments:
         datasets -- list of Dataset objects containing the time series to cluster.
@@ -176,50 +235,89 @@ class AbstractClustering(SingletonClass, metaclass=abc.ABCMeta):
         Return: 
         List of updated Dataset objects.
         """
-        all_avg_ncc = {}
+        updated_datasets = []
+        for dataset in tqdm(datasets):
+            clusters_assignment = dataset.load_cassignment(self)
+            codes, cids = pd.factorize(clusters_assignment['Cluster ID']) # clusters in order of first appearance
+            sizes = np.bincount(codes, minlength=len(cids))
+            small_clusters = np.flatnonzero(sizes < min_nb_ts)
+            if len(small_clusters) > 0:
+                timeseries = dataset.load_timeseries(transpose=True)
+                ncc_engine = NCCEngine(timeseries) # scores of the data set's pairs of time series are measured at most once
+                tids = clusters_assignment['Time Series ID'].to_numpy()
+                within_sums, cross_sums = self._get_ncc_block_sums(ncc_engine, tids, codes, len(cids), small_clusters)
+                small_rows = dict(zip(small_clusters, range(len(small_clusters)))) # cluster -> row in cross_sums
 
-        # compute avg ncc score of each cluster
-        for dataset, _, cluster, cluster_id in Dataset.yield_each_datasets_cluster(datasets):
-            all_avg_ncc[f'{dataset.name}_{cluster_id}'] = self._get_dataset_mean_ncc_score(cluster)
+                # merging phase
+                owners = np.arange(len(cids)) # cluster each original cluster has been merged into
+                alive = np.ones(len(cids), dtype=bool)
+                for c in small_clusters:
+                    if sizes[c] >= min_nb_ts: # the cluster has grown by absorbing other small clusters
+                        continue
+                    # average NCC score difference of each candidate (score with merge - score without merge)
+                    candidates = alive & (sizes + sizes[c] >= min_nb_ts)
+                    candidates[c] = False
+                    if not candidates.any():
+                        continue
+                    merged_sizes = sizes + sizes[c]
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        merged_avg_ncc = (within_sums + within_sums[c] + cross_sums[small_rows[c]]) / (merged_sizes * (merged_sizes - 1) / 2)
+                    ncc_diffs = np.where(candidates, merged_avg_ncc - self._get_avg_ncc(within_sums, sizes), -np.inf)
 
-        # merging phase
-        updated_datasets = []
-        for dataset, timeseries, cluster, cluster_id in Dataset.yield_each_datasets_cluster(datasets):
-            clusters_assignment = self.load_clusters(dataset.name)
-            if cluster.shape[0] < min_nb_ts: # merge if not enough time series
-                ncc_diffs = {}
-
-                # compute average NCC score of each cluster
-                for other_clusters_id in clusters_assignment['Cluster ID'].unique():
-                    if cluster_id != other_clusters_id: # for all the other clusters from this data set
-                        other_cluster = dataset.get_cluster_by_id(timeseries, other_clusters_id, clusters_assignment)
-
-                        merged_cluster = pd.concat([other_cluster, cluster]) # merge the two clusters
-
-                        if merged_cluster.shape[0] >= min_nb_ts:
-                            # compute the avg ncc score difference (score with merge - score without merge)
-                            other_cluster_avg_ncc = all_avg_ncc[f'{dataset.name}_{other_clusters_id}']
-                            merged_cluster_avg_ncc = self._get_dataset_mean_ncc_score(merged_cluster)
-                            ncc_diffs[other_clusters_id] = merged_cluster_avg_ncc - other_cluster_avg_ncc
-
-                # merge with the cluster that returned the largest positive diff
-                ranked_ncc_diffs = sorted(ncc_diffs.items(), key=operator.itemgetter(1), reverse=True)
-                selected_cluster_id = ranked_ncc_diffs[0][0]
-                clusters_assignment['Cluster ID'].replace(cluster_id, selected_cluster_id, inplace=True)
-
-                # update the avg ncc score of the merged cluster
-                new_cluster = dataset.get_cluster_by_id(timeseries, selected_cluster_id, clusters_assignment)
-                all_avg_ncc[f'{dataset.name}_{selected_cluster_id}'] = self._get_dataset_mean_ncc_score(new_cluster)
-
-            # save modified assignments to csv
+                    # merge with the cluster that returned the largest diff
+                    selected = ncc_diffs.argmax()
+                    within_sums[selected] += within_sums[c] + cross_sums[small_rows[c], selected]
+                    cross_sums[:, selected] += cross_sums[:, c]
+                    if selected in small_rows:
+                        cross_sums[small_rows[selected]] += cross_sums[small_rows[c]]
+                    sizes[selected] += sizes[c]
+                    sizes[c], alive[c] = 0, False
+                    owners[owners == c] = selected
+
+                clusters_assignment['Cluster ID'] = cids.to_numpy()[owners[codes]]
+
+            # save modified assignments
             self.save_clusters(dataset, clusters_assignment)
             updated_datasets.append(dataset)
         return updated_datasets
 
+    def _get_ncc_block_sums(self, ncc_engine, tids, codes, nb_clusters, small_clusters):
+        """
+        Computes the sums of the NCC scores of the pairs of time series within each cluster and between each small cluster 
+        and each cluster.
+        
+        Keyword arguments:
+        ncc_engine -- NCCEngine object of the data set
+        tids -- Numpy array of the IDs of the data set's time series
+        codes -- Numpy array of the index of the cluster of each time series (each cluster has at least one time series)
+        nb_clusters -- number of clusters
+        small_clusters -- Numpy array of the index of the small clusters
+        
+        Return:
+        1. Numpy array of the sum of the NCC scores of the distinct pairs of each cluster's time series
+        2. Numpy ndarray (nb small clusters x nb clusters) of the sum of the NCC scores of the pairs made of one time series 
+           of a small cluster and one time series of a cluster
+        """
+        order = np.argsort(codes, kind='stable')
+        sizes = np.bincount(codes, minlength=nb_clusters)
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+        within_sums = np.zeros(nb_clusters)
+        for c in np.flatnonzero(sizes > 1):
+            cluster_tids = tids[order[starts[c]:starts[c] + sizes[c]]]
+            within_sums[c] = np.triu(ncc_engine.get_submatrix(cluster_tids, cluster_tids), 1).sum()
+
+        # sum the scores of the small clusters' rows by cluster of the columns, then by small cluster of the rows
+        small_rows = order[np.concatenate([np.arange(starts[c], starts[c] + sizes[c]) for c in small_clusters])]
+        block = ncc_engine.get_submatrix(tids[small_rows], tids[order])
+        block = np.add.reduceat(block, starts, axis=1)
+        cross_sums = np.add.reduceat(block, np.concatenate([[0], np.cumsum(sizes[small_clusters])[:-1]]), axis=0)
+        return within_sums, cross_sums
+
     def _explode_large_clusters(self, datasets, max_nb_ts):
         """
         Explodes large clusters into multiple smaller ones.
-        Updates the clusters assignment csv files.
+        Updates the saved clusters assignments.
         
         Keyword arguments:
         datasets -- list of Dataset objects containing the time series to cluster.
@@ -229,28 +327,33 @@ class AbstractClustering(SingletonClass, metaclass=abc.ABCMeta):
         List of updated Dataset objects.
         """
         updated_datasets = []
-        for dataset, timeseries, cluster, cluster_id in Dataset.yield_each_datasets_cluster(datasets):
-            clusters_assignment = self.load_clusters(dataset.name)
-            if cluster.shape[0] > max_nb_ts: # explode if too many time series
+        for dataset in datasets:
+            clusters_assignment = dataset.load_cassignment(self)
+            cids = clusters_assignment['Cluster ID'].to_numpy()
+            codes, _ = pd.factorize(cids)
+            Ntotal = np.bincount(codes)[codes] # size of each row's cluster
 
-                # select all rows of this cluster
-                rows = clusters_assignment.loc[clusters_assignment['Cluster ID'] == cluster_id]
-                
-                Ntotal = rows.shape[0]
-                Nsections = int(np.ceil(Ntotal / max_nb_ts))
-                # code taken from numpy "array_split" method
-                # source (last consulted 09.11.2021): https://numpy.org/doc/stable/reference/generated/numpy.array_split.html
-                Neach_section, extras = divmod(Ntotal, Nsections)
-                section_sizes = ([0] + extras * [Neach_section+1] + (Nsections-extras) * [Neach_section])
-                div_points = _nx.array(section_sizes, dtype=_nx.intp).cumsum()
-
-                # change the cid of each chunk of rows originally assigned to cluster_id's cluster
-                for i in range(Nsections):
-                    st = div_points[i]
-                    end = div_points[i + 1]
-                    clusters_assignment.at[rows[st:end].index.values, 'Cluster ID'] = cluster_id * 1000000 + i 
+            # rank of each row in its cluster (by order of appearance)
+            order = np.argsort(codes, kind='stable')
+            starts = np.concatenate([[0], np.cumsum(np.bincount(codes))[:-1]])
+            ranks = np.empty(len(codes), dtype=np.intp)
+            ranks[order] = np.arange(len(codes)) - starts[codes[order]]
+
+            # split each large cluster in chunks as numpy's "array_split" method would: the first "extras" chunks have one 
+            # more row than the others
+            # source (last consulted 09.11.2021): https://numpy.org/doc/stable/reference/generated/numpy.array_split.html
+            Nsections = np.ceil(Ntotal / max_nb_ts).astype(np.intp)
+            Neach_section, extras = np.divmod(Ntotal, Nsections)
+            nb_rows_in_larger_sections = extras * (Neach_section + 1)
+            sections = np.where(ranks < nb_rows_in_larger_sections, 
+                                ranks // (Neach_section + 1), 
+                                extras + (ranks - nb_rows_in_larger_sections) // np.maximum(Neach_section, 1))
+
+            # change the cid of each chunk of rows of the clusters with too many time series
+            to_explode = Ntotal > max_nb_ts
+            clusters_assignment.loc[to_explode, 'Cluster ID'] = cids[to_explode] * 1000000 + sections[to_explode]
                 
-            # save modified assignments to csv
+            # save modified assignments
             self.save_clusters(dataset, clusters_assignment)
             updated_datasets.append(dataset)
         return updated_datasets
\ No newline at end of file
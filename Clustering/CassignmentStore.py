@@ -0,0 +1,224 @@
+"""
+RecImpute - A Recommendation System of Imputation Techniques for Missing Values in Time Series,
+eXascale Infolab, University of Fribourg, Switzerland
+***
+CassignmentStore.py
+@author: @chacungu
+"""
+
+from contextlib import contextmanager
+import fcntl
+import json
+import numpy as np
+import os
+from os.path import normpath as normp
+import pandas as pd
+
+class CassignmentStore:
+    """
+    Stores the clusters' assignments of all data sets clustered by a clusterer in a single binary file. Each data set's
+    assignment is a contiguous block of (Time Series ID, Cluster ID) int64 pairs. An index file keeps the offset, the
+    number of rows and the version of each data set's block.
+    Updates append the new block to the data file and then atomically replace the index: readers never see a partially
+    written assignment. Blocks which are no longer referenced are dropped when the data file is compacted.
+    """
+
+    DTYPE = np.int64
+    COLUMNS = ['Time Series ID', 'Cluster ID']
+    COMPACTION_RATIO = 2 # the data file is compacted once it is this many times larger than its referenced blocks
+
+
+    # constructor
+
+    def __init__(self, filename_prefix):
+        """
+        Initializes a CassignmentStore object.
+
+        Keyword arguments:
+        filename_prefix -- path and prefix of the store's files
+        """
+        self.filename_prefix = filename_prefix
+        self.index_filename = filename_prefix + '_index.json'
+        self.lock_filename = filename_prefix + '.lock'
+        self._index = None
+        self._index_stat = None
+
+
+    # public methods
+
+    def contains(self, dataset_name):
+        """
+        Checks whether the store contains the clusters' assignment of the given data set.
+
+        Keyword arguments:
+        dataset_name -- name of the data set
+
+        Return:
+        True if the data set's clusters' assignment is stored, False otherwise
+        """
+        return dataset_name in self._get_index()['datasets']
+
+    def get_datasets_names(self):
+        """
+        Returns the names of the data sets whose clusters' assignment is stored.
+
+        Keyword arguments: -
+
+        Return:
+        List of the names of the data sets
+        """
+        return list(self._get_index()['datasets'].keys())
+
+    def get_version(self, dataset_name):
+        """
+        Returns the version of the given data set's clusters' assignment. The version changes each time the assignment is saved.
+
+        Keyword arguments:
+        dataset_name -- name of the data set
+
+        Return:
+        Version (int) of the data set's clusters' assignment or None if it is not stored
+        """
+        entry = self._get_index()['datasets'].get(dataset_name)
+        return entry['version'] if entry is not None else None
+
+    def load(self, dataset_name):
+        """
+        Loads the clusters' assignment of the given data set.
+
+        Keyword arguments:
+        dataset_name -- name of the data set
+
+        Return:
+        Pandas DataFrame containing clusters' assignment of the data set's time series. Two columns: Time Series ID, Cluster ID.
+        """
+        with self._lock(fcntl.LOCK_SH):
+            index = self._get_index()
+            entry = index['datasets'][dataset_name]
+            values = np.fromfile(self._get_data_filename(index), dtype=CassignmentStore.DTYPE,
+                                 count=entry['nb_rows'] * len(CassignmentStore.COLUMNS),
+                                 offset=entry['offset'] * np.dtype(CassignmentStore.DTYPE).itemsize)
+        return pd.DataFrame(values.reshape(entry['nb_rows'], len(CassignmentStore.COLUMNS)), columns=CassignmentStore.COLUMNS)
+
+    def save(self, dataset_name, cassignment):
+        """
+        Saves the clusters' assignment of the given data set. Replaces the previously saved assignment if any.
+
+        Keyword arguments:
+        dataset_name -- name of the data set
+        cassignment -- Pandas DataFrame containing clusters' assignment of the data set's time series. Two columns:
+                       Time Series ID, Cluster ID (both must be integers).
+
+        Return: -
+        """
+        values = np.ascontiguousarray(cassignment[CassignmentStore.COLUMNS].to_numpy(dtype=CassignmentStore.DTYPE))
+        with self._lock(fcntl.LOCK_EX):
+            index = self._get_index(force_reload=True)
+            offset = index['size']
+            with open(self._get_data_filename(index), 'ab') as f:
+                f.truncate(offset * values.itemsize) # drop any partially written block
+                f.write(values.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            index['datasets'][dataset_name] = {'offset': offset, 'nb_rows': values.shape[0], 'version': index['next_version']}
+            index['next_version'] += 1
+            index['size'] = offset + values.size
+            self._save_index(index)
+
+            nb_referenced_values = sum(e['nb_rows'] for e in index['datasets'].values()) * len(CassignmentStore.COLUMNS)
+            if index['size'] > CassignmentStore.COMPACTION_RATIO * nb_referenced_values:
+                self._compact(index)
+
+
+    # private methods
+
+    def _compact(self, index):
+        """
+        Rewrites the referenced blocks in a new data file and deletes the old one. Must be called while holding the
+        exclusive lock.
+
+        Keyword arguments:
+        index -- dict of the store's current index
+
+        Return: -
+        """
+        old_data_filename = self._get_data_filename(index)
+        new_index = {'generation': index['generation'] + 1, 'next_version': index['next_version'], 'size': 0, 'datasets': {}}
+        itemsize = np.dtype(CassignmentStore.DTYPE).itemsize
+        with open(old_data_filename, 'rb') as f_old, open(self._get_data_filename(new_index), 'wb') as f_new:
+            for dataset_name, entry in index['datasets'].items():
+                size = entry['nb_rows'] * len(CassignmentStore.COLUMNS)
+                f_old.seek(entry['offset'] * itemsize)
+                f_new.write(f_old.read(size * itemsize))
+                new_index['datasets'][dataset_name] = dict(entry, offset=new_index['size'])
+                new_index['size'] += size
+            f_new.flush()
+            os.fsync(f_new.fileno())
+        self._save_index(new_index) # the new data file is only used once the new index is saved
+        os.remove(old_data_filename)
+
+    def _get_data_filename(self, index):
+        """
+        Returns the filename of the data file referenced by the given index.
+
+        Keyword arguments:
+        index -- dict of the store's index
+
+        Return:
+        Filename of the store's data file
+        """
+        return normp(self.filename_prefix + '.%i.bin' % index['generation'])
+
+    def _get_index(self, force_reload=False):
+        """
+        Returns the store's index. The index is reloaded if its file changed since it was last read.
+
+        Keyword arguments:
+        force_reload -- if True, the index is read from its file even if it did not change (default False)
+
+        Return:
+        Dict with keys: generation, next_version, size (number of values written in the data file) and datasets (dict
+        with data sets' name as keys and, as values, a dict with keys: offset, nb_rows, version)
+        """
+        try:
+            stat = os.stat(self.index_filename)
+        except FileNotFoundError:
+            return {'generation': 0, 'next_version': 0, 'size': 0, 'datasets': {}}
+        stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if force_reload or self._index is None or stat != self._index_stat:
+            with open(self.index_filename, 'r') as f:
+                self._index = json.load(f)
+            self._index_stat = stat
+        return self._index
+
+    def _save_index(self, index):
+        """
+        Saves (atomically) the store's index.
+
+        Keyword arguments:
+        index -- dict of the store's index to save
+
+        Return: -
+        """
+        tmp_filename = self.index_filename + '.tmp%i' % os.getpid()
+        with open(tmp_filename, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_filename, self.index_filename)
+        self._index = None
+
+    @contextmanager
+    def _lock(self, operation):
+        """
+        Holds a lock on the store's files shared by all processes.
+
+        Keyword arguments:
+        operation -- fcntl.LOCK_SH for a shared (read) lock or fcntl.LOCK_EX for an exclusive (write) lock
+
+        Return: -
+        """
+        with open(self.lock_filename, 'a') as f:
+            fcntl.flock(f.fileno(), operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -6,9 +6,13 @@ ConFree_kClustering.py
 @author: @chacungu
 """
 
+from collections import deque
 import math
+from multiprocessing import Pool
 import numpy as np
+import os
 import pandas as pd
+import pickle
 
 def sklearn_kmeans_helper(k, X):
     from sklearn.cluster import KMeans
@@ -17,14 +21,16 @@ def sklearn_kmeans_helper(k, X):
 
 def cluster(clustering_algo, objective_function, data, 
             obj_thresh, init_obj_thresh, sim_cluster_thresh, centroid_dist_thresh,
-            k_perc=0.2, security_limit=5, max_iter=5000, id='data', apply_merging=True):
+            k_perc=0.2, security_limit=5, max_iter=5000, id='data', apply_merging=True, engine='pandas', nb_workers=0,
+            checkpoint_file=None, checkpoint_interval=25):
     """
     Clusters the given data iteratively.
     
     Keyword arguments:
     clustering_algo -- clustering method that takes as argument K (the objective number of clusters to form) and the samples to clusters. 
                        It returns the index of the cluster each sample belongs to (such as ScikitLearn's KMeans.fit_predict() method).
-    objective_function -- objective function to MAXIMIZE that retuns a single score (float)
+    objective_function -- objective function to MAXIMIZE that retuns a single score (float). It may also implement the methods
+                          of _ConcatObjective to let the merging phase update clusters' score and centroid incrementally.
     data -- list of lists or numpy ndarray or pandas dataframe that contains the data to cluster.
     obj_thresh -- if cluster has a score higher or equal than this, refinement of this data subset stops, cluster is valid and therefore is accepted 
     init_obj_thresh -- if original data has a score higher or equal than this, clustering is not necessary
@@ -36,6 +42,15 @@ def cluster(clustering_algo, objective_function, data,
     max_iter -- maximum number of iterations before a force-stop (default: 10000)
     id -- used to identify the data that is clustered in print messages (default 'data')
     apply_merging -- True if the merging phase should be used after the incremental clustering, False otherwise (default True)
+    engine -- 'pandas' to handle the data subsets as Pandas DataFrames during the incremental clustering, 'numpy' to handle 
+              them as arrays of positions into the data's matrix or 'parallel' to refine the data subsets in parallel
+              (default 'pandas'). The 'pandas' and 'numpy' engines return the same labels. The 'parallel' engine's labels are
+              deterministic under a seed but differ from the other engines' (see _iterative_clustering_parallel).
+    nb_workers -- number of workers used by the 'parallel' engine. If set to <= 0, all available cores are used (default 0).
+    checkpoint_file -- file in which the state of the clustering is saved regularly (default None, if None, no checkpoint is 
+                       saved). If this file contains the state of an interrupted clustering of the same data with the same 
+                       parameters, the clustering resumes from this state. The file is not removed once the clustering is done.
+    checkpoint_interval -- number of iterations of the incremental clustering between two checkpoints (default 25)
     
     Return: 
     List of labels: index of the cluster each sample belongs to
@@ -47,10 +62,31 @@ def cluster(clustering_algo, objective_function, data,
     else: raise TypeError('Invalid type for data.')
     
     nb_entries = data.shape[0]
+
+    checkpoint = _Checkpoint(checkpoint_file, checkpoint_interval, clustering_algo, params={
+        'index': data.index.tolist(), 'obj_thresh': obj_thresh, 'init_obj_thresh': init_obj_thresh, 
+        'k_perc': k_perc, 'security_limit': security_limit, 'max_iter': max_iter, 'engine': engine})
     
+    if checkpoint.state is not None and checkpoint.state['phase'] == 'merging':
+        # the incremental clustering of this data was done before the interruption
+        checkpoint.restore_random_state()
+        clusters = [data.iloc[positions] for positions in checkpoint.state['result']]
+
     # cluster iteratively the data using the clustering algorithm
-    clusters = _iterative_clustering(clustering_algo, objective_function, data, 
-                                     obj_thresh, init_obj_thresh, k_perc, security_limit, max_iter, id)
+    elif engine == 'numpy':
+        clusters = _iterative_clustering_np(clustering_algo, objective_function, data, 
+                                            obj_thresh, init_obj_thresh, k_perc, security_limit, max_iter, id, checkpoint)
+    elif engine == 'parallel':
+        clusters = _iterative_clustering_parallel(clustering_algo, objective_function, data, 
+                                                  obj_thresh, init_obj_thresh, k_perc, security_limit, max_iter, nb_workers, id,
+                                                  checkpoint)
+    elif engine == 'pandas':
+        clusters = _iterative_clustering(clustering_algo, objective_function, data, 
+                                         obj_thresh, init_obj_thresh, k_perc, security_limit, max_iter, id, checkpoint)
+    else: raise ValueError('Invalid engine: %s.' % engine)
+    if hasattr(objective_function, 'clear_cache'):
+        objective_function.clear_cache() # the scores of the subsets visited by the iterative clustering are not needed anymore
+    checkpoint.save(phase='merging', result=[data.index.get_indexer(cluster.index) for cluster in clusters])
 
     # merge clusters if score remains high
     if apply_merging:
@@ -68,7 +104,8 @@ def cluster(clustering_algo, objective_function, data,
     return list(labels)
 
 
-def _iterative_clustering(clustering_algo, objective_function, data, obj_threshold, init_obj_threshold, k_perc, security_limit, max_iter, id='data'):
+def _iterative_clustering(clustering_algo, objective_function, data, obj_threshold, init_obj_threshold, k_perc, security_limit, max_iter, id='data', 
+                          checkpoint=None):
     """
     Clusters the given data iteratively.
     
@@ -83,6 +120,7 @@ def _iterative_clustering(clustering_algo, objective_function, data, obj_thresho
     security_limit -- number of iterations without new valid cluster before "helping" the clustering algorithm
     max_iter -- maximum number of iterations before a force-stop
     id -- used to identify the data that is clustered in print messages (default 'data')
+    checkpoint -- _Checkpoint object in which the state of the clustering is saved regularly (default None)
     
     Return: 
     List of resulting clusters (each cluster is a Pandas DataFrame of data samples)
@@ -92,6 +130,12 @@ def _iterative_clustering(clustering_algo, objective_function, data, obj_thresho
     result = [] # contains the clusters that have been accepted
     security_count = 0
     iter_count = 0
+    if checkpoint is not None and checkpoint.state is not None:
+        # resume the interrupted clustering
+        checkpoint.restore_random_state()
+        stack = [data.iloc[positions] for positions in checkpoint.state['queue']]
+        result = [data.iloc[positions] for positions in checkpoint.state['result']]
+        security_count, iter_count = checkpoint.state['security_count'], checkpoint.state['iter_count']
     while len(stack) > 0:
 
         subdata = stack.pop()
@@ -137,17 +181,246 @@ def _iterative_clustering(clustering_algo, objective_function, data, obj_thresho
             print('Max iteration reached for %s! %i clusters did not meet all requirements yet.' % (id, len(stack)))
             result.extend(stack)
             break
+        if checkpoint is not None and checkpoint.is_due(iter_count):
+            checkpoint.save(phase='iterative', 
+                            queue=[data.index.get_indexer(subdata.index) for subdata in stack],
+                            result=[data.index.get_indexer(subdata.index) for subdata in result],
+                            security_count=security_count, iter_count=iter_count)
     print('clustering subroutine done for %s w/ %i iterations' % (id, iter_count))
     return result
 
+def _iterative_clustering_np(clustering_algo, objective_function, data, obj_threshold, init_obj_threshold, k_perc, security_limit, max_iter, id='data', 
+                             checkpoint=None):
+    """
+    Clusters the given data iteratively. Same as _iterative_clustering but the data subsets are arrays of positions into 
+    the data's matrix and the subsets which have not been handled yet are kept in a deque.
+    
+    Keyword arguments:
+    clustering_algo -- clustering method that takes as argument K (the objective number of clusters to form) and the samples to clusters
+                       (a Numpy ndarray). It returns the index of the cluster each sample belongs to.
+    objective_function -- objective function to MAXIMIZE that retuns a single score (float). If it has a method score_positions 
+                          (e.g. Clustering.CorrelationMatrixObjective), this method is given the positions of the samples to score.
+                          Otherwise, the objective function is given a Pandas DataFrame of the samples.
+    data -- pandas DataFrame of samples to cluster (each row is a sample)
+    obj_threshold -- if cluster has a score higher or equal than this, refinement of this data subset stops, cluster is valid and therefore is accepted 
+    init_obj_threshold -- if original data has a score higher or equal than this, clustering is not necessary
+    k_perc -- used to compute K by multiplying this percentage by the number of samples. Must be > 0.
+    security_limit -- number of iterations without new valid cluster before "helping" the clustering algorithm
+    max_iter -- maximum number of iterations before a force-stop
+    id -- used to identify the data that is clustered in print messages (default 'data')
+    checkpoint -- _Checkpoint object in which the state of the clustering is saved regularly (default None)
+    
+    Return: 
+    List of resulting clusters (each cluster is a Pandas DataFrame of data samples)
+    """
+    assert k_perc > 0
+    values = data.to_numpy() # matrix shared by all data subsets
+    score = objective_function.score_positions if hasattr(objective_function, 'score_positions') \
+            else lambda positions: objective_function(data.iloc[positions])
+    queue = deque([np.arange(data.shape[0])]) # contains the clusters that have not been handled yet
+    result = [] # contains the clusters that have been accepted
+    security_count = 0
+    iter_count = 0
+    if checkpoint is not None and checkpoint.state is not None:
+        # resume the interrupted clustering
+        checkpoint.restore_random_state()
+        queue, result = deque(checkpoint.state['queue']), checkpoint.state['result']
+        security_count, iter_count = checkpoint.state['security_count'], checkpoint.state['iter_count']
+    while len(queue) > 0:
+
+        positions = queue.pop()
+        assert len(positions) > 0
+
+        threshold = obj_threshold if iter_count > 0 else init_obj_threshold
+        if len(positions) == 1 or score(positions) >= threshold:
+            security_count = 0
+            # score is high enough: accept the cluster
+            result.append(positions)
+
+        elif len(positions) == 2:
+            security_count = 0
+            # accept the two remaining samples as individual clusters
+            result.append(positions[:1])
+            result.append(positions[1:])
+
+        else:
+            # score in this cluster is not high enough: cluster
+            security_count += 1
+
+            K = max(2, math.floor(len(positions) * k_perc))
+            if security_count >= 15 * security_limit: 
+                # even with help the clustering algo couldn't create valid clusters for too many iterations
+                # manually split the current cluster in 2 hoping it unstucks the algorithms
+                queue.appendleft(positions[0::2])
+                queue.appendleft(positions[1::2])
+
+            else:
+                if security_count >= security_limit: 
+                    # the clustering algo is having difficulties creating clusters that match the criteria
+                    # to unstuck it, increase K to help create valid clusters
+                    K += (security_count // (security_limit-1)) * K
+                    K = min(len(positions), K)
+                
+                labels = np.asarray(clustering_algo(K, values[positions]))
+                for cluster_samples_ids in _group_by_label(labels):
+                    queue.appendleft(positions[cluster_samples_ids])
+        iter_count += 1
+        if iter_count >= max_iter:
+            print('Max iteration reached for %s! %i clusters did not meet all requirements yet.' % (id, len(queue)))
+            result.extend(queue)
+            break
+        if checkpoint is not None and checkpoint.is_due(iter_count):
+            checkpoint.save(phase='iterative', queue=list(queue), result=result, 
+                            security_count=security_count, iter_count=iter_count)
+    print('clustering subroutine done for %s w/ %i iterations' % (id, iter_count))
+    return [data.iloc[positions] for positions in result]
+
+def _iterative_clustering_parallel(clustering_algo, objective_function, data, obj_threshold, init_obj_threshold, k_perc, security_limit, max_iter, nb_workers, id='data', 
+                                   checkpoint=None):
+    """
+    Clusters the given data iteratively. The data subsets are independent: all the subsets pending in the queue (a "wave") are 
+    scored and those which must be refined are dispatched to a pool of workers sharing the data's matrix. The resulting 
+    subsets form the next wave.
+    To keep the results deterministic under a seed: the security count is tracked per subtree (a subset inherits the count
+    of the subset it has been split from), the clustering algorithm is seeded with a seed derived from the subset's path in
+    the tree of splits, and the iteration budget is consumed in the waves' order.
+    
+    Keyword arguments:
+    clustering_algo -- clustering method that takes as argument K (the objective number of clusters to form) and the samples to clusters
+                       (a Numpy ndarray). It returns the index of the cluster each sample belongs to. Must be picklable.
+    objective_function -- objective function to MAXIMIZE that retuns a single score (float). If it has a method score_positions 
+                          (e.g. Clustering.CorrelationMatrixObjective), this method is given the positions of the samples to score.
+                          Otherwise, the objective function is given a Pandas DataFrame of the samples.
+    data -- pandas DataFrame of samples to cluster (each row is a sample)
+    obj_threshold -- if cluster has a score higher or equal than this, refinement of this data subset stops, cluster is valid and therefore is accepted 
+    init_obj_threshold -- if original data has a score higher or equal than this, clustering is not necessary
+    k_perc -- used to compute K by multiplying this percentage by the number of samples. Must be > 0.
+    security_limit -- number of successive refinements of a subtree before "helping" the clustering algorithm
+    max_iter -- maximum number of iterations before a force-stop
+    nb_workers -- number of workers. If set to <= 0, all available cores are used.
+    id -- used to identify the data that is clustered in print messages (default 'data')
+    checkpoint -- _Checkpoint object in which the state of the clustering is saved regularly (after a wave) (default None)
+    
+    Return: 
+    List of resulting clusters (each cluster is a Pandas DataFrame of data samples)
+    """
+    assert k_perc > 0
+    values = data.to_numpy() # matrix shared by all data subsets and workers
+    score = objective_function.score_positions if hasattr(objective_function, 'score_positions') \
+            else lambda positions: objective_function(data.iloc[positions])
+    root_seed = np.random.randint(2**31 - 1)
+    queue = deque([(np.arange(data.shape[0]), 0, ())]) # pending subsets: (positions, security count, path in the tree of splits)
+    result = [] # contains the clusters that have been accepted
+    iter_count = 0
+    if checkpoint is not None and checkpoint.state is not None:
+        # resume the interrupted clustering
+        checkpoint.restore_random_state()
+        root_seed, queue, result = checkpoint.state['root_seed'], deque(checkpoint.state['queue']), checkpoint.state['result']
+        iter_count = checkpoint.state['iter_count']
+    with Pool(processes=nb_workers if nb_workers > 0 else None, initializer=_init_worker, initargs=(values, clustering_algo)) as p:
+        while len(queue) > 0 and iter_count < max_iter:
+            wave = [queue.pop() for _ in range(min(len(queue), max_iter - iter_count))]
+            tasks = [] # subsets to refine with the clustering algorithm: (positions, security count, path, K)
+            for positions, security_count, path in wave:
+
+                threshold = obj_threshold if iter_count > 0 else init_obj_threshold
+                if len(positions) == 1 or score(positions) >= threshold:
+                    # score is high enough: accept the cluster
+                    result.append(positions)
+
+                elif len(positions) == 2:
+                    # accept the two remaining samples as individual clusters
+                    result.append(positions[:1])
+                    result.append(positions[1:])
+
+                else:
+                    # score in this cluster is not high enough: cluster
+                    security_count += 1
+
+                    K = max(2, math.floor(len(positions) * k_perc))
+                    if security_count >= 15 * security_limit: 
+                        # even with help the clustering algo couldn't create valid clusters for too many iterations
+                        # manually split the current cluster in 2 hoping it unstucks the algorithms
+                        queue.appendleft((positions[0::2], security_count, path + (0,)))
+                        queue.appendleft((positions[1::2], security_count, path + (1,)))
+
+                    else:
+                        if security_count >= security_limit: 
+                            # the clustering algo is having difficulties creating clusters that match the criteria
+                            # to unstuck it, increase K to help create valid clusters
+                            K += (security_count // (security_limit-1)) * K
+                            K = min(len(positions), K)
+                        tasks.append((positions, security_count, path, K))
+                iter_count += 1
+
+            seeds = [np.random.SeedSequence(root_seed, spawn_key=path).generate_state(1)[0] for _, _, path, _ in tasks]
+            all_labels = p.map(_cluster_subset, [(K, positions, seed) for (positions, _, _, K), seed in zip(tasks, seeds)])
+            for (positions, security_count, path, _), labels in zip(tasks, all_labels):
+                for i, cluster_samples_ids in enumerate(_group_by_label(labels)):
+                    queue.appendleft((positions[cluster_samples_ids], security_count, path + (i,)))
+            if checkpoint is not None and checkpoint.is_due(iter_count):
+                checkpoint.save(phase='iterative', root_seed=root_seed, queue=list(queue), result=result, iter_count=iter_count)
+
+    if len(queue) > 0:
+        print('Max iteration reached for %s! %i clusters did not meet all requirements yet.' % (id, len(queue)))
+        result.extend(positions for positions, _, _ in queue)
+    print('clustering subroutine done for %s w/ %i iterations' % (id, iter_count))
+    return [data.iloc[positions] for positions in result]
+
+def _init_worker(values, clustering_algo):
+    """
+    Initializes a worker of the 'parallel' engine.
+    
+    Keyword arguments:
+    values -- Numpy ndarray of the data's matrix (each row is a sample)
+    clustering_algo -- clustering method that takes as argument K and the samples to clusters (a Numpy ndarray)
+    
+    Return: -
+    """
+    global _worker_values, _worker_clustering_algo
+    _worker_values, _worker_clustering_algo = values, clustering_algo
+
+def _cluster_subset(args):
+    """
+    Clusters a data subset in a worker of the 'parallel' engine.
+    
+    Keyword arguments:
+    args -- tuple: K (the objective number of clusters to form), Numpy array of the subset's positions in the data's matrix,
+            seed of the random number generator
+    
+    Return:
+    Numpy array of labels: index of the cluster each sample belongs to
+    """
+    K, positions, seed = args
+    np.random.seed(seed)
+    return np.asarray(_worker_clustering_algo(K, _worker_values[positions]))
+
+def _group_by_label(labels):
+    """
+    Groups the samples by label.
+    
+    Keyword arguments:
+    labels -- Numpy array of labels: index of the cluster each sample belongs to
+    
+    Return:
+    List of Numpy arrays: positions of the samples of each label (by ascending order of label)
+    """
+    order = np.argsort(labels, kind='stable')
+    return np.split(order, np.flatnonzero(np.diff(labels[order])) + 1)
+
 def _merging(clusters, objective_function, nb_entries, sim_cluster_thresh, centroid_dist_thresh):
     """
-    Merges clusters if the objective function score remains high enough.
+    Merges clusters if the objective function score remains high enough. Each cluster is represented by its sufficient 
+    statistics (see _ConcatObjective): testing and applying a merge or the move of a sample update the clusters' score and
+    centroid from their statistics. The similarities of pairs of centroids are kept in a matrix: a row is measured at once
+    (for the pairs which have not been measured yet) and a merge or a move only invalidates the rows and columns of the
+    updated clusters.
     
     Keyword arguments:
     clusters -- list of resulting clusters (each cluster is a Pandas DataFrame of data samples)
     objective_function -- objective function to MAXIMIZE that is given a cluster (a Pandas DataFrame of data samples) and retuns a 
-                          single score (float)
+                          single score (float). If it does not implement the sufficient statistics' methods of _ConcatObjective,
+                          it is wrapped in a _ConcatObjective.
     nb_entries -- number of entries in the dataset the cluster belongs to
     sim_cluster_thresh -- score btw centroids of two clusters must be above this to consider them "similar" and consider merging
     centroid_dist_thresh -- score btw a sample and its current cluster's centroid must greater than this to consider moving the 
@@ -156,30 +429,47 @@ def _merging(clusters, objective_function, nb_entries, sim_cluster_thresh, centr
     Return:
     Updated clusters: list of updated clusters (each cluster is a Pandas DataFrame of data samples)
     """
-    clusters = dict(zip(range(0, len(clusters)), clusters))
+    objective = objective_function if hasattr(objective_function, 'get_statistics') else _ConcatObjective(objective_function)
+    clusters = {cid: objective.get_statistics(cluster_samples) for cid, cluster_samples in enumerate(clusters)}
     
     # init: compute a centroid for each cluster as well as the score inside each cluster
     all_centroids, all_scores = {}, {}
-    for cid, cluster_samples in clusters.items():
-        all_centroids[cid] = cluster_samples.mean().to_frame().T
-        all_scores[cid] = objective_function(cluster_samples)
+    for cid, cluster_stats in clusters.items():
+        all_centroids[cid] = objective.get_centroid(cluster_stats)
+        all_scores[cid] = objective.score_statistics(cluster_stats)
+
+    # similarities btw pairs of centroids (clusters' ID are their row/column in the matrix)
+    centroids_values = np.vstack([all_centroids[cid].to_numpy() for cid in clusters.keys()])
+    similarities = np.empty((len(clusters), len(clusters)))
+    measured = np.zeros((len(clusters), len(clusters)), dtype=bool)
+    def get_similarities(cid):
+        other_cids = np.fromiter(clusters.keys(), dtype=int)
+        other_cids = other_cids[~measured[cid, other_cids]]
+        if len(other_cids) > 0:
+            similarities[cid, other_cids] = similarities[other_cids, cid] = \
+                objective.score_pairs(centroids_values[cid:cid+1], centroids_values[other_cids])[0]
+            measured[cid, other_cids] = measured[other_cids, cid] = True
+        return similarities[cid]
+    def update_similarities(updated_cid):
+        centroids_values[updated_cid] = all_centroids[updated_cid].to_numpy()[0]
+        measured[updated_cid, :] = measured[:, updated_cid] = False
 
     # for each cluster
     for cid in list(clusters.keys()):
-        # retrieve the cluster's samples and centroid
-        cluster_samples = clusters[cid]
-        centroid = all_centroids[cid]
+        # retrieve the cluster's samples
+        cluster_stats = clusters[cid]
 
-        # compute the score btw the cluster's centroid and all other clusters' centroid and identify a list of similar clusters
-        is_cluster_similar = lambda other_cid: \
-                                other_cid != cid and \
-                                objective_function(pd.concat([centroid, all_centroids[other_cid]])) >= sim_cluster_thresh
-        similar_clusters_ids = [other_cid for other_cid in clusters.keys() if is_cluster_similar(other_cid)]
+        # identify a list of clusters whose centroid is similar to the cluster's centroid
+        cid_similarities = get_similarities(cid)
+        similar_clusters_ids = [other_cid for other_cid in clusters.keys() 
+                                if other_cid != cid and cid_similarities[other_cid] >= sim_cluster_thresh]
 
-        res = _merging_subroutine(objective_function, clusters, cluster_samples, cid, similar_clusters_ids, 
+        res = _merging_subroutine(objective, clusters, cluster_stats, cid, similar_clusters_ids, 
                                   nb_entries, all_scores, all_centroids)
-        merged, clusters, all_centroids, all_scores = res
+        merged_cid, clusters, all_centroids, all_scores = res
+        merged = merged_cid is not None
         if merged:
+            update_similarities(merged_cid)
             del clusters[cid]
             del all_centroids[cid]
             del all_scores[cid]
@@ -187,24 +477,25 @@ def _merging(clusters, objective_function, nb_entries, sim_cluster_thresh, centr
         # ---
         # we did not found a valid candidate (cluster) to merge with
         # try to move the samples that are the farthest from the cluster's centroid to other clusters
-        if not merged and cluster_samples.shape[0] > 1:
+        if not merged and cluster_stats['count'] > 1:
             # identify samples that are "far away" from their cluster's centroid
-            is_far_from_centroid = lambda item: \
-                                        objective_function(pd.concat([centroid, 
-                                                                      item[1].to_frame().T])) < centroid_dist_thresh
-            farthest_samples = filter(is_far_from_centroid, cluster_samples.iterrows())
-
-            for sid, sample in farthest_samples:
+            cluster_samples = objective.get_samples(cluster_stats)
+            centroid_scores = objective.score_pairs(centroids_values[cid:cid+1], cluster_samples.to_numpy())[0]
+            farthest_samples = np.flatnonzero(centroid_scores < centroid_dist_thresh)
 
-                res = _merging_subroutine(objective_function, clusters, sample.to_frame().T, cid, filter(lambda id: id != cid, clusters.keys()), 
+            for i in farthest_samples:
+                sample_stats = objective.get_statistics(cluster_samples.iloc[[i]])
+                res = _merging_subroutine(objective, clusters, sample_stats, cid, filter(lambda id: id != cid, clusters.keys()), 
                                           nb_entries, all_scores, all_centroids)
-                merged, clusters, all_centroids, all_scores = res
-                if merged: 
+                merged_cid, clusters, all_centroids, all_scores = res
+                if merged_cid is not None: 
                     # 1 ts has been moved -> update
-                    clusters[cid] = clusters[cid].drop(sid)
-                    if clusters[cid].shape[0] > 0:
-                        all_centroids[cid] = clusters[cid].mean().to_frame().T
-                        all_scores[cid] = objective_function(clusters[cid])
+                    update_similarities(merged_cid)
+                    clusters[cid] = objective.remove_statistics(clusters[cid], sample_stats)
+                    if clusters[cid]['count'] > 0:
+                        all_centroids[cid] = objective.get_centroid(clusters[cid])
+                        all_scores[cid] = objective.score_statistics(clusters[cid])
+                        update_similarities(cid)
                     else:
                         # no samples are left in the cluster: delete it
                         del clusters[cid]
@@ -212,73 +503,325 @@ def _merging(clusters, objective_function, nb_entries, sim_cluster_thresh, centr
                         del all_scores[cid]
                 
             
-    return list(clusters.values())
+    return [objective.get_samples(cluster_stats) for cluster_stats in clusters.values()]
 
-def correlation_gain(objective_function, clusters, sample_to_merge, cid, other_cid, nb_entries, all_scores):
+def correlation_gain(phi_union, phi_i, phi_j, nb_entries):
     """
     Computes the correlation gain of merging/moving a cluster/sequence with/to a different cluster.
     
     Keyword arguments:
-    objective_function -- objective function to MAXIMIZE. Takes a cluster (a Pandas DataFrame of data samples) and retuns a 
-                          single score (float)
-    clusters -- list of clusters (each cluster is a Pandas DataFrame of samples)
-    sample_to_merge -- Pandas DataFrame containing the single sample to try merging
-    cid -- id of the clusters from which the sample_to_merge is originating
-    other_cid -- id of the other cluster that is a candidate for the merge
+    phi_union -- objective function's score of the union of the samples to merge and the other cluster (float or Numpy array
+                 of the scores of the unions with several other clusters)
+    phi_i -- objective function's score of the cluster from which the samples to merge are originating
+    phi_j -- objective function's score of the other cluster (float or Numpy array of the scores of several other clusters)
     nb_entries -- number of entries in the dataset the cluster belongs to
-    all_scores -- dict with keys being clusters 'id and values their current objective function's score
     
     Return:
-    Correlation gain.
+    Correlation gain (float or Numpy array of the correlation gains with the other clusters).
     """
-    phi_union = objective_function(pd.concat([sample_to_merge, clusters[other_cid]]))
-    phi_i = all_scores[cid]
-    phi_j = all_scores[other_cid]
     corr_gain = (1 / (2*nb_entries)) * (phi_union - ((phi_i * phi_j) / nb_entries))
     return corr_gain
 
-def _merging_subroutine(objective_function, clusters, samples_to_merge, cid, other_clusters_ids, nb_entries, all_scores, all_centroids):
+def _merging_subroutine(objective, clusters, stats_to_merge, cid, other_clusters_ids, nb_entries, all_scores, all_centroids):
     """
     Searches for a cluster to merge the given samples with.
     
     Keyword arguments:
-    objective_function -- objective function to MAXIMIZE that is given a cluster (a Pandas DataFrame of data samples) and retuns a 
-                          single score (float)
-    clusters -- list of clusters (each cluster is a Pandas DataFrame of samples)
-    samples_to_merge -- Pandas DataFrame of samples to try merging (each row is a sample)
-    cid -- id of the clusters from which the samples_to_merge are originating
+    objective -- objective function to MAXIMIZE implementing the sufficient statistics' methods of _ConcatObjective
+    clusters -- dict with keys being clusters' id and values their sufficient statistics
+    stats_to_merge -- sufficient statistics of the samples to try merging
+    cid -- id of the clusters from which the samples to merge are originating
     other_clusters_ids -- list of other clusters' ID that are candidates for a merge
     nb_entries -- number of entries in the dataset the cluster belongs to
     all_scores -- dict with keys being clusters 'id and values their current objective function's score
     all_centroids -- dict with keys being clusters 'id and values their current centroid
     
     Return:
-    1. True if a merged occured, False otherwise
-    2. Updated clusters: list of updated clusters (each cluster is a Pandas DataFrame of samples)
+    1. ID of the cluster the samples have been merged with, None if no merge occured
+    2. Updated clusters: dict with keys being clusters' id and values their sufficient statistics
     3. Updated all_scores
     4. Updated all_centroids
     """
-    best_corr_gain, best_cid = 0, None
-    # for each cluster
-    for other_cid in other_clusters_ids:
-        corr_gain = correlation_gain(objective_function, clusters, samples_to_merge, cid, other_cid, nb_entries, all_scores)
-        # is this other cluster the best candidate yet for merging?
-        if corr_gain > best_corr_gain:
-            best_corr_gain = corr_gain
-            best_cid = other_cid
+    best_cid = None
+    other_clusters_ids = list(other_clusters_ids)
+    if len(other_clusters_ids) > 0:
+        # compute the correlation gain of merging with each cluster at once
+        phi_union = objective.score_merges(stats_to_merge, [clusters[other_cid] for other_cid in other_clusters_ids])
+        phi_j = np.array([all_scores[other_cid] for other_cid in other_clusters_ids])
+        corr_gains = correlation_gain(phi_union, all_scores[cid], phi_j, nb_entries)
+        corr_gains[np.isnan(corr_gains)] = -np.inf
+        # the best candidate is the first cluster with the largest positive gain
+        best_idx = corr_gains.argmax()
+        if corr_gains[best_idx] > 0:
+            best_cid = other_clusters_ids[best_idx]
 
     # merge with the best candidate (if we found one)
-    merged = False
     if best_cid != None:
-        merged = True
         # merge samples with the best_cid's cluster
-        merged_cluster_samples = pd.concat([samples_to_merge, clusters[best_cid]])
-        clusters[best_cid] = merged_cluster_samples
-        all_centroids[best_cid] = merged_cluster_samples.mean().to_frame().T
-        all_scores[best_cid] = objective_function(merged_cluster_samples)
+        union_stats = objective.merge_statistics(stats_to_merge, clusters[best_cid])
+        clusters[best_cid] = union_stats
+        all_centroids[best_cid] = objective.get_centroid(union_stats)
+        all_scores[best_cid] = objective.score_statistics(union_stats)
+
+    return best_cid, clusters, all_centroids, all_scores
+
+def _get_centroid(cluster_samples):
+    """
+    Computes the centroid of a cluster. The centroid's index is 'centroid' such that it cannot be mistaken for a sample.
+    
+    Keyword arguments:
+    cluster_samples -- Pandas DataFrame of the cluster's samples (each row is a sample)
+    
+    Return:
+    Pandas DataFrame containing the cluster's centroid as single row
+    """
+    return cluster_samples.mean().to_frame('centroid').T
+
+
+class _ConcatObjective:
+    """
+    Wraps an objective function which is only given clusters (Pandas DataFrames of data samples). The sufficient statistics
+    of a cluster are its samples and their count: merging clusters concatenates their samples and scores are measured by the 
+    objective function. Objective functions able to update the score and the centroid of a cluster incrementally implement 
+    these same methods with statistics that also have a 'count' key (e.g. Clustering.CorrelationMatrixObjective). 
+    score_pairs(samples, other_samples) is given two Numpy ndarrays of samples and returns the matrix of the scores of all 
+    pairs (sample, other sample). score_merges(stats, all_other_stats) returns the scores of the unions of a cluster with
+    each of the other clusters.
+    """
+
+    # constructor
+
+    def __init__(self, objective_function):
+        """
+        Initializes a _ConcatObjective object.
+        
+        Keyword arguments:
+        objective_function -- objective function to MAXIMIZE that takes a Pandas DataFrame of data samples (each row is a 
+                              sample) and returns a single score (float)
+        """
+        self.objective_function = objective_function
+
+
+    # public methods
+
+    def __call__(self, samples):
+        """
+        Measures the score of the given samples with the objective function.
+        
+        Keyword arguments:
+        samples -- Pandas DataFrame of data samples (each row is a sample)
+        
+        Return:
+        Score of the samples (float)
+        """
+        return self.objective_function(samples)
+
+    def score_pairs(self, samples, other_samples):
+        """
+        Measures the score of all pairs made of one sample and one other sample (e.g. clusters' centroids).
+        
+        Keyword arguments:
+        samples -- Numpy ndarray of samples (each row is a sample)
+        other_samples -- Numpy ndarray of other samples (each row is a sample)
+        
+        Return:
+        Numpy ndarray (nb samples x nb other samples) of the scores of the pairs
+        """
+        return np.array([[self.objective_function(pd.DataFrame(np.vstack([sample, other_sample]))) 
+                          for other_sample in other_samples] for sample in samples])
+
+    def get_statistics(self, samples):
+        """
+        Computes the sufficient statistics of a cluster.
+        
+        Keyword arguments:
+        samples -- Pandas DataFrame of the cluster's samples (each row is a sample)
+        
+        Return:
+        Dict with keys: samples (Pandas DataFrame of the cluster's samples) and count (number of samples)
+        """
+        return {'samples': samples, 'count': samples.shape[0]}
+
+    def merge_statistics(self, stats, other_stats):
+        """
+        Computes the sufficient statistics of the union of two disjoint clusters by concatenating their samples.
+        
+        Keyword arguments:
+        stats -- dict of the first cluster's sufficient statistics (see get_statistics)
+        other_stats -- dict of the second cluster's sufficient statistics (see get_statistics)
+        
+        Return:
+        Dict of the union's sufficient statistics (see get_statistics)
+        """
+        return self.get_statistics(pd.concat([stats['samples'], other_stats['samples']]))
+
+    def score_merges(self, stats, all_other_stats):
+        """
+        Measures the score of the unions of a cluster with each of the given other clusters.
+        
+        Keyword arguments:
+        stats -- dict of the cluster's sufficient statistics (see get_statistics)
+        all_other_stats -- list of dicts of the other clusters' sufficient statistics (see get_statistics)
+        
+        Return:
+        Numpy array of the scores of the unions
+        """
+        return np.array([self.score_statistics(self.merge_statistics(stats, other_stats)) for other_stats in all_other_stats])
+
+    def remove_statistics(self, stats, removed_stats):
+        """
+        Computes the sufficient statistics of a cluster once some of its samples have been removed.
+        
+        Keyword arguments:
+        stats -- dict of the cluster's sufficient statistics (see get_statistics)
+        removed_stats -- dict of the sufficient statistics of the samples to remove (see get_statistics)
+        
+        Return:
+        Dict of the remaining samples' sufficient statistics (see get_statistics)
+        """
+        return self.get_statistics(stats['samples'].drop(removed_stats['samples'].index))
+
+    def score_statistics(self, stats):
+        """
+        Measures the score of a cluster from its sufficient statistics.
+        
+        Keyword arguments:
+        stats -- dict of the cluster's sufficient statistics (see get_statistics)
+        
+        Return:
+        Score of the cluster's samples (float)
+        """
+        return self.objective_function(stats['samples'])
+
+    def get_centroid(self, stats):
+        """
+        Returns the centroid of a cluster from its sufficient statistics.
+        
+        Keyword arguments:
+        stats -- dict of the cluster's sufficient statistics (see get_statistics)
+        
+        Return:
+        Pandas DataFrame containing the cluster's centroid as single row (see _get_centroid)
+        """
+        return _get_centroid(stats['samples'])
+
+    def get_samples(self, stats):
+        """
+        Returns the samples of a cluster.
+        
+        Keyword arguments:
+        stats -- dict of the cluster's sufficient statistics (see get_statistics)
+        
+        Return:
+        Pandas DataFrame of the cluster's samples (each row is a sample)
+        """
+        return stats['samples']
+
+
+class _Checkpoint:
+    """
+    Durable state of a clustering: the subsets which have not been handled yet, the accepted clusters (as positions of their
+    samples in the data), the counters of the incremental clustering and the state of the random number generators. The 
+    state is saved atomically (written to a temporary file, flushed to disk and renamed) such that an interrupted clustering
+    can resume from its last checkpoint. A checkpoint saved with other parameters or other data is ignored.
+    """
+
+    # constructor
+
+    def __init__(self, filename, interval, clustering_algo, params):
+        """
+        Initializes a _Checkpoint object and loads the state saved in the checkpoint's file if there is one.
+        
+        Keyword arguments:
+        filename -- path to the checkpoint's file (None to disable checkpointing)
+        interval -- minimal number of iterations of the incremental clustering between two checkpoints
+        clustering_algo -- clustering algorithm; if it has get_state/set_state methods, its state is saved and restored
+        params -- picklable parameters and data of the clustering; a checkpoint saved with other params is ignored
+        """
+        self.filename = filename
+        self.interval = interval
+        self.clustering_algo = clustering_algo
+        self.params = params
+        self.state = self._load()
+        self._last_iter_count = self.state.get('iter_count', 0) if self.state is not None else 0
+
+
+    # public methods
+
+    def is_due(self, iter_count):
+        """
+        Checks whether a checkpoint should be saved.
+        
+        Keyword arguments:
+        iter_count -- current number of iterations of the incremental clustering
+        
+        Return:
+        True if checkpointing is enabled and at least "interval" iterations have been done since the last checkpoint
+        """
+        return self.filename is not None and iter_count - self._last_iter_count >= self.interval
+
+    def save(self, **state):
+        """
+        Saves the given state atomically to the checkpoint's file, along with the parameters and the state of the random 
+        number generators. Does nothing if checkpointing is disabled.
+        
+        Keyword arguments:
+        state -- picklable state of the clustering (e.g. phase, subsets, clusters, iter_count)
+        
+        Return: -
+        """
+        if self.filename is None:
+            return
+        state['params'] = self.params
+        state['random_state'] = np.random.get_state()
+        state['clustering_algo_state'] = self.clustering_algo.get_state() if hasattr(self.clustering_algo, 'get_state') else None
+        tmp_filename = self.filename + '.tmp%i' % os.getpid()
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.filename)
+        self._last_iter_count = state.get('iter_count', self._last_iter_count)
+
+    def restore_random_state(self):
+        """
+        Restores the state of the random number generators (Numpy's and the clustering algorithm's) saved in the loaded 
+        checkpoint such that the resumed clustering draws the same random numbers as an uninterrupted one.
+        
+        Keyword arguments: -
+        
+        Return: -
+        """
+        np.random.set_state(self.state['random_state'])
+        if self.state['clustering_algo_state'] is not None:
+            self.clustering_algo.set_state(self.state['clustering_algo_state'])
+
 
-    return merged, clusters, all_centroids, all_scores
+    # private methods
 
+    def _load(self):
+        """
+        Loads the state saved in the checkpoint's file.
+        
+        Keyword arguments: -
+        
+        Return:
+        Dict of the saved state. None if checkpointing is disabled, if the file does not exist or cannot be read, or if 
+        it was saved with other parameters.
+        """
+        if self.filename is None or not os.path.exists(self.filename):
+            return None
+        try:
+            with open(self.filename, 'rb') as f:
+                state = pickle.load(f)
+        except (EOFError, pickle.UnpicklingError) as e:
+            print('Checkpoint %s ignored: it could not be read (%s).' % (self.filename, e))
+            return None
+        if state['params'] != self.params:
+            print('Checkpoint %s ignored: it was saved with other parameters or data.' % self.filename)
+            return None
+        print('Resuming the clustering from checkpoint %s (%s phase).' % (self.filename, state['phase']))
+        return state
 
 
 if __name__ == "__main__":
@@ -0,0 +1,271 @@
+"""
+RecImpute - A Recommendation System of Imputation Techniques for Missing Values in Time Series,
+eXascale Infolab, University of Fribourg, Switzerland
+***
+CorrelationMatrixObjective.py
+@author: @chacungu
+"""
+
+import numpy as np
+import pandas as pd
+
+class CorrelationMatrixObjective:
+    """
+    Objective function measuring the average correlation of a subset of a data set's time series. The correlation matrix of
+    all the data set's time series is computed once: a subset is scored by summing its submatrix.
+    Clusters can also be represented by sufficient statistics (positions of their time series, count, sum vector and sum of
+    their pairwise correlations): adding, removing or merging time series then updates a cluster's score and centroid 
+    without copying nor concatenating its time series.
+    Samples which are not time series of the data set (e.g. clusters' centroids) are scored with np.corrcoef.
+    """
+
+
+    # constructor
+
+    def __init__(self, timeseries, offset=0):
+        """
+        Initializes a CorrelationMatrixObjective object.
+
+        Keyword arguments:
+        timeseries -- Pandas DataFrame containing the data set's time series (each row is a time series)
+        offset -- value added to every score (default 0)
+        """
+        self.index = timeseries.index
+        self.columns = timeseries.columns
+        self.offset = offset
+        self._values = timeseries.to_numpy()
+        self._corr_matrix = np.corrcoef(self._values, rowvar=True)
+        self._sums = {} # subset of positions -> sum of the subset's correlations (diagonal excluded)
+
+
+    # public methods
+
+    def __call__(self, samples):
+        """
+        Measures the average correlation of the given time series.
+
+        Keyword arguments:
+        samples -- Pandas DataFrame containing the time series (each row is a time series)
+
+        Return:
+        Average correlation for all pairs of time series + offset (1.0 + offset if there are less than 2 time series)
+        """
+        if samples.shape[0] < 2:
+            return 1.0 + self.offset
+        positions = self._get_positions(samples)
+        if positions is None:
+            return self._get_mean_corr(samples) + self.offset
+        return self.score_positions(positions)
+
+    def score_positions(self, positions):
+        """
+        Measures the average correlation of the time series at the given positions in the data set.
+
+        Keyword arguments:
+        positions -- Numpy array of the time series' positions in the data set
+
+        Return:
+        Average correlation for all pairs of time series + offset (1.0 + offset if there are less than 2 time series)
+        """
+        if len(positions) < 2:
+            return 1.0 + self.offset
+        return self._get_sum(positions) / (len(positions) * (len(positions) - 1)) + self.offset
+
+    def score_pairs(self, samples, other_samples):
+        """
+        Measures the correlation of all pairs made of one sample and one other sample (e.g. clusters' centroids).
+
+        Keyword arguments:
+        samples -- Numpy ndarray of samples (each row is a sample)
+        other_samples -- Numpy ndarray of other samples (each row is a sample)
+
+        Return:
+        Numpy ndarray (nb samples x nb other samples) of the correlations + offset
+        """
+        standardized, other_standardized = self._standardize(samples), self._standardize(other_samples)
+        return np.clip(standardized @ other_standardized.T, -1, 1) + self.offset
+
+    def clear_cache(self):
+        """
+        Forgets the cached sums of the subsets scored so far. The cache keeps one entry per scored subset: it should be 
+        cleared once the subsets are not scored again (e.g. after the iterative phase of the clustering).
+
+        Keyword arguments: -
+
+        Return: -
+        """
+        self._sums = {}
+
+    def get_statistics(self, samples):
+        """
+        Computes the sufficient statistics of a cluster.
+
+        Keyword arguments:
+        samples -- Pandas DataFrame containing the cluster's time series (each row is a time series of the data set)
+
+        Return:
+        Dict with keys: positions (Numpy array of the time series' positions in the data set), count, sum (Numpy array of
+        the sum of the time series) and pairs_sum (sum of the correlations of all ordered pairs of distinct time series)
+        """
+        positions = self._get_positions(samples)
+        return {'positions': positions, 'count': len(positions), 
+                'sum': self._values[positions].sum(axis=0), 'pairs_sum': self._get_sum(positions)}
+
+    def merge_statistics(self, stats, other_stats):
+        """
+        Computes the sufficient statistics of the union of two disjoint clusters.
+
+        Keyword arguments:
+        stats -- dict of the first cluster's sufficient statistics (see get_statistics)
+        other_stats -- dict of the second cluster's sufficient statistics (see get_statistics)
+
+        Return:
+        Dict of the union's sufficient statistics (see get_statistics)
+        """
+        cross_sum = self._corr_matrix[np.ix_(stats['positions'], other_stats['positions'])].sum()
+        return {'positions': np.concatenate([stats['positions'], other_stats['positions']]),
+                'count': stats['count'] + other_stats['count'],
+                'sum': stats['sum'] + other_stats['sum'],
+                'pairs_sum': stats['pairs_sum'] + other_stats['pairs_sum'] + 2 * cross_sum}
+
+    def score_merges(self, stats, all_other_stats):
+        """
+        Measures the average correlation of the unions of a cluster with each of the given other clusters at once.
+
+        Keyword arguments:
+        stats -- dict of the cluster's sufficient statistics (see get_statistics)
+        all_other_stats -- list of dicts of the other clusters' sufficient statistics (see get_statistics)
+
+        Return:
+        Numpy array of the average correlations of the unions + offset
+        """
+        other_positions = np.concatenate([other_stats['positions'] for other_stats in all_other_stats])
+        other_counts = np.array([other_stats['count'] for other_stats in all_other_stats])
+        owners = np.repeat(np.arange(len(all_other_stats)), other_counts)
+        cross_sums = np.bincount(owners, weights=self._corr_matrix[np.ix_(stats['positions'], other_positions)].sum(axis=0),
+                                 minlength=len(all_other_stats))
+        counts = stats['count'] + other_counts
+        pairs_sums = stats['pairs_sum'] + np.array([other_stats['pairs_sum'] for other_stats in all_other_stats]) + 2 * cross_sums
+        return pairs_sums / (counts * (counts - 1)) + self.offset
+
+    def remove_statistics(self, stats, removed_stats):
+        """
+        Computes the sufficient statistics of a cluster once some of its time series have been removed.
+
+        Keyword arguments:
+        stats -- dict of the cluster's sufficient statistics (see get_statistics)
+        removed_stats -- dict of the sufficient statistics of the time series to remove (see get_statistics)
+
+        Return:
+        Dict of the remaining time series' sufficient statistics (see get_statistics)
+        """
+        positions = stats['positions'][~np.isin(stats['positions'], removed_stats['positions'])]
+        cross_sum = self._corr_matrix[np.ix_(removed_stats['positions'], positions)].sum()
+        return {'positions': positions, 'count': len(positions),
+                'sum': stats['sum'] - removed_stats['sum'],
+                'pairs_sum': stats['pairs_sum'] - removed_stats['pairs_sum'] - 2 * cross_sum if len(positions) > 1 else 0.}
+
+    def score_statistics(self, stats):
+        """
+        Measures the average correlation of a cluster from its sufficient statistics.
+
+        Keyword arguments:
+        stats -- dict of the cluster's sufficient statistics (see get_statistics)
+
+        Return:
+        Average correlation for all pairs of the cluster's time series + offset (1.0 + offset if there are less than 2 time series)
+        """
+        if stats['count'] < 2:
+            return 1.0 + self.offset
+        return stats['pairs_sum'] / (stats['count'] * (stats['count'] - 1)) + self.offset
+
+    def get_centroid(self, stats):
+        """
+        Returns the centroid of a cluster from its sufficient statistics.
+
+        Keyword arguments:
+        stats -- dict of the cluster's sufficient statistics (see get_statistics)
+
+        Return:
+        Pandas DataFrame containing the cluster's centroid as single row (its index is 'centroid')
+        """
+        return pd.DataFrame([stats['sum'] / stats['count']], index=['centroid'], columns=self.columns)
+
+    def get_samples(self, stats):
+        """
+        Returns the time series of a cluster.
+
+        Keyword arguments:
+        stats -- dict of the cluster's sufficient statistics (see get_statistics)
+
+        Return:
+        Pandas DataFrame containing the cluster's time series (each row is a time series)
+        """
+        return pd.DataFrame(self._values[stats['positions']], index=self.index[stats['positions']], columns=self.columns)
+
+
+    # private methods
+
+    def _get_positions(self, samples):
+        """
+        Returns the positions of the given time series in the data set.
+
+        Keyword arguments:
+        samples -- Pandas DataFrame containing the time series (each row is a time series)
+
+        Return:
+        Numpy array of the time series' positions or None if some of them are not time series of the data set
+        """
+        positions = self.index.get_indexer(samples.index)
+        return None if (positions < 0).any() else positions
+
+    def _get_sum(self, positions):
+        """
+        Returns the sum of the correlations of all pairs of the given time series (diagonal excluded). Sums are cached.
+
+        Keyword arguments:
+        positions -- Numpy array of the time series' positions in the data set
+
+        Return:
+        Sum of the correlations of all ordered pairs of distinct time series
+        """
+        if len(positions) < 2:
+            return 0.
+        key = frozenset(positions)
+        if key not in self._sums:
+            submatrix = self._corr_matrix[np.ix_(positions, positions)]
+            self._sums[key] = submatrix.sum() - np.trace(submatrix)
+        return self._sums[key]
+
+
+    # static methods
+
+    @staticmethod
+    def _standardize(samples):
+        """
+        Centers the given samples and scales them to a unit norm: the dot product of two standardized samples is their correlation.
+
+        Keyword arguments:
+        samples -- Numpy ndarray of samples (each row is a sample)
+
+        Return:
+        Numpy ndarray of the standardized samples (NaN for constant samples)
+        """
+        centered = samples - samples.mean(axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return centered / np.linalg.norm(centered, axis=1, keepdims=True)
+
+    @staticmethod
+    def _get_mean_corr(samples):
+        """
+        Measures the average correlation of the given samples with np.corrcoef.
+
+        Keyword arguments:
+        samples -- Pandas DataFrame or Numpy ndarray of samples (each row is a sample)
+
+        Return:
+        Average correlation for all pairs of samples
+        """
+        corr_matrix = np.corrcoef(np.asarray(samples), rowvar=True)
+        n = corr_matrix.shape[0]
+        return (corr_matrix.sum() - np.trace(corr_matrix)) / (n * (n - 1))
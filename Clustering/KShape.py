@@ -0,0 +1,331 @@
+"""
+RecImpute - A Recommendation System of Imputation Techniques for Missing Values in Time Series,
+eXascale Infolab, University of Fribourg, Switzerland
+***
+KShape.py
+@author: @chacungu
+"""
+
+import hashlib
+import numpy as np
+
+class KShape:
+    """
+    Vectorized implementation of the k-Shape clustering algorithm (Paparrizos & Gravano, 2015). Same algorithm as
+    kshape.core.kshape but the FFT of each time series is computed once per call, and the shape-based distances (SBD) of all
+    time series to all centroids as well as the alignments of a cluster's time series to its centroid are computed as batched
+    matrix operations.
+    Can be used as clustering_algo of Clustering.ConFree_kClustering.cluster. If warm_start is True, clustering a subset of
+    time series which is a cluster produced by a previous call starts from this cluster's centroid instead of a random
+    assignment.
+    """
+
+    MAX_ITER = 100
+    MAX_BLOCK_BYTES = 256 * 1024 ** 2 # maximum memory used by the cross-correlations computed at once
+
+
+    # constructor
+
+    def __init__(self, seed=None, warm_start=False):
+        """
+        Initializes a KShape object.
+
+        Keyword arguments:
+        seed -- seed of the random number generator used to initialize the clusters (default None, if None, uses Numpy's
+                global random number generator)
+        warm_start -- True if clustering a cluster produced by a previous call should start from this cluster's centroid
+                      (default False)
+        """
+        self.warm_start = warm_start
+        self._random_state = np.random.RandomState(seed) if seed is not None else None
+        self._produced_centroids = {} # fingerprint of a produced cluster's time series -> centroid of the cluster
+
+
+    # public methods
+
+    def __call__(self, k, X):
+        """
+        Clusters the given time series with an objective of k clusters.
+
+        Keyword arguments:
+        k -- number of clusters to produce
+        X -- Pandas DataFrame or Numpy ndarray of time series to cluster (each row is one time series)
+
+        Return:
+        Numpy array of labels: index of the cluster each time series belongs to
+        """
+        labels, _ = self.fit(k, X)
+        return labels
+
+    def fit(self, k, X):
+        """
+        Clusters the given time series with an objective of k clusters.
+
+        Keyword arguments:
+        k -- number of clusters to produce
+        X -- Pandas DataFrame or Numpy ndarray of time series to cluster (each row is one time series)
+
+        Return:
+        1. Numpy array of labels: index of the cluster each time series belongs to
+        2. Numpy ndarray of the clusters' centroids (k x time series' length)
+        """
+        x = np.asarray(X, dtype=np.float64)
+        m, length = x.shape
+        fft_size = 1 << (2 * length - 1).bit_length()
+        x_ffts = np.fft.rfft(x, n=fft_size, axis=1)
+        x_norms = np.linalg.norm(x, axis=1)
+
+        centroids = np.zeros((k, length))
+        parent_centroid = self._produced_centroids.pop(self._get_fingerprint(x), None) if self.warm_start else None
+        if parent_centroid is not None:
+            centroids = self._init_centroids(parent_centroid, x, x_ffts, x_norms, k, fft_size)
+            labels = self._get_distances(x_ffts, x_norms, centroids, fft_size, length).argmin(axis=1)
+        else:
+            random_state = self._random_state if self._random_state is not None else np.random
+            labels = random_state.randint(0, k, size=m)
+
+        for _ in range(KShape.MAX_ITER):
+            old_labels = labels
+            for j in range(k):
+                centroids[j] = self._extract_shape(x, x_ffts, x_norms, labels == j, centroids[j], fft_size)
+            labels = self._get_distances(x_ffts, x_norms, centroids, fft_size, length).argmin(axis=1)
+            if np.array_equal(old_labels, labels):
+                break
+
+        if self.warm_start:
+            for j in np.unique(labels):
+                self._produced_centroids[self._get_fingerprint(x[labels == j])] = centroids[j].copy()
+        return labels, centroids
+
+    def extract_shapes(self, X, labels):
+        """
+        Computes the centroid (shape) of each cluster of the given time series. The time series of a cluster are aligned to
+        a first shape extracted without alignment, then the cluster's shape is extracted from the aligned time series.
+
+        Keyword arguments:
+        X -- Pandas DataFrame or Numpy ndarray of time series (each row is one time series)
+        labels -- Numpy array of labels: index of the cluster each time series belongs to
+
+        Return:
+        1. Numpy array of the clusters' labels (ascending order)
+        2. Numpy ndarray of the clusters' centroids (nb clusters x time series' length)
+        """
+        x = np.asarray(X, dtype=np.float64)
+        labels = np.asarray(labels)
+        length = x.shape[1]
+        fft_size = 1 << (2 * length - 1).bit_length()
+        x_ffts = np.fft.rfft(x, n=fft_size, axis=1)
+        x_norms = np.linalg.norm(x, axis=1)
+
+        unique_labels = np.unique(labels)
+        centroids = np.zeros((len(unique_labels), length))
+        for j, label in enumerate(unique_labels):
+            members = labels == label
+            shape = self._extract_shape(x, x_ffts, x_norms, members, np.zeros(length), fft_size)
+            centroids[j] = self._extract_shape(x, x_ffts, x_norms, members, shape, fft_size)
+        return unique_labels, centroids
+
+    def predict(self, X, centroids):
+        """
+        Assigns each time series to the centroid it is the closest to (shape-based distance).
+
+        Keyword arguments:
+        X -- Pandas DataFrame or Numpy ndarray of time series (each row is one time series)
+        centroids -- Numpy ndarray of the centroids (each row is one centroid)
+
+        Return:
+        Numpy array of the index of the closest centroid of each time series
+        """
+        x = np.asarray(X, dtype=np.float64)
+        length = x.shape[1]
+        fft_size = 1 << (2 * length - 1).bit_length()
+        x_ffts = np.fft.rfft(x, n=fft_size, axis=1)
+        return self._get_distances(x_ffts, np.linalg.norm(x, axis=1), centroids, fft_size, length).argmin(axis=1)
+
+    def get_state(self):
+        """
+        Returns the state of this object (random number generator and centroids kept for warm starts).
+
+        Keyword arguments: -
+
+        Return:
+        Dict of the state of this object (see set_state)
+        """
+        return {'random_state': self._random_state.get_state() if self._random_state is not None else None,
+                'produced_centroids': dict(self._produced_centroids)}
+
+    def set_state(self, state):
+        """
+        Restores a state of this object.
+
+        Keyword arguments:
+        state -- dict of the state to restore (see get_state)
+
+        Return: -
+        """
+        if state['random_state'] is not None:
+            self._random_state.set_state(state['random_state'])
+        self._produced_centroids = dict(state['produced_centroids'])
+
+
+    # private methods
+
+    def _init_centroids(self, parent_centroid, x, x_ffts, x_norms, k, fft_size):
+        """
+        Initializes k centroids from the centroid of the cluster being clustered: the other centroids are iteratively
+        the time series which are the farthest (SBD) from the centroids already selected.
+
+        Keyword arguments:
+        parent_centroid -- Numpy array of the centroid of the cluster being clustered
+        x -- Numpy ndarray of the time series (each row is one time series)
+        x_ffts -- Numpy ndarray of the time series' FFT
+        x_norms -- Numpy array of the time series' norm
+        k -- number of centroids
+        fft_size -- size of the FFTs
+
+        Return:
+        Numpy ndarray of the initial centroids (k x time series' length)
+        """
+        centroids = np.zeros((k, x.shape[1]))
+        centroids[0] = parent_centroid
+        min_distances = self._get_distances(x_ffts, x_norms, centroids[:1], fft_size, x.shape[1])[:, 0]
+        for j in range(1, k):
+            farthest = min_distances.argmax()
+            centroids[j] = x[farthest]
+            distances = self._get_distances(x_ffts, x_norms, centroids[j:j+1], fft_size, x.shape[1])[:, 0]
+            min_distances = np.minimum(min_distances, distances)
+            min_distances[farthest] = -np.inf
+        return centroids
+
+    def _extract_shape(self, x, x_ffts, x_norms, members, centroid, fft_size):
+        """
+        Computes the shape (new centroid) of a cluster: its time series are aligned to its current centroid and the shape
+        is the eigenvector maximizing their squared normalized cross-correlation.
+
+        Keyword arguments:
+        x -- Numpy ndarray of the time series (each row is one time series)
+        x_ffts -- Numpy ndarray of the time series' FFT
+        x_norms -- Numpy array of the time series' norm
+        members -- boolean Numpy array: True for the time series of the cluster
+        centroid -- Numpy array of the cluster's current centroid
+        fft_size -- size of the FFTs
+
+        Return:
+        Numpy array of the cluster's new centroid (z-normalized)
+        """
+        a = x[members]
+        if a.shape[0] == 0:
+            return np.zeros(x.shape[1])
+        if np.sum(centroid) != 0:
+            a = self._align(centroid, a, x_ffts[members], x_norms[members], fft_size)
+
+        columns = a.shape[1]
+        y = self._zscore(a, axis=1)
+        s = np.dot(y.T, y)
+        p = np.eye(columns) - np.full((columns, columns), 1.0 / columns)
+        m = np.dot(np.dot(p, s), p)
+        _, vec = np.linalg.eigh(m)
+        shape = vec[:, -1]
+        if np.sqrt(((a[0] - shape) ** 2).sum()) >= np.sqrt(((a[0] + shape) ** 2).sum()):
+            shape = -shape
+        return self._zscore(shape, axis=0)
+
+    def _align(self, centroid, a, a_ffts, a_norms, fft_size):
+        """
+        Shifts (with zero-padding) each time series such that its cross-correlation with the centroid is maximal.
+
+        Keyword arguments:
+        centroid -- Numpy array of the centroid
+        a -- Numpy ndarray of the time series to align (each row is one time series)
+        a_ffts -- Numpy ndarray of the time series' FFT
+        a_norms -- Numpy array of the time series' norm
+        fft_size -- size of the FFTs
+
+        Return:
+        Numpy ndarray of the aligned time series
+        """
+        length = a.shape[1]
+        centroid_fft = np.fft.rfft(centroid, n=fft_size)
+        ncc = self._get_ncc(centroid_fft[None, :] * np.conj(a_ffts), np.linalg.norm(centroid) * a_norms, fft_size, length)
+        shifts = ncc.argmax(axis=1) + 1 - length
+        positions = np.arange(length)[None, :] - shifts[:, None]
+        valid = (positions >= 0) & (positions < length)
+        return np.where(valid, np.take_along_axis(a, np.clip(positions, 0, length - 1), axis=1), 0.)
+
+    def _get_distances(self, x_ffts, x_norms, centroids, fft_size, length):
+        """
+        Computes the shape-based distance (SBD) of all time series to all centroids. The time series are processed in blocks
+        such that the memory used by their cross-correlations with the centroids does not exceed MAX_BLOCK_BYTES.
+
+        Keyword arguments:
+        x_ffts -- Numpy ndarray of the time series' FFT
+        x_norms -- Numpy array of the time series' norm
+        centroids -- Numpy ndarray of the centroids (each row is one centroid)
+        fft_size -- size of the FFTs
+        length -- length of the time series
+
+        Return:
+        Numpy ndarray of the distances (nb time series x nb centroids)
+        """
+        centroids_conj_ffts = np.conj(np.fft.rfft(centroids, n=fft_size, axis=1))
+        centroids_norms = np.linalg.norm(centroids, axis=1)
+        bytes_per_pair = fft_size * 8 + x_ffts.shape[1] * 16 # cross-correlation and product of the FFTs
+        block_size = max(1, KShape.MAX_BLOCK_BYTES // (bytes_per_pair * len(centroids)))
+
+        distances = np.empty((x_ffts.shape[0], len(centroids)))
+        for start in range(0, x_ffts.shape[0], block_size):
+            block = slice(start, start + block_size)
+            den = x_norms[block, None] * centroids_norms[None, :]
+            ncc = self._get_ncc(x_ffts[block, None, :] * centroids_conj_ffts[None, :, :], den, fft_size, length)
+            distances[block] = 1 - ncc.max(axis=2)
+        return distances
+
+    def _get_ncc(self, ffts_product, den, fft_size, length):
+        """
+        Computes normalized cross-correlations from the products of FFTs.
+
+        Keyword arguments:
+        ffts_product -- Numpy ndarray of the products of FFTs (last axis: frequencies)
+        den -- Numpy ndarray of the products of norms (shape of ffts_product without its last axis)
+        fft_size -- size of the FFTs
+        length -- length of the time series
+
+        Return:
+        Numpy ndarray of the normalized cross-correlations for the shifts -(length-1)..(length-1) (last axis)
+        """
+        cc = np.fft.irfft(ffts_product, n=fft_size, axis=-1)
+        cc = np.concatenate([cc[..., -(length - 1):], cc[..., :length]], axis=-1) if length > 1 else cc[..., :1]
+        den = np.where(den == 0, np.inf, den)
+        return cc / den[..., None]
+
+
+    # static methods
+
+    @staticmethod
+    def _zscore(a, axis):
+        """
+        Z-normalizes the given array (ddof=1). NaNs (constant time series) are replaced by 0.
+
+        Keyword arguments:
+        a -- Numpy ndarray
+        axis -- axis along which to normalize
+
+        Return:
+        Z-normalized Numpy ndarray
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            res = (a - a.mean(axis=axis, keepdims=True)) / a.std(axis=axis, ddof=1, keepdims=True)
+        return np.nan_to_num(res)
+
+    @staticmethod
+    def _get_fingerprint(x):
+        """
+        Returns a fingerprint identifying a set of time series.
+
+        Keyword arguments:
+        x -- Numpy ndarray of the time series (each row is one time series)
+
+        Return:
+        SHA-1 hex digest of the time series' values
+        """
+        return hashlib.sha1(np.ascontiguousarray(x).tobytes()).hexdigest()
@@ -0,0 +1,174 @@
+"""
+RecImpute - A Recommendation System of Imputation Techniques for Missing Values in Time Series,
+eXascale Infolab, University of Fribourg, Switzerland
+***
+NCCEngine.py
+@author: @chacungu
+"""
+
+import numpy as np
+
+from Utils.Utils import Utils
+
+class NCCEngine:
+    """
+    Computes the maximum Normalized Cross-Correlation (NCC) of pairs of time series of a data set. The FFT of each time series
+    is computed once and the cross-correlations of many pairs are computed at once (vectorized products of the FFTs) in blocks
+    whose size is bounded. Computed scores are kept in a matrix: the NCC of a pair is never computed twice.
+    Scores are the same as the maximum of kshape.core._ncc_c's output.
+    """
+
+    CONF = Utils.read_conf_file('clustering')
+
+
+    # constructor
+
+    def __init__(self, timeseries, max_block_bytes=None):
+        """
+        Initializes a NCCEngine object.
+
+        Keyword arguments:
+        timeseries -- Pandas DataFrame containing the time series (each row is a time series)
+        max_block_bytes -- maximum memory (in bytes) used by a block of cross-correlations (default None, if None, uses
+                           the conf file's value)
+        """
+        self.index = timeseries.index
+        values = timeseries.to_numpy(dtype=np.float64)
+        self.nb_timeseries, self.timeseries_length = values.shape
+        self.fft_size = 1 << (2 * self.timeseries_length - 1).bit_length()
+        self.max_block_bytes = max_block_bytes if max_block_bytes is not None \
+                               else NCCEngine.CONF['NCC_MAX_BLOCK_MB'] * 1024 ** 2
+
+        self._ffts = np.fft.rfft(values, n=self.fft_size, axis=1)
+        self._norms = np.linalg.norm(values, axis=1)
+        self._matrix = np.zeros((self.nb_timeseries, self.nb_timeseries))
+        self._computed = np.eye(self.nb_timeseries, dtype=bool) # the diagonal (NCC of a time series with itself) is not used
+
+
+    # public methods
+
+    def get_matrix(self):
+        """
+        Returns the max-NCC matrix of all pairs of time series.
+
+        Keyword arguments: -
+
+        Return:
+        Numpy ndarray (nb_timeseries x nb_timeseries) of the max-NCC scores (the diagonal is not meaningful)
+        """
+        self._compute_missing(np.arange(self.nb_timeseries))
+        return self._matrix
+
+    def get_mean_ncc(self, tids=None):
+        """
+        Returns the average max-NCC score over all pairs of the given time series. Only the scores of the pairs which have
+        not been computed yet are computed.
+
+        Keyword arguments:
+        tids -- list of the IDs of the time series (default None, if None, uses all time series)
+
+        Return:
+        Average of the max-NCC scores measured for all pairs of the given time series (1.0 if there are less than 2 time series)
+        """
+        positions = np.arange(self.nb_timeseries) if tids is None else self._get_positions(tids)
+        if len(positions) < 2:
+            return 1.0
+        self._compute_missing(positions)
+        return self._matrix[np.ix_(positions, positions)][np.triu_indices(len(positions), 1)].mean()
+
+    def get_submatrix(self, row_tids, column_tids):
+        """
+        Returns the max-NCC scores of all pairs (row, column) of the given time series. Only the rows which have scores not
+        computed yet are computed.
+
+        Keyword arguments:
+        row_tids -- list of the IDs of the rows' time series
+        column_tids -- list of the IDs of the columns' time series
+
+        Return:
+        Numpy ndarray (len(row_tids) x len(column_tids)) of the max-NCC scores (the scores of a time series with itself are 
+        not meaningful)
+        """
+        rows, columns = self._get_positions(row_tids), self._get_positions(column_tids)
+        missing_rows = rows[~self._computed[np.ix_(rows, columns)].all(axis=1)]
+        if len(missing_rows) > 0:
+            block = self._compute_block(missing_rows, columns)
+            self._matrix[np.ix_(missing_rows, columns)] = block
+            self._matrix[np.ix_(columns, missing_rows)] = block.T
+            self._computed[np.ix_(missing_rows, columns)] = True
+            self._computed[np.ix_(columns, missing_rows)] = True
+        return self._matrix[np.ix_(rows, columns)]
+
+
+    # private methods
+
+    def _get_positions(self, tids):
+        """
+        Returns the positions of the given time series.
+
+        Keyword arguments:
+        tids -- list of the IDs of the time series
+
+        Return:
+        Numpy array of the positions of the time series. Raises a KeyError if some of them are not time series of the engine.
+        """
+        positions = self.index.get_indexer(tids)
+        if (positions < 0).any():
+            raise KeyError('Time series IDs not found: %s' % list(np.asarray(tids)[positions < 0]))
+        return positions
+
+    def _compute_missing(self, positions):
+        """
+        Computes the scores of all pairs of the given time series which have not been computed yet. Since the matrix is
+        symmetric, the rows to compute are selected greedily (row with the most missing scores first) until no score is missing.
+
+        Keyword arguments:
+        positions -- Numpy array of the positions of the time series
+
+        Return: -
+        """
+        missing = ~self._computed[np.ix_(positions, positions)]
+        nb_missing = missing.sum(axis=1)
+        rows = []
+        while nb_missing.any():
+            i = nb_missing.argmax()
+            rows.append(i)
+            nb_missing -= missing[:, i]
+            nb_missing[i] = 0
+            missing[:, i] = False
+            missing[i, :] = False
+        if rows:
+            rows = positions[rows]
+            block = self._compute_block(rows, positions)
+            self._matrix[np.ix_(rows, positions)] = block
+            self._matrix[np.ix_(positions, rows)] = block.T
+            self._computed[np.ix_(rows, positions)] = True
+            self._computed[np.ix_(positions, rows)] = True
+
+    def _compute_block(self, rows, columns):
+        """
+        Computes the max-NCC scores of all pairs (row, column). The rows are processed in chunks such that the memory used
+        by the cross-correlations of a chunk does not exceed the engine's bound.
+
+        Keyword arguments:
+        rows -- Numpy array of the positions of the rows' time series
+        columns -- Numpy array of the positions of the columns' time series
+
+        Return:
+        Numpy ndarray (len(rows) x len(columns)) of the max-NCC scores
+        """
+        length = self.timeseries_length
+        bytes_per_pair = self.fft_size * 8 + self._ffts.shape[1] * 16 # cross-correlation and product of the FFTs
+        chunk_size = max(1, self.max_block_bytes // (bytes_per_pair * len(columns)))
+        conj_ffts = np.conj(self._ffts[columns])
+
+        block = np.empty((len(rows), len(columns)))
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            cc = np.fft.irfft(self._ffts[chunk, None, :] * conj_ffts[None, :, :], n=self.fft_size, axis=2)
+            # lags -(length-1)..(length-1) are stored at the end and the beginning of the cross-correlation
+            block[start:start + chunk_size] = np.maximum(cc[:, :, :length].max(axis=2), cc[:, :, -(length - 1):].max(axis=2))
+
+        den = self._norms[rows, None] * self._norms[None, columns]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(den == 0, 0., block / den)
@@ -6,6 +6,8 @@ ShapeBasedClustering.py
 @author: @chacungu
 """
 
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from functools import partial
 import json
@@ -20,7 +22,10 @@ import time
 from tqdm import tqdm
 
 from Clustering.AbstractClustering import AbstractClustering
+from Clustering.CassignmentStore import CassignmentStore
 from Clustering.ConFree_kClustering import cluster as cfkc_cluster
+from Clustering.CorrelationMatrixObjective import CorrelationMatrixObjective
+from Clustering.KShape import KShape
 from Datasets.Dataset import Dataset
 from Utils.Utils import Utils
 
@@ -30,9 +35,16 @@ class ShapeBasedClustering(AbstractClustering):
     """
 
     GS_SCORES_FILE = normp(AbstractClustering.CLUSTERS_DIR + 'sbc_gridsearch_scores.json')
-    CLUSTERING_STATUS_FILE = normp(AbstractClustering.CLUSTERS_DIR + 'sbc_clustering_status.txt')
+    CLUSTERING_STATUS_FILE = normp(AbstractClustering.CLUSTERS_DIR + '/sbc_clustering_status.txt')
+    CHANGED_CLUSTERS_FILE = normp(AbstractClustering.CLUSTERS_DIR + '/sbc_changed_clusters.json')
     CLUSTERS_FILENAMES_ID = '_sbc'
+    CASSIGNMENTS_STORE = CassignmentStore(normp(AbstractClustering.CLUSTERS_DIR + '/sbc_cassignments'))
     CONF = Utils.read_conf_file('clustering')
+    # configuration entries which change the clusters (see get_inputs_hash): the others only change how fast they are created
+    INPUTS_CONF_KEYS = ['INIT_ACCEPTANCE_THRESHOLD', 'CLUSTER_ACCEPTANCE_THRESHOLD', 'SIMILAR_CLUSTER_THRESHOLD', 
+                        'CENTROID_DIST_THRESHOLD', 'TS_PERC_TO_COMPUTE_K', 'MAX_ITER', 'APPLY_MERGING', 'CLUSTERING_ENGINE', 
+                        'KSHAPE_IMPLEMENTATION', 'KSHAPE_SEED', 'KSHAPE_WARM_START', 
+                        'SAMPLE_CLUSTERING_MIN_NB_TS', 'SAMPLE_CLUSTERING_FRACTION']
 
 
     # constructor
@@ -46,7 +58,13 @@ class ShapeBasedClustering(AbstractClustering):
     def cluster_all_datasets(self, datasets):
         """
         Parallel - For each data set, searches the optimal number of clusters to produce, performs multiple clustering tries
-        to find the most accurate. Saves the clusters' assignment to a .csv file stored in the Dataset object.
+        to find the most accurate. Saves the clusters' assignment in the clusterer's assignments store.
+        Data sets are scheduled by decreasing estimated peak memory and are only admitted in the pool of workers while the 
+        estimated memory of the running jobs fits the RAM budget. A job which fails with a MemoryError or whose worker is killed
+        (e.g. by the system when running out of memory) is retried alone, as well as the jobs which were running in the same
+        pool. Data sets whose clustering fails otherwise are reported and not clustered.
+        If a previous run has been interrupted, the data sets it has clustered are not clustered again and the others resume 
+        from their last checkpoint.
         
         Keyword arguments:
         datasets -- list of Dataset objects containing the time series to cluster.
@@ -58,24 +76,86 @@ class ShapeBasedClustering(AbstractClustering):
         for dataset in datasets:
             print('- %s' % dataset.name)
         print('\n')
-            
-        updated_datasets = []
-        with Pool() as p:
+
+        updated_datasets, datasets = self._skip_clustered_datasets(datasets)
+
+        ram_budget = ShapeBasedClustering.CONF['CLUSTERING_RAM_BUDGET_MB'] * 1024 ** 2
+        if ram_budget <= 0:
+            ram_budget = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        nb_workers, _ = self._get_nb_workers()
+
+        # largest jobs first: (dataset, estimated peak memory, True if the job must run alone)
+        pending = sorted([(dataset, self._estimate_peak_memory(dataset), False) for dataset in datasets], 
+                         key=lambda job: job[1], reverse=True)
+        running = {} # future -> job
+        failed_datasets = []
+        executor = ProcessPoolExecutor(max_workers=nb_workers)
+        try:
             with tqdm(total=len(datasets)) as pbar:
-                for updated_dataset in p.imap(self.cluster, datasets):
-                    updated_datasets.append(updated_dataset)
-                    pbar.update()
-            
+                while pending or running:
+                    # admit the largest pending jobs which fit the remaining budget (at least one job runs at any time)
+                    used_memory = sum(job[1] for job in running.values())
+                    for job in list(pending):
+                        if len(running) >= nb_workers or any(j[2] for j in running.values()) or (job[2] and running):
+                            break
+                        if not running or used_memory + job[1] <= ram_budget:
+                            pending.remove(job)
+                            running[executor.submit(self.cluster, job[0])] = job
+                            used_memory += job[1]
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    is_pool_broken = False
+                    for future in done:
+                        dataset, memory, alone = running.pop(future)
+                        try:
+                            updated_datasets.append(future.result())
+                            self._set_clustering_status(dataset.name)
+                            pbar.update()
+                        except (MemoryError, BrokenProcessPool) as e:
+                            # a worker killed by the system (e.g. out of memory) breaks the pool
+                            is_pool_broken = is_pool_broken or isinstance(e, BrokenProcessPool)
+                            if alone:
+                                print('%s got a %s exception: %s' % (dataset.name, e.__class__.__name__, e))
+                                failed_datasets.append(dataset.name)
+                                pbar.update()
+                            else:
+                                # retry without concurrent jobs
+                                print('%s got a %s exception, it will be clustered again alone.' % (dataset.name, e.__class__.__name__))
+                                pending.insert(0, (dataset, memory, True))
+                        except Exception as e:
+                            print('%s got an exception, it is not clustered: %r' % (dataset.name, e))
+                            failed_datasets.append(dataset.name)
+                            pbar.update()
+
+                    if is_pool_broken:
+                        # the jobs still running have been lost with the pool: retry them alone in a new pool
+                        for dataset, memory, _ in running.values():
+                            print('%s was interrupted, it will be clustered again alone.' % dataset.name)
+                            pending.insert(0, (dataset, memory, True))
+                        running = {}
+                        executor.shutdown(wait=True)
+                        executor = ProcessPoolExecutor(max_workers=nb_workers)
+        finally:
+            executor.shutdown(wait=True)
+
+        if failed_datasets:
+            print('The following data sets could not be clustered: %s' % ', '.join(failed_datasets))
+
         print('Clustering ended at %s.\n\n\n' % datetime.now().strftime("%d/%m/%Y %H:%M:%S"))
 
-        # change all clusters' ID (for all datasets) such that there are no duplicates
-        updated_datasets = self.make_cids_unique(updated_datasets)
+        # change the clusters' ID of the clustered data sets such that there are no duplicates: they are numbered after the 
+        # clusters of the other data sets, whose clusters' ID are left unchanged
+        excluded_names = [dataset.name for dataset in updated_datasets]
+        updated_datasets = self.make_cids_unique(updated_datasets, first_cid=self._get_max_cid(excluded_names) + 1)
+        self._clear_clustering_status()
         return updated_datasets
 
     def cluster_all_datasets_seq(self, datasets):
         """
         Sequential - For each data set, searches the optimal number of clusters to produce, performs multiple clustering tries
-        to find the most accurate. Saves the clusters' assignment to a .csv file stored in the Dataset object.
+        to find the most accurate. Saves the clusters' assignment in the clusterer's assignments store.
+        If a previous run has been interrupted, the data sets it has clustered are not clustered again and the others resume 
+        from their last checkpoint.
         
         Keyword arguments:
         datasets -- list of Dataset objects containing the time series to cluster.
@@ -88,24 +168,32 @@ class ShapeBasedClustering(AbstractClustering):
             print('- %s' % dataset.name)
         print('\n')
             
-        updated_datasets = []
+        updated_datasets, datasets = self._skip_clustered_datasets(datasets)
         for dataset in tqdm(datasets, total=len(datasets)):
             try:
                 updated_dataset = self.cluster(dataset)
                 updated_datasets.append(updated_dataset)
+                self._set_clustering_status(dataset.name)
             except MemoryError as e:
                 print('%s got a MemoryError exception: %s' % (dataset.name, e))
             
             
         print('Clustering ended at %s.\n\n\n' % datetime.now().strftime("%d/%m/%Y %H:%M:%S"))
 
-        # change all clusters' ID (for all datasets) such that there are no duplicates
-        updated_datasets = self.make_cids_unique(updated_datasets)
+        # change the clusters' ID of the clustered data sets such that there are no duplicates: they are numbered after the 
+        # clusters of the other data sets, whose clusters' ID are left unchanged
+        excluded_names = [dataset.name for dataset in updated_datasets]
+        updated_datasets = self.make_cids_unique(updated_datasets, first_cid=self._get_max_cid(excluded_names) + 1)
+        self._clear_clustering_status()
         return updated_datasets
 
     def cluster(self, dataset):
         """
-        Clusters the given data set's time series. Saves the clusters' assignment to a .csv file stored in the Dataset object.
+        Clusters the given data set's time series. Saves the clusters' assignment in the clusterer's assignments store.
+        The state of the clustering is saved regularly in a checkpoint file: if the clustering is interrupted, the next call
+        resumes from the last checkpoint.
+        Data sets with at least SAMPLE_CLUSTERING_MIN_NB_TS time series are clustered with the sample-then-assign mode 
+        (see _sample_then_assign).
         
         Keyword arguments:
         dataset -- Dataset objects containing the time series to cluster.
@@ -114,24 +202,13 @@ class ShapeBasedClustering(AbstractClustering):
         Updated Dataset object
         """
         timeseries = dataset.load_timeseries(transpose=True)
+        checkpoint_file = self._get_checkpoint_filename(dataset.name) \
+                          if ShapeBasedClustering.CONF['CLUSTERING_CHECKPOINT_INTERVAL'] > 0 else None
 
-        # add 2 to the correlation score to avoid dividing by 0 in some computations
-        corr_offset = 2 # changing this impacts the moving_thresh param which may then not be optimal !
-
-        labels = cfkc_cluster(
-            self.kshape_helper, 
-            lambda timeseries: self._get_dataset_mean_corr(timeseries) +corr_offset, 
-            timeseries, 
-            obj_thresh = ShapeBasedClustering.CONF['CLUSTER_ACCEPTANCE_THRESHOLD'] +corr_offset, 
-            init_obj_thresh = ShapeBasedClustering.CONF['INIT_ACCEPTANCE_THRESHOLD'] +corr_offset, 
-            sim_cluster_thresh = ShapeBasedClustering.CONF['SIMILAR_CLUSTER_THRESHOLD'] +corr_offset, 
-            centroid_dist_thresh = ShapeBasedClustering.CONF['CENTROID_DIST_THRESHOLD'] +corr_offset,
-            k_perc = ShapeBasedClustering.CONF['TS_PERC_TO_COMPUTE_K'], 
-            security_limit = 5, 
-            max_iter = ShapeBasedClustering.CONF['MAX_ITER'], 
-            id = dataset.name,
-            apply_merging = ShapeBasedClustering.CONF['APPLY_MERGING']
-        )
+        if 0 < ShapeBasedClustering.CONF['SAMPLE_CLUSTERING_MIN_NB_TS'] <= timeseries.shape[0]:
+            labels = self._sample_then_assign(timeseries, dataset.name, checkpoint_file)
+        else:
+            labels = self._confree_cluster(timeseries, dataset.name, checkpoint_file=checkpoint_file)
 
         # create the clusters' assignments data frame
         data = [
@@ -141,8 +218,166 @@ class ShapeBasedClustering(AbstractClustering):
         clusters_assignment = pd.DataFrame(data=data, columns=['Time Series ID', 'Cluster ID']).sort_values('Time Series ID')
         assert sorted(timeseries.index) == sorted(clusters_assignment['Time Series ID'].tolist())
         self.save_clusters(dataset, clusters_assignment)
+        self.clear_changed_cids(dataset.name)
+        if os.path.exists(self._get_checkpoint_filename(dataset.name)):
+            os.remove(self._get_checkpoint_filename(dataset.name))
         return dataset
 
+    def assign_new_timeseries(self, datasets):
+        """
+        Incremental clustering: assigns the time series which have no cluster yet (e.g. series appended to a data set's archive)
+        to the existing clusters of their data set without changing the other clusters' ID. Each new time series is proposed 
+        to the cluster whose centroid is the closest (shape-based distance) and is accepted if the cluster's average 
+        correlation remains higher or equal than CLUSTER_ACCEPTANCE_THRESHOLD. The leftovers are clustered and get new 
+        cluster IDs, unique over all data sets. Data sets which have never been clustered are clustered and get new cluster 
+        IDs as well. Saves the updated clusters' assignments and clusters' statistics.
+        
+        Keyword arguments:
+        datasets -- list of Dataset objects containing the time series to assign
+        
+        Return:
+        Dict with the data sets' names as keys and the sorted list of the IDs of their clusters which have changed or have been
+        created as values (only these clusters need to be labeled again, see get_changed_cids)
+        """
+        threshold = ShapeBasedClustering.CONF['CLUSTER_ACCEPTANCE_THRESHOLD']
+        next_cid = self._get_max_cid() + 1
+        changed_cids = {}
+        for dataset in datasets:
+            if not self.are_clusters_created(dataset.name):
+                # new data set: cluster it and shift its clusters' ID after the existing ones
+                self.cluster(dataset)
+                clusters_assignment = dataset.load_cassignment(self)
+                clusters_assignment['Cluster ID'] += next_cid
+                self.save_clusters(dataset, clusters_assignment)
+                changed_cids[dataset.name] = sorted(clusters_assignment['Cluster ID'].unique().tolist())
+                next_cid = max(changed_cids[dataset.name]) + 1
+                continue
+
+            timeseries = dataset.load_timeseries(transpose=True)
+            clusters_assignment = dataset.load_cassignment(self)
+            new_tids = timeseries.index[~timeseries.index.isin(clusters_assignment['Time Series ID'])]
+            changed_cids[dataset.name] = []
+            if len(new_tids) == 0:
+                continue
+            stats = self.get_clusters_statistics(dataset, timeseries)
+            new_timeseries = timeseries.loc[new_tids]
+            new_standardized = np.nan_to_num(CorrelationMatrixObjective._standardize(new_timeseries.to_numpy()))
+
+            # propose each new time series to the closest cluster and accept it if the cluster's correlation remains high enough
+            new_cids = np.full(len(new_tids), -1, dtype=np.int64)
+            closest = KShape().predict(new_timeseries, stats['centroids'])
+            for j in np.unique(closest):
+                candidates = np.flatnonzero(closest == j)
+                count, standardized_sum = stats['counts'][j], stats['sums'][j].copy()
+                # mean correlation of n time series = (||sum of their standardized vectors||^2 - n) / (n * (n-1))
+                candidates_sums = standardized_sum + new_standardized[candidates]
+                candidates_scores = (np.einsum('ij,ij->i', candidates_sums, candidates_sums) - (count + 1)) / ((count + 1) * count) \
+                                    if count > 0 else np.ones(len(candidates))
+                for candidate in candidates[np.argsort(-candidates_scores, kind='stable')]:
+                    candidate_sum = standardized_sum + new_standardized[candidate]
+                    if (candidate_sum @ candidate_sum - (count + 1)) / ((count + 1) * count) >= threshold:
+                        new_cids[candidate] = stats['cids'][j]
+                        count, standardized_sum = count + 1, candidate_sum
+
+            # cluster the leftovers and give them new clusters' ID
+            leftovers = np.flatnonzero(new_cids == -1)
+            if len(leftovers) > 0:
+                leftovers_labels = np.asarray(self._confree_cluster(new_timeseries.iloc[leftovers], '%s (new time series)' % dataset.name)) \
+                                   if len(leftovers) > 1 else np.zeros(1, dtype=np.int64)
+                new_cids[leftovers] = next_cid + np.unique(leftovers_labels, return_inverse=True)[1]
+                next_cid = new_cids.max() + 1
+
+            clusters_assignment = pd.concat([clusters_assignment, 
+                                             pd.DataFrame({'Time Series ID': new_tids, 'Cluster ID': new_cids})], ignore_index=True)
+            clusters_assignment = clusters_assignment.sort_values('Time Series ID').reset_index(drop=True)
+            self.save_clusters(dataset, clusters_assignment)
+            changed_cids[dataset.name] = sorted(np.unique(new_cids).tolist())
+            self._save_clusters_statistics(dataset, 
+                self._compute_clusters_statistics(timeseries, clusters_assignment, changed_cids[dataset.name], stats))
+        self._record_changed_cids(changed_cids)
+        return changed_cids
+
+    def can_assign_new_timeseries(self, dataset):
+        """
+        Checks whether the given data set's clusters are still valid and can be extended with assign_new_timeseries: the 
+        data set has been clustered and all its clustered time series are still in the data set. If the statistics of the 
+        clusters have been saved (see get_clusters_statistics), the clustered time series must also be unchanged.
+        
+        Keyword arguments:
+        dataset -- Dataset object to which the clusters belong
+        
+        Return:
+        True if the data set's new time series can be assigned to its existing clusters, False if it must be clustered again
+        """
+        if not self.are_clusters_created(dataset.name):
+            return False
+        timeseries = dataset.load_timeseries(transpose=True)
+        clusters_assignment = dataset.load_cassignment(self)
+        if not clusters_assignment['Time Series ID'].isin(timeseries.index).all():
+            return False # some clustered time series have been removed
+        stats = self._load_clusters_statistics(dataset.name)
+        if stats is None:
+            return True
+        # the sums of the clusters' standardized time series change if some of their time series have been edited
+        positions = np.searchsorted(stats['cids'], clusters_assignment['Cluster ID'].to_numpy())
+        sums = np.zeros(stats['sums'].shape)
+        values = timeseries.loc[clusters_assignment['Time Series ID']].to_numpy()
+        # constant time series are standardized as zeros: they do not change the sums
+        np.add.at(sums, positions, np.nan_to_num(CorrelationMatrixObjective._standardize(values)))
+        return np.allclose(sums, stats['sums'])
+
+    def get_changed_cids(self, dataset_name):
+        """
+        Returns the IDs of the given data set's clusters which have changed or have been created by assign_new_timeseries 
+        since the data set has been clustered or since clear_changed_cids has been called.
+        
+        Keyword arguments:
+        dataset_name -- name of the data set to which the clusters belong
+        
+        Return:
+        Sorted list of the clusters' ID or None if the data set has been clustered again entirely
+        """
+        return self._get_changed_cids().get(dataset_name)
+
+    def clear_changed_cids(self, dataset_name):
+        """
+        Forgets the IDs of the given data set's changed clusters (e.g. once they have been labeled again).
+        
+        Keyword arguments:
+        dataset_name -- name of the data set to which the clusters belong
+        
+        Return: -
+        """
+        changed_cids = self._get_changed_cids()
+        if dataset_name in changed_cids:
+            del changed_cids[dataset_name]
+            self._save_changed_cids(changed_cids)
+
+    def get_clusters_statistics(self, dataset, timeseries=None):
+        """
+        Returns the statistics of the given data set's clusters. They are computed and saved if they are missing or if they
+        have been computed for another version of the clusters.
+        
+        Keyword arguments:
+        dataset -- Dataset object to which the clusters belong
+        timeseries -- Pandas DataFrame containing the data set's time series (each row is a time series) (default None, if 
+                      None, they are loaded if needed)
+        
+        Return:
+        Dict with keys: cids (Numpy array of the clusters' ID), counts (Numpy array of the clusters' number of time series), 
+        sums (Numpy ndarray of the sum of each cluster's standardized time series, see 
+        CorrelationMatrixObjective._standardize; constant time series are standardized as zeros) and centroids (Numpy 
+        ndarray of the clusters' k-Shape centroid)
+        """
+        stats = self._load_clusters_statistics(dataset.name)
+        if stats is not None:
+            return stats
+        if timeseries is None:
+            timeseries = dataset.load_timeseries(transpose=True)
+        stats = self._compute_clusters_statistics(timeseries, dataset.load_cassignment(self))
+        self._save_clusters_statistics(dataset, stats)
+        return stats
+
     def kshape_helper(self, k, X):
         """
         Clusters the given time series using the k-Shape algorithm with an objective of k clusters.
@@ -150,7 +385,7 @@ class ShapeBasedClustering(AbstractClustering):
         
         Keyword arguments:
         k -- number of clusters k-Shape will try producing
-        X -- pandas DataFrame of time series to cluster (each row is one time series)
+        X -- pandas DataFrame or numpy ndarray of time series to cluster (each row is one time series)
         
         Return: 
         List of labels: index of the cluster each sample belongs to.
@@ -160,7 +395,7 @@ class ShapeBasedClustering(AbstractClustering):
 
     def save_clusters(self, dataset, cassignment):
         """
-        Saves the given clusters to CSV.
+        Saves the given clusters to the clusters' assignments store.
         
         Keyword arguments: 
         dataset -- Dataset object to which the clusters belong
@@ -170,9 +405,9 @@ class ShapeBasedClustering(AbstractClustering):
         
         Return: -
         """
-        cassignment_filename = self._get_cassignment_filename(dataset.name)
         dataset.cids = cassignment['Cluster ID'].unique().tolist()
-        cassignment.to_csv(cassignment_filename, index=False)
+        ShapeBasedClustering.CASSIGNMENTS_STORE.save(dataset.name, cassignment)
+        dataset.cache_cassignment(self, cassignment)
 
     def load_clusters(self, dataset_name):
         """
@@ -186,19 +421,383 @@ class ShapeBasedClustering(AbstractClustering):
         as the real world data set of this object. The associated values are the clusters' id to which are
         assigned the time series. Two columns: Time Series ID, Cluster ID.
         """
-        cassignment_filename = self._get_cassignment_filename(dataset_name)
-        clusters_assignment = pd.read_csv(cassignment_filename)
-        return clusters_assignment
+        self._migrate_cassignment_csv(dataset_name)
+        return ShapeBasedClustering.CASSIGNMENTS_STORE.load(dataset_name)
 
     
     # private methods
 
+    def _confree_cluster(self, timeseries, id, init_obj_thresh=None, checkpoint_file=None):
+        """
+        Clusters the given time series with ConFree_kClustering and k-Shape.
+        
+        Keyword arguments:
+        timeseries -- Pandas DataFrame containing the time series to cluster (each row is a time series)
+        id -- used to identify the time series that are clustered in print messages
+        init_obj_thresh -- if the time series have an average correlation higher or equal than this, clustering is not 
+                           necessary (default None, if None, uses INIT_ACCEPTANCE_THRESHOLD)
+        checkpoint_file -- file in which the state of the clustering is saved regularly (default None, if None, no checkpoint 
+                           is saved)
+        
+        Return:
+        List of labels: index of the cluster each time series belongs to
+        """
+        # add 2 to the correlation score to avoid dividing by 0 in some computations
+        corr_offset = 2 # changing this impacts the moving_thresh param which may then not be optimal !
+        if init_obj_thresh is None:
+            init_obj_thresh = ShapeBasedClustering.CONF['INIT_ACCEPTANCE_THRESHOLD']
+
+        if ShapeBasedClustering.CONF['PRECOMPUTE_CORRELATION_MATRIX']:
+            objective_function = CorrelationMatrixObjective(timeseries, offset=corr_offset)
+        else:
+            objective_function = lambda timeseries: self._get_dataset_mean_corr(timeseries) +corr_offset
+
+        if ShapeBasedClustering.CONF['KSHAPE_IMPLEMENTATION'] == 'internal':
+            # warm starts depend on the clusters produced by the same process: not reproducible with the parallel engine
+            warm_start = ShapeBasedClustering.CONF['KSHAPE_WARM_START'] and ShapeBasedClustering.CONF['CLUSTERING_ENGINE'] != 'parallel'
+            clustering_algo = KShape(seed=ShapeBasedClustering.CONF['KSHAPE_SEED'], warm_start=warm_start)
+        else:
+            clustering_algo = self.kshape_helper
+
+        return cfkc_cluster(
+            clustering_algo, 
+            objective_function, 
+            timeseries, 
+            obj_thresh = ShapeBasedClustering.CONF['CLUSTER_ACCEPTANCE_THRESHOLD'] +corr_offset, 
+            init_obj_thresh = init_obj_thresh +corr_offset, 
+            sim_cluster_thresh = ShapeBasedClustering.CONF['SIMILAR_CLUSTER_THRESHOLD'] +corr_offset, 
+            centroid_dist_thresh = ShapeBasedClustering.CONF['CENTROID_DIST_THRESHOLD'] +corr_offset,
+            k_perc = ShapeBasedClustering.CONF['TS_PERC_TO_COMPUTE_K'], 
+            security_limit = 5, 
+            max_iter = ShapeBasedClustering.CONF['MAX_ITER'], 
+            id = id,
+            apply_merging = ShapeBasedClustering.CONF['APPLY_MERGING'],
+            engine = ShapeBasedClustering.CONF['CLUSTERING_ENGINE'],
+            nb_workers = ShapeBasedClustering.CONF['CLUSTERING_NB_WORKERS'],
+            checkpoint_file = checkpoint_file,
+            checkpoint_interval = ShapeBasedClustering.CONF['CLUSTERING_CHECKPOINT_INTERVAL']
+        )
+
+    def _sample_then_assign(self, timeseries, id, checkpoint_file=None):
+        """
+        Clusters a large set of time series: a stratified sample of the time series is clustered with ConFree_kClustering, 
+        then each remaining time series is assigned to the closest (shape-based distance) centroid of the sample's clusters.
+        Only the clusters which received time series are checked again: those whose average correlation is lower than 
+        CLUSTER_ACCEPTANCE_THRESHOLD are clustered again with ConFree_kClustering.
+        
+        Keyword arguments:
+        timeseries -- Pandas DataFrame containing the time series to cluster (each row is a time series)
+        id -- used to identify the time series that are clustered in print messages
+        checkpoint_file -- file in which the state of the sample's clustering is saved regularly (default None, if None, no 
+                           checkpoint is saved)
+        
+        Return:
+        Numpy array of labels: index of the cluster each time series belongs to
+        """
+        sample_positions = self._get_stratified_sample(timeseries.to_numpy(), ShapeBasedClustering.CONF['SAMPLE_CLUSTERING_FRACTION'])
+        sample = timeseries.iloc[sample_positions]
+        print('Clustering a sample of %i out of %i time series for %s.' % (len(sample_positions), timeseries.shape[0], id))
+        sample_labels = np.asarray(self._confree_cluster(sample, id, checkpoint_file=checkpoint_file))
+
+        # assign each remaining time series to the closest centroid of the sample's clusters
+        kshape = KShape()
+        clusters_labels, centroids = kshape.extract_shapes(sample, sample_labels)
+        remaining_positions = np.setdiff1d(np.arange(timeseries.shape[0]), sample_positions)
+        labels = np.empty(timeseries.shape[0], dtype=np.int64)
+        labels[sample_positions] = sample_labels
+        labels[remaining_positions] = clusters_labels[kshape.predict(timeseries.iloc[remaining_positions], centroids)]
+
+        # check again the clusters which have changed: cluster again those whose correlation is not high enough anymore
+        next_label = labels.max() + 1
+        for label in np.unique(labels[remaining_positions]):
+            members = np.flatnonzero(labels == label)
+            cluster_timeseries = timeseries.iloc[members]
+            if self._get_dataset_mean_corr(cluster_timeseries) < ShapeBasedClustering.CONF['CLUSTER_ACCEPTANCE_THRESHOLD']:
+                members_labels = np.asarray(self._confree_cluster(cluster_timeseries, '%s (cluster %i)' % (id, label), 
+                                                                  init_obj_thresh=ShapeBasedClustering.CONF['CLUSTER_ACCEPTANCE_THRESHOLD']))
+                labels[members] = members_labels + next_label
+                next_label += members_labels.max() + 1
+
+        # number the clusters from 0
+        return np.unique(labels, return_inverse=True)[1]
+
+    def _get_stratified_sample(self, values, fraction):
+        """
+        Selects a sample of time series stratified along their main variation of shape: the time series are sorted by their
+        projection on the first principal component of the z-normalized time series and one time series is selected in each 
+        of the len(sample) strata of equal size (the middle one).
+        
+        Keyword arguments:
+        values -- Numpy ndarray of the time series (each row is a time series)
+        fraction -- fraction of the time series to select
+        
+        Return:
+        Numpy array of the positions of the sample's time series (ascending order)
+        """
+        nb_timeseries = values.shape[0]
+        sample_size = min(nb_timeseries, max(2, math.ceil(fraction * nb_timeseries)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            znorm_values = np.nan_to_num((values - values.mean(axis=1, keepdims=True)) / values.std(axis=1, keepdims=True))
+        centered_values = znorm_values - znorm_values.mean(axis=0)
+        _, _, vt = np.linalg.svd(centered_values, full_matrices=False)
+        order = np.argsort(centered_values @ vt[0], kind='stable')
+        strata_middles = ((np.arange(sample_size) + 0.5) * nb_timeseries / sample_size).astype(np.intp)
+        return np.sort(order[strata_middles])
+
+    def _compute_clusters_statistics(self, timeseries, cassignment, cids_to_update=None, stats=None):
+        """
+        Computes the statistics of a data set's clusters.
+        
+        Keyword arguments:
+        timeseries -- Pandas DataFrame containing the data set's time series (each row is a time series)
+        cassignment -- Pandas DataFrame containing clusters' assignment of the data set's time series
+        cids_to_update -- list of the IDs of the clusters whose statistics must be computed (default None, if None, the 
+                          statistics of all clusters are computed)
+        stats -- dict of the previous statistics of the clusters (see get_clusters_statistics), from which the statistics of 
+                 the clusters which are not updated are taken (default None, must be specified if cids_to_update is)
+        
+        Return:
+        Dict of the clusters' statistics (see get_clusters_statistics)
+        """
+        cassignment = cassignment.set_index('Time Series ID')
+        timeseries = timeseries.loc[timeseries.index.isin(cassignment.index)] # time series without cluster are ignored
+        cassignment = cassignment.loc[timeseries.index]
+        cids = np.unique(cassignment['Cluster ID'].to_numpy())
+        to_update = np.isin(cids, cids_to_update) if cids_to_update is not None else np.ones(len(cids), dtype=bool)
+        new_stats = {'cids': cids, 'counts': np.zeros(len(cids), dtype=np.int64), 
+                     'sums': np.zeros((len(cids), timeseries.shape[1])), 'centroids': np.zeros((len(cids), timeseries.shape[1]))}
+        if not to_update.all():
+            previous_positions = np.searchsorted(stats['cids'], cids[~to_update])
+            for key in ['counts', 'sums', 'centroids']:
+                new_stats[key][~to_update] = stats[key][previous_positions]
+
+        members = cassignment['Cluster ID'].isin(cids[to_update]).to_numpy()
+        values, labels = timeseries.to_numpy()[members], cassignment['Cluster ID'].to_numpy()[members]
+        positions = np.searchsorted(cids, labels)
+        new_stats['counts'] += np.bincount(positions, minlength=len(cids)) * to_update
+        np.add.at(new_stats['sums'], positions, np.nan_to_num(CorrelationMatrixObjective._standardize(values)))
+        if members.any():
+            updated_labels, centroids = KShape().extract_shapes(values, labels)
+            new_stats['centroids'][np.searchsorted(cids, updated_labels)] = centroids
+        return new_stats
+
+    def _load_clusters_statistics(self, dataset_name):
+        """
+        Loads the saved statistics of the given data set's clusters.
+        
+        Keyword arguments:
+        dataset_name -- name of the data set to which the clusters belong
+        
+        Return:
+        Dict of the clusters' statistics (see get_clusters_statistics) or None if they are missing or have been computed 
+        for another version of the clusters
+        """
+        filename = self._get_clusters_statistics_filename(dataset_name)
+        if os.path.exists(filename):
+            with np.load(filename) as f:
+                if f['version'] == self.get_clusters_version(dataset_name):
+                    return {key: f[key] for key in ['cids', 'counts', 'sums', 'centroids']}
+        return None
+
+    def _save_clusters_statistics(self, dataset, stats):
+        """
+        Saves (atomically) the statistics of the given data set's clusters along with the version of the clusters.
+        
+        Keyword arguments:
+        dataset -- Dataset object to which the clusters belong
+        stats -- dict of the clusters' statistics (see get_clusters_statistics)
+        
+        Return: -
+        """
+        filename = self._get_clusters_statistics_filename(dataset.name)
+        tmp_filename = filename + '.tmp%i' % os.getpid()
+        with open(tmp_filename, 'wb') as f:
+            np.savez(f, version=self.get_clusters_version(dataset.name), **stats)
+        os.replace(tmp_filename, filename)
+
+    def _get_clusters_statistics_filename(self, dataset_name):
+        """
+        Returns the filename of the statistics of the given data set's clusters.
+        
+        Keyword arguments: 
+        dataset_name -- name of the data set to which the clusters belong
+        
+        Return: 
+        Filename of the statistics of the data set's clusters
+        """
+        return normp(AbstractClustering.CLUSTERS_DIR + f'/{dataset_name}{ShapeBasedClustering.CLUSTERS_FILENAMES_ID}_cstats.npz')
+
+    def _record_changed_cids(self, changed_cids):
+        """
+        Adds the given IDs to the IDs of the data sets' changed clusters.
+        
+        Keyword arguments:
+        changed_cids -- dict with the data sets' names as keys and the lists of the IDs of their changed clusters as values
+        
+        Return: -
+        """
+        all_changed_cids = self._get_changed_cids()
+        for dataset_name, cids in changed_cids.items():
+            all_changed_cids[dataset_name] = sorted(set(all_changed_cids.get(dataset_name, [])).union(cids))
+        self._save_changed_cids(all_changed_cids)
+
+    def _get_changed_cids(self):
+        """
+        Loads the IDs of the data sets' changed clusters.
+        
+        Keyword arguments: -
+        
+        Return:
+        Dict with the data sets' names as keys and the sorted lists of the IDs of their changed clusters as values
+        """
+        if not os.path.exists(ShapeBasedClustering.CHANGED_CLUSTERS_FILE):
+            return {}
+        with open(ShapeBasedClustering.CHANGED_CLUSTERS_FILE, 'r') as f:
+            return json.load(f)
+
+    def _save_changed_cids(self, changed_cids):
+        """
+        Saves (atomically) the IDs of the data sets' changed clusters.
+        
+        Keyword arguments:
+        changed_cids -- dict with the data sets' names as keys and the sorted lists of the IDs of their changed clusters as values
+        
+        Return: -
+        """
+        tmp_filename = ShapeBasedClustering.CHANGED_CLUSTERS_FILE + '.tmp%i' % os.getpid()
+        with open(tmp_filename, 'w') as f:
+            json.dump(changed_cids, f)
+        os.replace(tmp_filename, ShapeBasedClustering.CHANGED_CLUSTERS_FILE)
+
+    def _get_max_cid(self, excluded_names=()):
+        """
+        Returns the largest cluster ID over all data sets' stored clusters.
+        
+        Keyword arguments:
+        excluded_names -- names of the data sets whose clusters are ignored (default ())
+        
+        Return:
+        Largest cluster ID (-1 if no clusters are stored)
+        """
+        return max([ShapeBasedClustering.CASSIGNMENTS_STORE.load(dataset_name)['Cluster ID'].max()
+                    for dataset_name in ShapeBasedClustering.CASSIGNMENTS_STORE.get_datasets_names()
+                    if dataset_name not in excluded_names], default=-1)
+
+    def _skip_clustered_datasets(self, datasets):
+        """
+        Splits the given data sets in those which have been clustered by an interrupted run (their clusters are stored with 
+        the version recorded in the clustering status file) and those which remain to cluster.
+        
+        Keyword arguments:
+        datasets -- list of Dataset objects containing the time series to cluster
+        
+        Return:
+        1. List of Dataset objects already clustered
+        2. List of Dataset objects to cluster
+        """
+        status = self._get_clustering_status()
+        clustered = [dataset for dataset in datasets 
+                     if dataset.name in status and status[dataset.name] == self.get_clusters_version(dataset.name)]
+        if clustered:
+            print('%i data set(s) already clustered by an interrupted run: %s.\n' % (
+                len(clustered), ', '.join(dataset.name for dataset in clustered)))
+        return clustered, [dataset for dataset in datasets if dataset not in clustered]
+
+    def _get_clustering_status(self):
+        """
+        Returns the data sets clustered by the current (or interrupted) run.
+        
+        Keyword arguments: -
+        
+        Return:
+        Dict with the names of the data sets clustered as keys and the version of their stored clusters as values
+        """
+        status = {}
+        if os.path.exists(ShapeBasedClustering.CLUSTERING_STATUS_FILE):
+            with open(ShapeBasedClustering.CLUSTERING_STATUS_FILE, 'r') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) == 2: # a line may be incomplete if the run has been interrupted while writing it
+                        status[fields[0]] = json.loads(fields[1])
+        return status
+
+    def _set_clustering_status(self, dataset_name):
+        """
+        Records (durably) in the clustering status file that the given data set has been clustered.
+        
+        Keyword arguments:
+        dataset_name -- name of the data set clustered
+        
+        Return: -
+        """
+        with open(ShapeBasedClustering.CLUSTERING_STATUS_FILE, 'a') as f:
+            f.write('%s\t%s\n' % (dataset_name, json.dumps(self.get_clusters_version(dataset_name))))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _clear_clustering_status(self):
+        """
+        Removes the clustering status file once all data sets of a run have been clustered.
+        
+        Keyword arguments: -
+        
+        Return: -
+        """
+        if os.path.exists(ShapeBasedClustering.CLUSTERING_STATUS_FILE):
+            os.remove(ShapeBasedClustering.CLUSTERING_STATUS_FILE)
+
+    def _get_checkpoint_filename(self, dataset_name):
+        """
+        Returns the filename of the checkpoint of the given data set's clustering.
+        
+        Keyword arguments: 
+        dataset_name -- name of the data set being clustered
+        
+        Return: 
+        Filename of the checkpoint of the data set's clustering
+        """
+        return normp(AbstractClustering.CLUSTERS_DIR + f'/{dataset_name}{ShapeBasedClustering.CLUSTERS_FILENAMES_ID}_checkpoint.pkl')
+
+    def _estimate_peak_memory(self, dataset):
+        """
+        Estimates the peak memory used to cluster the given data set.
+        
+        Keyword arguments:
+        dataset -- Dataset object containing the time series to cluster
+        
+        Return:
+        Estimated peak memory in bytes
+        """
+        timeseries_bytes = dataset.get_space_complexity() * np.dtype(np.float64).itemsize
+        corr_matrix_bytes = dataset.nb_timeseries ** 2 * np.dtype(np.float64).itemsize
+        # each worker of the 'parallel' clustering engine holds a copy of the time series
+        _, nb_engine_workers = self._get_nb_workers()
+        workers_bytes = nb_engine_workers * timeseries_bytes if ShapeBasedClustering.CONF['CLUSTERING_ENGINE'] == 'parallel' else 0
+        return ShapeBasedClustering.CONF['CLUSTERING_MEMORY_FACTOR'] * timeseries_bytes + corr_matrix_bytes + workers_bytes
+
+    def _get_nb_workers(self):
+        """
+        Returns the number of data sets clustered at once by cluster_all_datasets and the number of workers used by the 
+        'parallel' clustering engine to cluster each data set, such that at most CLUSTERING_NB_WORKERS processes cluster 
+        time series at any time.
+        
+        Keyword arguments: -
+        
+        Return:
+        1. Number of data sets clustered at once
+        2. Number of workers of the 'parallel' clustering engine (1 if another engine is used)
+        """
+        nb_workers = ShapeBasedClustering.CONF['CLUSTERING_NB_WORKERS'] if ShapeBasedClustering.CONF['CLUSTERING_NB_WORKERS'] > 0 \
+                     else os.cpu_count()
+        nb_engine_workers = nb_workers if ShapeBasedClustering.CONF['CLUSTERING_ENGINE'] == 'parallel' else 1
+        return max(1, nb_workers // nb_engine_workers), nb_engine_workers
+
     def _cluster_timeseries(self, timeseries, nb_clusters):
         """
         Clusters the given time series.
         
         Keyword arguments:
-        timeseries -- Pandas DataFrame containing the time series (each row is a time series)
+        timeseries -- Pandas DataFrame or Numpy ndarray containing the time series (each row is a time series)
         nb_clusters -- number of clusters to produce
         
         Return:
@@ -216,18 +815,30 @@ class ShapeBasedClustering(AbstractClustering):
 
     def _get_cassignment_filename(self, dataset_name):
         """
-        Returns the filename of the clusters for the given data set's name.
+        Returns the filename of the CSV clusters for the given data set's name. Clusters are no longer saved as CSV: 
+        this file is only read to import clusters created by previous versions in the clusters' assignments store.
         
         Keyword arguments: 
         dataset_name -- name of the data set to which the clusters belong
         
         Return: 
-        Filename of the clusters for the given data set's name.
+        Filename of the CSV clusters for the given data set's name.
         """
         return normp(
             AbstractClustering.CLUSTERS_DIR + \
             f'/{dataset_name}{ShapeBasedClustering.CLUSTERS_FILENAMES_ID}{AbstractClustering.CLUSTERS_APPENDIX}')
 
+    def _get_cassignments_store(self):
+        """
+        Returns the store containing the clusters' assignments of all data sets clustered by this clusterer.
+        
+        Keyword arguments: -
+        
+        Return: 
+        CassignmentStore object
+        """
+        return ShapeBasedClustering.CASSIGNMENTS_STORE
+
     def _compute_run_score(self, timeseries, cassignment):
         """
         Computes a clustering run's score.
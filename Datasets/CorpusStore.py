@@ -0,0 +1,217 @@
+"""
+RecImpute - A Recommendation System of Imputation Techniques for Missing Values in Time Series,
+eXascale Infolab, University of Fribourg, Switzerland
+***
+CorpusStore.py
+@author: @chacungu
+"""
+
+import json
+import numpy as np
+import os
+from os.path import normpath as normp
+
+from Utils.Utils import Utils
+from Utils.SingletonClass import SingletonClass
+
+class CorpusStore(SingletonClass):
+    """
+    Singleton class which stores the time series of all real-world data sets in a single float32 memory-mapped file.
+    Each data set is stored as a contiguous (nb_timeseries x timeseries_length) block. An index file keeps the offset,
+    the shape and the archive's content hash of each data set's block. Views returned by this class are read-only and
+    never copy the data: all processes that open the corpus share the same memory pages.
+    """
+
+    CORPUS_DIR = normp('./Datasets/Cache/')
+    CORPUS_FILENAME = normp(CORPUS_DIR + '/corpus.f32')
+    INDEX_FILENAME = normp(CORPUS_DIR + '/corpus_index.json')
+    DTYPE = np.float32
+
+    # create necessary directories if not there yet
+    Utils.create_dirs_if_not_exist([CORPUS_DIR])
+
+
+    # constructor
+
+    def __new__(cls, *args, **kwargs):
+        if 'caller' in kwargs and kwargs['caller'] == 'get_instance':
+            return super(CorpusStore, cls).__new__(cls)
+        raise Exception('Singleton class cannot be instantiated. Please use the static method "get_instance".')
+
+    def __init__(self, *args, **kwargs):
+        self._index = None
+        self._index_mtime = None
+        self._corpus = None
+
+
+    # public methods
+
+    def contains(self, dataset_name, sha1):
+        """
+        Checks whether the corpus contains an up-to-date version of the given data set.
+
+        Keyword arguments:
+        dataset_name -- name of the data set
+        sha1 -- content hash of the data set's archive
+
+        Return:
+        True if the corpus contains the data set's time series created from the archive with the given hash, False otherwise
+        """
+        entry = self._get_index().get(dataset_name)
+        return entry is not None and entry['sha1'] == sha1
+
+    def get_view(self, dataset_name, transpose=True):
+        """
+        Returns a read-only zero-copy view of the data set's time series.
+
+        Keyword arguments:
+        dataset_name -- name of the data set
+        transpose -- if True, each row is a time series. Otherwise, each column is a time series (default True)
+
+        Return:
+        Numpy ndarray (memory-mapped view) containing the data set's time series
+        """
+        entry = self._get_index()[dataset_name]
+        corpus = self._get_corpus()
+        size = entry['nb_timeseries'] * entry['timeseries_length']
+        view = corpus[entry['offset']:entry['offset'] + size].reshape(entry['nb_timeseries'], entry['timeseries_length'])
+        return view if transpose else view.T
+
+    def update(self, datasets):
+        """
+        Adds to the corpus the data sets which are missing or outdated. New blocks are appended at the end of the corpus
+        file. If some blocks are outdated, the whole corpus is rebuilt in a new file to avoid keeping stale data.
+
+        Keyword arguments:
+        datasets -- list of Dataset objects whose time series must be stored in the corpus
+
+        Return: -
+        """
+        index = self._get_index()
+        keys = {dataset.name: dataset.get_archive_sha1() for dataset in datasets}
+        outdated = [name for name, sha1 in keys.items() if name in index and index[name]['sha1'] != sha1]
+        missing = [dataset for dataset in datasets if dataset.name not in index or dataset.name in outdated]
+        if not missing:
+            return
+
+        if outdated: # rebuild: copy the up-to-date blocks to a new file and append the missing ones
+            tmp_filename = CorpusStore.CORPUS_FILENAME + '.tmp%i' % os.getpid()
+            new_index, offset = {}, 0
+            with open(tmp_filename, 'wb') as f:
+                for name, entry in index.items():
+                    if name in outdated:
+                        continue
+                    f.write(self.get_view(name).tobytes())
+                    new_index[name] = dict(entry, offset=offset)
+                    offset += entry['nb_timeseries'] * entry['timeseries_length']
+                offset = self._append(f, missing, keys, new_index, offset)
+            os.replace(tmp_filename, CorpusStore.CORPUS_FILENAME)
+        else: # append the missing blocks to the current file
+            new_index = dict(index)
+            offset = sum(e['nb_timeseries'] * e['timeseries_length'] for e in index.values())
+            with open(CorpusStore.CORPUS_FILENAME, 'ab') as f:
+                f.truncate(offset * np.dtype(CorpusStore.DTYPE).itemsize) # drop any partially written block
+                self._append(f, missing, keys, new_index, offset)
+        self._save_index(new_index)
+        self._corpus = None # the corpus' size changed: it must be mapped again
+
+
+    # private methods
+
+    def _append(self, f, datasets, keys, index, offset):
+        """
+        Writes the given data sets' time series at the end of the opened corpus file and registers them in the index.
+
+        Keyword arguments:
+        f -- corpus file opened in binary write/append mode
+        datasets -- list of Dataset objects to write
+        keys -- dict with data sets' name as keys and their archive's content hash as values
+        index -- dict of the corpus' index to update
+        offset -- offset (number of values) at which the first data set is written
+
+        Return:
+        Offset following the last written data set
+        """
+        for dataset in datasets:
+            try:
+                values = dataset.load_timeseries(transpose=True).to_numpy(dtype=CorpusStore.DTYPE)
+            except (TypeError, ValueError): # non-numerical data set: cannot be stored
+                continue
+            f.write(np.ascontiguousarray(values).tobytes())
+            index[dataset.name] = {
+                'offset': offset,
+                'nb_timeseries': values.shape[0],
+                'timeseries_length': values.shape[1],
+                'sha1': keys[dataset.name],
+            }
+            offset += values.size
+        return offset
+
+    def _get_index(self):
+        """
+        Returns the corpus' index. The index is reloaded if its file changed since it was last read.
+
+        Keyword arguments: -
+
+        Return:
+        Dict with data sets' name as keys and, as values, a dict (with keys: offset, nb_timeseries, timeseries_length, sha1)
+        """
+        try:
+            mtime = os.stat(CorpusStore.INDEX_FILENAME).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if self._index is None or mtime != self._index_mtime:
+            with open(CorpusStore.INDEX_FILENAME, 'r') as f:
+                self._index = json.load(f)
+            self._index_mtime = mtime
+            self._corpus = None
+        return self._index
+
+    def _save_index(self, index):
+        """
+        Saves (atomically) the corpus' index.
+
+        Keyword arguments:
+        index -- dict of the corpus' index to save
+
+        Return: -
+        """
+        tmp_filename = CorpusStore.INDEX_FILENAME + '.tmp%i' % os.getpid()
+        with open(tmp_filename, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_filename, CorpusStore.INDEX_FILENAME)
+        self._index = None
+
+    def _get_corpus(self):
+        """
+        Returns the read-only memory-mapped corpus.
+
+        Keyword arguments: -
+
+        Return:
+        1D Numpy memmap containing the time series of all data sets
+        """
+        if self._corpus is None:
+            self._corpus = np.memmap(CorpusStore.CORPUS_FILENAME, dtype=CorpusStore.DTYPE, mode='r')
+        return self._corpus
+
+    def __getstate__(self):
+        # the memory map is not sent to other processes: they map the corpus file themselves
+        state = self.__dict__.copy()
+        state['_corpus'] = None
+        return state
+
+
+    # static methods
+
+    @classmethod
+    def get_instance(cls):
+        """
+        Returns the single instance of this class.
+        
+        Keyword arguments: - (no args required, cls is provided automatically since this is a classmethod)
+        
+        Return: 
+        Single instance of this class.
+        """
+        return super().get_instance(cls)
@@ -6,15 +6,27 @@ Dataset.py
 @author: @chacungu
 """
 
+import hashlib
+import json
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import numpy as np
 import os
 from os.path import normpath as normp
 import pandas as pd
 from pandas.api.types import is_datetime64_any_dtype as is_datetime
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError: # pandas < 2.2
+    from pandas._libs.tslibs.parsing import guess_datetime_format
 import re
+import time
 from tqdm import tqdm
 import yaml
 import zipfile
 
+from Datasets.CorpusStore import CorpusStore
+from Utils.LRUCache import LRUCache
 from Utils.Utils import Utils
 
 class Dataset:
@@ -23,7 +35,19 @@ class Dataset:
     """
 
     RW_DS_PATH = normp('./Datasets/RealWorld/')
+    CACHE_DIR = normp('./Datasets/Cache/')
+    ARCHIVE_FILES_EXT = (('txt', 'csv'), 'index', 'info') # data set, index and info files' extension
+    DATETIME_SAMPLE_SIZE = 32 # number of values parsed to detect a date time column and infer its format
     CONF = Utils.read_conf_file('datasets')
+    # process-wide cache of the loaded time series and clusters' assignments (shared by all Dataset objects)
+    CACHE = LRUCache(CONF['LRU_CACHE_MAX_MB'] * 1024 ** 2)
+
+    # the corpus reads the time series' index from the on-disk cache
+    if CONF['USE_CORPUS'] and not CONF['CACHE_TIMESERIES']:
+        raise ValueError('USE_CORPUS requires CACHE_TIMESERIES to be True in the data sets\' configuration file.')
+
+    # create necessary directories if not there yet
+    Utils.create_dirs_if_not_exist([CACHE_DIR])
 
 
     # constructor
@@ -31,7 +55,8 @@ class Dataset:
     def __init__(self, archive_name, clusterer):
         self.rw_ds_filename = archive_name
         self.name = archive_name[:-4]
-        self.nb_timeseries, self.timeseries_length = self.load_timeseries(transpose=True).shape
+        # the time series are loaded lazily: only their shape is read when instantiating the data set
+        self.nb_timeseries, self.timeseries_length = self._get_shape()
 
         self.clusterer = clusterer
         self.cids = None
@@ -42,29 +67,59 @@ class Dataset:
 
     # public methods
 
-    def get_cluster_by_id(self, timeseries, cluster_id, cassignment):
+    def get_cluster_by_id(self, timeseries, cluster_id, cassignment, clusters_index=None):
         """
         Returns the time series belonging to the specified cluster's id.
         
         Keyword arguments:
-        timeseries -- Pandas DataFrame containing the time series (each row is a time series).
+        timeseries -- Pandas DataFrame containing the time series (each row is a time series). If None, only the cluster's 
+                      time series are loaded.
         cluster_id -- cluster id (int) of which the time series that must be returned belong to.
         cassignment -- Pandas DataFrame containing clusters' assignment of the data set's time series. 
                        Its index is the same as the real world data set of this object. The associated 
                        values are the clusters' id to which are assigned the time series.
+        clusters_index -- dict mapping each cluster's id to the rows' position of its time series, as returned by
+                          get_clusters_index (default None, if None, the rows are searched in the clusters' assignment).
         
         Return:
         Pandas DataFrame containing the time series belonging to the specified cluster's id (each row is a time series).
         """
-        return timeseries.loc[cassignment['Time Series ID'][cassignment['Cluster ID'] == cluster_id]]
+        if timeseries is not None and clusters_index is not None:
+            return timeseries.iloc[clusters_index[cluster_id]]
+        tids = cassignment['Time Series ID'].to_numpy()[cassignment['Cluster ID'].to_numpy() == cluster_id]
+        if timeseries is None:
+            return self.load_timeseries(transpose=True, tids=tids)
+        return timeseries.iloc[self._get_positions(timeseries, tids)]
+
+    def get_clusters_index(self, timeseries, cassignment):
+        """
+        Builds the index mapping each cluster's id to the rows' position of its time series. The index is built in a single
+        pass over the clusters' assignment (stable argsort of the clusters' id and split at each cluster's boundary).
+        
+        Keyword arguments:
+        timeseries -- Pandas DataFrame containing the time series (each row is a time series).
+        cassignment -- Pandas DataFrame containing clusters' assignment of the data set's time series. 
+                       Its index is the same as the real world data set of this object. The associated 
+                       values are the clusters' id to which are assigned the time series.
+        
+        Return:
+        Dict with clusters' id as keys (in order of first appearance in the clusters' assignment) and, as values,
+        Numpy arrays of the positions (in timeseries) of the rows belonging to each cluster.
+        """
+        cids = cassignment['Cluster ID'].to_numpy()
+        positions = self._get_positions(timeseries, cassignment['Time Series ID'].to_numpy())
+        unique_cids, first_occurrences, inverse = np.unique(cids, return_index=True, return_inverse=True)
+        sorted_positions = positions[np.argsort(inverse, kind='stable')]
+        groups = np.split(sorted_positions, np.cumsum(np.bincount(inverse, minlength=len(unique_cids)))[:-1])
+        return {unique_cids[i]: groups[i] for i in np.argsort(first_occurrences)}
 
     def yield_all_clusters(self, timeseries, cassignment=None):
         """
         Yields the time series of each cluster in a Pandas DataFrame.
         
         Keyword arguments:
-        timeseries -- Pandas DataFrame containing the time series (each row is a time series).
-        cluster_id -- cluster id (int) of which the time series that must be returned belong to.
+        timeseries -- Pandas DataFrame containing the time series (each row is a time series). If None, the time series of
+                      each cluster are loaded one cluster at a time.
         cassignment -- Pandas DataFrame containing clusters' assignment of the data set's time series. 
                        Its index is the same as the real world data set of this object. The associated 
                        values are the clusters' id to which are assigned the time series (default None, if None, loads it).
@@ -78,71 +133,109 @@ class Dataset:
         # load clusters assignment
         if cassignment is None:
             cassignment = self.load_cassignment(self.clusterer)
-        for cluster_id in cassignment['Cluster ID'].unique(): # for each cluster ID present in this dataset
+        clusters_index = self.get_clusters_index(timeseries, cassignment) if timeseries is not None \
+                         else dict.fromkeys(cassignment['Cluster ID'].unique())
+        for cluster_id in clusters_index.keys(): # for each cluster ID present in this dataset
             # retrieve time series assigned to this cluster
-            cluster = self.get_cluster_by_id(timeseries, cluster_id, cassignment)
+            cluster = self.get_cluster_by_id(timeseries, cluster_id, cassignment, 
+                                             clusters_index if timeseries is not None else None)
             yield cluster, cluster_id, cassignment
 
-    def load_timeseries(self, transpose=False):
+    def load_timeseries(self, transpose=False, tids=None, time_range=None):
         """
         Loads time series which are stored in a .txt file with either a .info or a .index file describing the dates used as index.
+        If enabled in the conf file, the time series are read from the memory-mapped corpus or from the on-disk cache to avoid 
+        parsing the archive again on later loads. Loaded time series are kept in the process-wide LRU cache (as float32 
+        values if they are stored in the corpus or cache). The time series are always returned as float64 values.
+        If a subset of the time series or a time window is requested, only the corresponding values are read from the 
+        memory-mapped corpus or cache (the whole data set is only parsed if none of them is available).
         
         Keyword arguments:
         transpose -- transpose the data set if true (default False)
+        tids -- list of the IDs of the time series to load (default None, if None, loads all time series)
+        time_range -- tuple (start, end) of the dates delimiting (inclusively) the time window to load. One of the bounds 
+                      can be None (default None, if None, loads the whole time series)
         
         Return:
         Pandas DataFrame containing the time series
         """
-        ds_filename_ext = ('txt', 'csv')
-        index_filename_ext = 'index'
-        info_filename_ext = 'info' 
+        is_subset = tids is not None or time_range is not None
+        stat = os.stat(self._get_archive_filename())
+        key = ('timeseries', self.name, stat.st_size, stat.st_mtime_ns)
+        dataset = Dataset.CACHE.get(key)
+        if dataset is None:
+            if Dataset.CONF['USE_CORPUS'] and CorpusStore.get_instance().contains(self.name, self.get_archive_sha1()):
+                # zero-copy view of the memory-mapped corpus
+                dataset = pd.DataFrame(self.get_timeseries_view(transpose=False), index=self._load_cached_index(), copy=False)
+            elif Dataset.CONF['CACHE_TIMESERIES']:
+                # a subset is read from the memory-mapped cache without loading the whole data set in memory
+                dataset = self._load_from_cache(mmap_mode='r' if is_subset else None)
+                if dataset is None: # cache is missing or outdated
+                    dataset = self._save_to_cache(self._load_from_archive())
+            else:
+                dataset = self._load_from_archive()
+            Dataset.CACHE.put(key, dataset)
+        
+        if is_subset:
+            rows = dataset.index.slice_indexer(*time_range) if time_range is not None else slice(None)
+            columns = slice(None)
+            if tids is not None:
+                columns = dataset.columns.get_indexer(tids)
+                if (columns < 0).any():
+                    raise KeyError('Time series IDs not found in data set %s: %s' % (self.name, list(np.asarray(tids)[columns < 0])))
+            dataset = dataset.iloc[rows, columns]
+        if (dataset.dtypes == np.float32).all():
+            # the corpus and the cache store float32 values: the time series are returned with the archive's precision (float64)
+            dataset = dataset.astype(np.float64)
+        else:
+            dataset = dataset.copy(deep=False) # callers can rename axes without altering the cached DataFrame
+        return dataset if not transpose else dataset.T
 
-        # load archive
-        with zipfile.ZipFile(normp(Dataset.RW_DS_PATH + '/' + self.rw_ds_filename), 'r') as archive:
-            prefix = f'{self.name}/' if archive.namelist()[0] == self.name + '/' else ''
-
-            r = re.compile(f'.*{self.name}.*\.[{ds_filename_ext[0]}|\
-                                               {ds_filename_ext[1]}|\
-                                               {index_filename_ext}|\
-                                               {info_filename_ext}]', re.IGNORECASE)
-            filenames = list(filter(r.match, archive.namelist()))
-            _get_filename = lambda l, ext: next(x for x in l if x.endswith(ext))
+    def yield_timeseries_chunks(self, chunk_size, transpose=False, time_range=None):
+        """
+        Yields the data set's time series by blocks of fixed size. Each block is read from the memory-mapped corpus or cache:
+        data sets larger than the available memory can be processed block by block.
+        
+        Keyword arguments:
+        chunk_size -- maximum number of time series per block
+        transpose -- transpose the blocks if true (default False)
+        time_range -- tuple (start, end) of the dates delimiting (inclusively) the time window to load. One of the bounds 
+                      can be None (default None, if None, loads the whole time series)
+        
+        Return:
+        Pandas DataFrame containing the time series of one block
+        """
+        for start in range(0, self.nb_timeseries, chunk_size):
+            tids = range(start, min(start + chunk_size, self.nb_timeseries))
+            yield self.load_timeseries(transpose=transpose, tids=tids, time_range=time_range)
 
-            # load data set
-            ds_filename = _get_filename(filenames, ds_filename_ext)
-            dataset = pd.read_csv(archive.open(ds_filename), sep=' ', header=None)
-            
-            if self._is_datetime_col(dataset[0]): # if first column is of type datetime: use it as index
-                dataset['DateTime'] = pd.to_datetime(dataset[0])
-                dataset = dataset.drop(columns=[0])
-                dataset = dataset.set_index('DateTime')
-                dataset.columns = pd.RangeIndex(dataset.columns.size)
-            else: # else try to load an index or info file containing information about the data set's index
-                # load data set's index (date range)
-                try:
-                    # index: each point's date is specified in file
-                    # index file: 1 column DataFrame (1 x nb_points_in_time_series), each row is a Date
-                    index_filename = _get_filename(filenames, index_filename_ext)
-                    index = pd.read_csv(archive.open(index_filename), sep=' ', header=None, parse_dates=True)
-                    dataset['DateTime'] = index[0].tolist()
-                    dataset['DateTime'] = pd.to_datetime(dataset['DateTime'])
-                    dataset = dataset.set_index('DateTime')
-                except StopIteration: # index file does not exist
-                    # info: only start date, periods and freq are given, date range is created from this
-                    # info file: 2 rows: header (start, periods, freq) and content (Date, int, Char)
-                    try:
-                        info_filename = _get_filename(filenames, info_filename_ext)
-                        date_range = pd.read_csv(archive.open(info_filename), sep=' ', parse_dates=True)
-                        date_range = dict(zip(date_range.columns, date_range.values[0]))
-                    except StopIteration:
-                        date_range = {'start': '1900-1-1', 'periods': len(dataset.index), 'freq': '1s'}
-                    dataset = dataset.set_index(pd.date_range(**date_range))
+    def get_timeseries_view(self, transpose=True):
+        """
+        Returns a read-only zero-copy view of the data set's time series stored in the memory-mapped corpus.
+        The corpus must have been built (see Dataset.instantiate_from_dir).
+        
+        Keyword arguments:
+        transpose -- if True, each row is a time series. Otherwise, each column is a time series (default True)
+        
+        Return:
+        Numpy ndarray (memory-mapped view) containing the data set's time series
+        """
+        return CorpusStore.get_instance().get_view(self.name, transpose=transpose)
 
-        return dataset if not transpose else dataset.T
+    def get_archive_sha1(self):
+        """
+        Returns the content hash of the data set's archive.
+        
+        Keyword arguments: -
+        
+        Return:
+        SHA-1 hex digest of the data set's archive
+        """
+        return self._get_archive_key(self._load_manifest())['sha1']
 
     def save_cassignment(self, clusterer, cassignment):
         """
-        Saves the given clusters to CSV.
+        Saves the given clusters.
         
         Keyword arguments: 
         clusterer -- clusterer instance used to create the clusters to load
@@ -156,7 +249,8 @@ class Dataset:
 
     def load_cassignment(self, clusterer):
         """
-        Loads the Pandas Dataframe containing the clusters' assignment of this data set. 
+        Loads the Pandas Dataframe containing the clusters' assignment of this data set. The assignment is read from the 
+        process-wide LRU cache if it did not change since it was last loaded or saved.
         
         Keyword arguments: 
         clusterer --- clusterer instance used to create the clusters to load
@@ -166,7 +260,43 @@ class Dataset:
         as the real world data set of this object. The associated values are the clusters' id to which are
         assigned the time series. Two columns: Time Series ID, Cluster ID.
         """
-        return clusterer.load_clusters(self.name)
+        key = self._get_cassignment_cache_key(clusterer)
+        cassignment = Dataset.CACHE.get(key)
+        if cassignment is None:
+            cassignment = clusterer.load_clusters(self.name)
+            Dataset.CACHE.put(key, cassignment.copy())
+        else:
+            cassignment = cassignment.copy() # callers update the assignment in place
+        return cassignment
+
+    def cache_cassignment(self, clusterer, cassignment):
+        """
+        Stores the given clusters' assignment in the process-wide LRU cache as the current version of the data set's 
+        clusters. Must be called by the clusterer each time it saves the data set's clusters.
+        
+        Keyword arguments: 
+        clusterer --- clusterer instance used to create the clusters
+        cassignment -- Pandas DataFrame containing clusters' assignment of the data set's time series which has just been saved.
+        
+        Return: -
+        """
+        prefix = ('cassignment', clusterer.__class__.__name__, self.name)
+        Dataset.CACHE.invalidate(lambda k: k[:3] == prefix)
+        # same content as the one which would be read back from the clusterer's store
+        Dataset.CACHE.put(self._get_cassignment_cache_key(clusterer), cassignment.reset_index(drop=True))
+
+    def get_cassignment_sha1(self, clusterer):
+        """
+        Returns the content hash of the data set's clusters' assignment.
+        
+        Keyword arguments: 
+        clusterer --- clusterer instance used to create the clusters
+        
+        Return:
+        SHA-1 hex digest of the (Time Series ID, Cluster ID) pairs of the clusters' assignment
+        """
+        cassignment = self.load_cassignment(clusterer)[['Time Series ID', 'Cluster ID']]
+        return hashlib.sha1(np.ascontiguousarray(cassignment.to_numpy(dtype=np.int64)).tobytes()).hexdigest()
 
     def get_space_complexity(self):
         """
@@ -236,49 +366,468 @@ class Dataset:
     def __repr__(self):
         return self.name
     
+    def _load_from_archive(self):
+        """
+        Loads time series which are stored in a .txt file with either a .info or a .index file describing the dates used as index.
+        
+        Keyword arguments: -
+        
+        Return:
+        Pandas DataFrame containing the time series (each column is a time series)
+        """
+        ds_filename_ext, index_filename_ext, info_filename_ext = Dataset.ARCHIVE_FILES_EXT
+
+        # load archive
+        with zipfile.ZipFile(self._get_archive_filename(), 'r') as archive:
+            filenames = self._get_archive_members(archive)
+            _get_filename = lambda l, ext: next(x for x in l if x.endswith(ext))
+
+            # load data set
+            ds_filename = _get_filename(filenames, ds_filename_ext)
+            dataset = pd.read_csv(archive.open(ds_filename), sep=' ', header=None)
+            
+            datetimes = self._parse_datetime_col(dataset[0])
+            if datetimes is not None: # if first column is of type datetime: use it as index
+                dataset['DateTime'] = datetimes
+                dataset = dataset.drop(columns=[0])
+                dataset = dataset.set_index('DateTime')
+                dataset.columns = pd.RangeIndex(dataset.columns.size)
+            else: # else try to load an index or info file containing information about the data set's index
+                # load data set's index (date range)
+                try:
+                    # index: each point's date is specified in file
+                    # index file: 1 column DataFrame (1 x nb_points_in_time_series), each row is a Date
+                    index_filename = _get_filename(filenames, index_filename_ext)
+                    index = pd.read_csv(archive.open(index_filename), sep=' ', header=None, parse_dates=True)
+                    dataset['DateTime'] = index[0].tolist()
+                    datetimes = self._parse_datetime_col(dataset['DateTime'])
+                    dataset['DateTime'] = datetimes if datetimes is not None else pd.to_datetime(dataset['DateTime'])
+                    dataset = dataset.set_index('DateTime')
+                except StopIteration: # index file does not exist
+                    # info: only start date, periods and freq are given, date range is created from this
+                    # info file: 2 rows: header (start, periods, freq) and content (Date, int, Char)
+                    try:
+                        info_filename = _get_filename(filenames, info_filename_ext)
+                        date_range = pd.read_csv(archive.open(info_filename), sep=' ', parse_dates=True)
+                        date_range = dict(zip(date_range.columns, date_range.values[0]))
+                    except StopIteration:
+                        date_range = {'start': '1900-1-1', 'periods': len(dataset.index), 'freq': '1s'}
+                    dataset = dataset.set_index(pd.date_range(**date_range))
+
+        return dataset
+
+    def _get_positions(self, timeseries, tids):
+        """
+        Returns the rows' position of the given time series.
+        
+        Keyword arguments:
+        timeseries -- Pandas DataFrame containing the time series (each row is a time series).
+        tids -- Numpy array of the IDs of the time series
+        
+        Return:
+        Numpy array of the positions (in timeseries) of the rows of the given time series. Raises a KeyError if some of the
+        time series are not in timeseries.
+        """
+        positions = timeseries.index.get_indexer(tids)
+        if (positions < 0).any():
+            raise KeyError('Time series IDs not found in data set %s: %s' % (self.name, list(np.asarray(tids)[positions < 0])))
+        return positions
+
+    def _get_archive_members(self, archive):
+        """
+        Returns the name of the archive's files which are related to the data set (data set, index and info files).
+        
+        Keyword arguments:
+        archive -- opened zipfile.ZipFile of the data set
+        
+        Return:
+        List of the archive's files names related to the data set
+        """
+        ds_filename_ext, index_filename_ext, info_filename_ext = Dataset.ARCHIVE_FILES_EXT
+        r = re.compile(f'.*{self.name}.*\.[{ds_filename_ext[0]}|\
+                                           {ds_filename_ext[1]}|\
+                                           {index_filename_ext}|\
+                                           {info_filename_ext}]', re.IGNORECASE)
+        return list(filter(r.match, archive.namelist()))
+
+    def _get_shape(self):
+        """
+        Returns the number of time series and their length without loading them. The shape is read from the data set's 
+        manifest if it is up to date. Otherwise, it is measured by counting the lines and the tokens of the data set's file 
+        inside the archive (no DataFrame is built) and saved in the manifest.
+        
+        Keyword arguments: -
+        
+        Return:
+        1. Number of time series in the data set
+        2. Time series' length
+        """
+        manifest = self._load_manifest()
+        key = self._get_archive_key(manifest)
+        if manifest is not None and manifest['archive']['sha1'] == key['sha1'] and 'shape' in manifest:
+            return tuple(manifest['shape'])
+
+        shape = self._probe_shape()
+        if manifest is None or manifest['archive']['sha1'] != key['sha1']:
+            manifest = {} # the manifest describes an outdated version of the archive
+        manifest.update({'archive': key, 'shape': shape})
+        self._save_manifest(manifest)
+        return tuple(shape)
+
+    def _probe_shape(self):
+        """
+        Measures the number of time series and their length by scanning the data set's file inside the archive. 
+        
+        Keyword arguments: -
+        
+        Return:
+        List of two elements: number of time series in the data set and time series' length
+        """
+        ds_filename_ext, _, _ = Dataset.ARCHIVE_FILES_EXT
+        with zipfile.ZipFile(self._get_archive_filename(), 'r') as archive:
+            ds_filename = next(x for x in self._get_archive_members(archive) if x.endswith(ds_filename_ext))
+            nb_columns, nb_lines = None, 0
+            with archive.open(ds_filename) as f:
+                for line in f:
+                    line = line.rstrip(b'\r\n')
+                    if not line.strip(): # blank lines are skipped by the parser
+                        continue
+                    if nb_columns is None:
+                        tokens = line.decode().split(' ')
+                        # a first column of dates is used as index and is therefore not a time series
+                        nb_columns = len(tokens) - int(self._is_datetime_token(tokens[0]))
+                    nb_lines += 1
+        return [nb_columns or 0, nb_lines]
+
+    def _get_archive_filename(self):
+        """
+        Returns the filename of the data set's archive.
+        
+        Keyword arguments: -
+        
+        Return:
+        Filename of the data set's archive.
+        """
+        return normp(Dataset.RW_DS_PATH + '/' + self.rw_ds_filename)
+
+    def _get_cassignment_cache_key(self, clusterer):
+        """
+        Returns the key identifying the current version of the data set's clusters' assignment in the process-wide LRU cache.
+        
+        Keyword arguments: 
+        clusterer --- clusterer instance used to create the clusters
+        
+        Return:
+        Tuple made of the clusterer's name, the data set's name and the version of the clusters' assignment
+        """
+        return ('cassignment', clusterer.__class__.__name__, self.name, clusterer.get_clusters_version(self.name))
+
+    def _get_cache_filenames(self):
+        """
+        Returns the filenames of the data set's cached files.
+        
+        Keyword arguments: -
+        
+        Return:
+        1. Filename of the .npy file containing the time series' values (float32, each column is a time series)
+        2. Filename of the .npy file containing the time series' index (datetime64)
+        3. Filename of the .json manifest describing the cached files and the archive they were created from
+        """
+        prefix = normp(Dataset.CACHE_DIR + '/' + self.name)
+        return prefix + '.npy', prefix + '_index.npy', prefix + '.json'
+
+    def _get_archive_key(self, manifest=None):
+        """
+        Returns the key identifying the current version of the data set's archive: its size, last modification time and
+        content hash. The content hash is only recomputed if the size or the modification time differ from the given manifest.
+        
+        Keyword arguments:
+        manifest -- dict of a previously saved manifest or None (default None)
+        
+        Return:
+        Dict with keys: size, mtime, sha1
+        """
+        stat = os.stat(self._get_archive_filename())
+        key = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': None}
+        if manifest is not None and manifest['archive']['size'] == key['size'] and manifest['archive']['mtime'] == key['mtime']:
+            key['sha1'] = manifest['archive']['sha1']
+        else:
+            sha1 = hashlib.sha1()
+            with open(self._get_archive_filename(), 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha1.update(chunk)
+            key['sha1'] = sha1.hexdigest()
+        return key
+
+    def _load_manifest(self):
+        """
+        Loads the manifest describing the data set's cached files.
+        
+        Keyword arguments: -
+        
+        Return:
+        Dict of the manifest or None if it does not exist
+        """
+        _, _, manifest_filename = self._get_cache_filenames()
+        try:
+            with open(manifest_filename, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save_manifest(self, manifest):
+        """
+        Saves (atomically) the manifest describing the data set's cached files.
+        
+        Keyword arguments:
+        manifest -- dict of the manifest to save
+        
+        Return: -
+        """
+        _, _, manifest_filename = self._get_cache_filenames()
+        tmp_filename = manifest_filename + '.tmp%i' % os.getpid()
+        with open(tmp_filename, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_filename, manifest_filename)
+
+    def _load_from_cache(self, mmap_mode=None):
+        """
+        Loads the time series from the on-disk cache if it exists and has been created from the current version of the archive.
+        
+        Keyword arguments:
+        mmap_mode -- if not None, the values are memory-mapped with this mode instead of being read (see numpy.load) (default None)
+        
+        Return:
+        Pandas DataFrame containing the time series (each column is a time series) or None if the cache is missing or outdated
+        """
+        values_filename, index_filename, _ = self._get_cache_filenames()
+        manifest = self._load_manifest()
+        if manifest is None or 'index_name' not in manifest or not os.path.isfile(values_filename):
+            return None
+        
+        key = self._get_archive_key(manifest)
+        if key['sha1'] != manifest['archive']['sha1']:
+            return None # archive's content changed
+        if key['mtime'] != manifest['archive']['mtime']:
+            # archive has been touched but its content did not change
+            manifest['archive'] = key
+            self._save_manifest(manifest)
+
+        values = np.load(values_filename, mmap_mode=mmap_mode)
+        return pd.DataFrame(values, index=self._load_cached_index(manifest), copy=False)
+
+    def _load_cached_index(self, manifest=None):
+        """
+        Loads the time series' index from the on-disk cache.
+        
+        Keyword arguments:
+        manifest -- dict of the data set's manifest (default None, if None, loads it)
+        
+        Return:
+        Pandas DatetimeIndex of the time series
+        """
+        manifest = manifest if manifest is not None else self._load_manifest()
+        _, index_filename, _ = self._get_cache_filenames()
+        return pd.DatetimeIndex(np.load(index_filename), name=manifest['index_name'], freq=manifest['index_freq'])
+
+    def _save_to_cache(self, dataset):
+        """
+        Saves the parsed time series to the on-disk cache (values as float32 and datetime index as separate .npy files).
+        
+        Keyword arguments:
+        dataset -- Pandas DataFrame containing the time series (each column is a time series)
+        
+        Return:
+        Pandas DataFrame containing the cached time series (each column is a time series)
+        """
+        try:
+            values = dataset.to_numpy(dtype=np.float32)
+        except (TypeError, ValueError): # non-numerical data set: cannot be cached
+            return dataset
+        index = pd.DatetimeIndex(dataset.index)
+        values_filename, index_filename, _ = self._get_cache_filenames()
+        for filename, array in ((values_filename, values), (index_filename, index.values)):
+            tmp_filename = filename + '.tmp%i.npy' % os.getpid()
+            np.save(tmp_filename, array)
+            os.replace(tmp_filename, filename)
+        manifest = self._load_manifest() or {}
+        manifest.update({
+            'archive': self._get_archive_key(),
+            'index_name': index.name,
+            'index_freq': index.freqstr,
+            'shape': [values.shape[1], values.shape[0]],
+        })
+        self._save_manifest(manifest)
+        return pd.DataFrame(values, index=index, copy=False)
+
+    def _is_datetime_token(self, token):
+        """
+        Checks if a single value read from a data set's file is a date time (and not a number or a missing value).
+        
+        Keyword arguments:
+        token -- string read from the data set's file
+        
+        Return:
+        True if the token is a date time, False otherwise
+        """
+        try:
+            float(token)
+            return False
+        except ValueError:
+            return token != '' and self._is_datetime_col(pd.Series([token], dtype='object'))
+
     def _is_datetime_col(self, col):
         """
-        Checks if a Pandas Series is of type date time.
+        Checks if a Pandas Series is of type date time. Only a sample of the series' values is parsed.
         
         Keyword arguments:
         col -- Pandas series
         
         Return:
-        True if the Pandas Series contains only date time objects False otherwise
+        True if the sampled values of the Pandas Series are all date time objects False otherwise
         """
         if col.dtype == 'object':
+            sample = col.dropna().iloc[:Dataset.DATETIME_SAMPLE_SIZE]
+            if sample.empty:
+                return False
             try:
-                col = pd.to_datetime(col)
+                pd.to_datetime(sample)
                 return True
             except ValueError:
                 return False
         return is_datetime(col)
 
+    def _parse_datetime_col(self, col):
+        """
+        Parses a Pandas Series of date times. The date time format is inferred on a sample of the series' values (or read 
+        from the data set's manifest if it has already been inferred) and the whole series is then parsed once with this 
+        explicit format. The inferred format is saved in the data set's manifest.
+        
+        Keyword arguments:
+        col -- Pandas series
+        
+        Return:
+        Pandas Series of date times or None if the Pandas Series does not contain only date time objects
+        """
+        if not self._is_datetime_col(col):
+            return None
+        if col.dtype != 'object':
+            return col
+
+        manifest = self._load_manifest()
+        datetime_format = self._infer_datetime_format(col, manifest)
+        try:
+            datetimes = pd.to_datetime(col, format=datetime_format)
+        except ValueError:
+            if datetime_format is None:
+                return None
+            try: # the format inferred from the sample does not match all values
+                datetime_format = None
+                datetimes = pd.to_datetime(col)
+            except ValueError:
+                return None
+
+        if manifest is not None and manifest.get('datetime_format') != datetime_format:
+            manifest['datetime_format'] = datetime_format
+            self._save_manifest(manifest)
+        return datetimes
+
+    def _infer_datetime_format(self, col, manifest=None):
+        """
+        Infers the format of a Pandas Series of date times from a sample of its values.
+        
+        Keyword arguments:
+        col -- Pandas series of date times (as strings)
+        manifest -- dict of the data set's manifest. If it contains a date time format matching the sample, this format 
+                    is used without inferring it again (default None)
+        
+        Return:
+        Date time format (strftime directives) matching all sampled values or None if no such format has been found
+        """
+        sample = col.dropna().iloc[:Dataset.DATETIME_SAMPLE_SIZE]
+        def _matches(datetime_format):
+            try:
+                pd.to_datetime(sample, format=datetime_format)
+                return True
+            except ValueError:
+                return False
+
+        datetime_format = manifest.get('datetime_format') if manifest is not None else None
+        if datetime_format is not None and _matches(datetime_format): # format inferred during a previous load
+            return datetime_format
+        datetime_format = guess_datetime_format(str(sample.iloc[0]))
+        if datetime_format is not None and _matches(datetime_format):
+            return datetime_format
+        return None
+
 
     # static methods
 
     @staticmethod
-    def instantiate_from_dir(clusterer):
+    def instantiate_from_dir(clusterer, mode=None, nb_workers=None):
         """
         Instantiates multiple data set objects from the Datasets/RealWorld folder.
-        Uses the Datasets conf file to define which data set use.
+        Uses the Datasets conf file to define which data set use. The data sets are returned in the order of the conf file's 
+        list (or in alphabetical order if all data sets are used). Prints the time needed to instantiate each data set.
         
         Keyword arguments: 
         clusterer --- clusterer instance that will be (or has been) used to cluster this data set's time series
+        mode -- how the data sets are instantiated. Can be one of: 'sequential', 'threads', 'processes' 
+                (default None, if None, uses the conf file's value)
+        nb_workers -- number of workers used if mode is 'threads' or 'processes'. If <= 0, uses all available cores 
+                      (default None, if None, uses the conf file's value)
         
         Return:
         List of Dataset objects
         """
-        timeseries = [Dataset(ds_filename, clusterer) 
-                      for ds_filename in os.listdir(Dataset.RW_DS_PATH)
-                      if Dataset.CONF['USE_ALL'] or ds_filename in Dataset.CONF['USE_LIST']]
+        mode = mode if mode is not None else Dataset.CONF['DISCOVERY_MODE']
+        nb_workers = nb_workers if nb_workers is not None else Dataset.CONF['DISCOVERY_NB_WORKERS']
+        nb_workers = nb_workers if nb_workers > 0 else None
+
+        available_filenames = os.listdir(Dataset.RW_DS_PATH)
+        if Dataset.CONF['USE_ALL']:
+            ds_filenames = sorted(f for f in available_filenames if f.endswith('.zip'))
+        else:
+            ds_filenames = [f for f in Dataset.CONF['USE_LIST'] if f in available_filenames]
+
+        args = [(ds_filename, clusterer) for ds_filename in ds_filenames]
+        if mode == 'sequential':
+            results = [_instantiate_timed(*a) for a in args]
+        elif mode in ('threads', 'processes'):
+            # the pool's map keeps the order of the data sets' list
+            pool_class = ThreadPool if mode == 'threads' else Pool
+            with pool_class(processes=nb_workers) as p:
+                results = p.starmap(_instantiate_timed, args)
+        else:
+            raise Exception('Invalid data sets discovery mode: %s' % mode)
+
+        print('Data sets instantiation times:')
+        for dataset, elapsed_time in results:
+            print('- %s: %.2f seconds' % (dataset.name, elapsed_time))
+        timeseries = [dataset for dataset, _ in results]
         
         # check: either use all data sets listed in the folder
         # ... or verify that all data sets listed in the conf file have been found and loaded
         assert Dataset.CONF['USE_ALL'] or len(timeseries) == len(Dataset.CONF['USE_LIST'])
 
+        # store the data sets' time series in the memory-mapped corpus (if not there yet)
+        if Dataset.CONF['USE_CORPUS']:
+            CorpusStore.get_instance().update(timeseries)
+
         return timeseries
 
+    @staticmethod
+    def get_cache_stats():
+        """
+        Returns the statistics of the process-wide LRU cache of loaded time series and clusters' assignments.
+        
+        Keyword arguments: -
+        
+        Return:
+        Dict with keys: hits, misses, evictions, nb_entries, current_bytes, max_bytes
+        """
+        return Dataset.CACHE.get_stats()
+
     @staticmethod
     def yield_each_datasets_cluster(datasets):
         """
@@ -296,8 +845,9 @@ class Dataset:
         for dataset in tqdm(datasets): # for each data set
             timeseries = dataset.load_timeseries(transpose=True) # load data set's time series
             clusters_assignment = dataset.load_cassignment(dataset.clusterer) # load clusters assignment
-            for cluster_id in clusters_assignment['Cluster ID'].unique(): # for each cluster
-                cluster = dataset.get_cluster_by_id(timeseries, cluster_id, clusters_assignment)
+            clusters_index = dataset.get_clusters_index(timeseries, clusters_assignment)
+            for cluster_id in clusters_index.keys(): # for each cluster
+                cluster = dataset.get_cluster_by_id(timeseries, cluster_id, clusters_assignment, clusters_index)
                 yield dataset, timeseries, cluster, cluster_id
 
     @staticmethod
@@ -313,4 +863,21 @@ class Dataset:
         """
         for dataset in datasets: # for each data set
             for cid in dataset.cids:
-                yield cid
\ No newline at end of file
+                yield cid
+
+
+def _instantiate_timed(ds_filename, clusterer):
+    """
+    Instantiates a Dataset object and measures the time it took. Defined at the module level to be usable by a pool of processes.
+    
+    Keyword arguments:
+    ds_filename -- filename of the data set's archive
+    clusterer -- clusterer instance that will be (or has been) used to cluster this data set's time series
+    
+    Return:
+    1. Dataset object
+    2. Time (in seconds) needed to instantiate the data set
+    """
+    start_time = time.time()
+    dataset = Dataset(ds_filename, clusterer)
+    return dataset, time.time() - start_time
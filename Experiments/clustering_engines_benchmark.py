@@ -0,0 +1,59 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir('../')
+
+from Clustering.ConFree_kClustering import cluster as cfkc_cluster
+from Clustering.CorrelationMatrixObjective import CorrelationMatrixObjective
+from Clustering.ShapeBasedClustering import ShapeBasedClustering
+from Datasets.Dataset import Dataset
+
+import numpy as np
+import pandas as pd
+import time
+
+ENGINES = ['pandas', 'numpy']
+SEED = 0
+
+def run_engine(clusterer, timeseries, engine, dataset_name):
+    CONF = ShapeBasedClustering.CONF
+    corr_offset = 2
+    np.random.seed(SEED)
+    start = time.time()
+    labels = cfkc_cluster(
+        clusterer.kshape_helper,
+        CorrelationMatrixObjective(timeseries, offset=corr_offset),
+        timeseries,
+        obj_thresh = CONF['CLUSTER_ACCEPTANCE_THRESHOLD'] +corr_offset,
+        init_obj_thresh = CONF['INIT_ACCEPTANCE_THRESHOLD'] +corr_offset,
+        sim_cluster_thresh = CONF['SIMILAR_CLUSTER_THRESHOLD'] +corr_offset,
+        centroid_dist_thresh = CONF['CENTROID_DIST_THRESHOLD'] +corr_offset,
+        k_perc = CONF['TS_PERC_TO_COMPUTE_K'],
+        security_limit = 5,
+        max_iter = CONF['MAX_ITER'],
+        id = dataset_name,
+        apply_merging = CONF['APPLY_MERGING'],
+        engine = engine
+    )
+    return labels, time.time() - start
+
+def main():
+    clusterer = ShapeBasedClustering()
+    datasets = Dataset.instantiate_from_dir(clusterer)
+
+    results = []
+    for dataset in datasets:
+        timeseries = dataset.load_timeseries(transpose=True)
+        all_labels, row = {}, {'Data set': dataset.name, 'Shape': '%ix%i' % timeseries.shape}
+        for engine in ENGINES:
+            all_labels[engine], row[engine + ' (s)'] = run_engine(clusterer, timeseries, engine, dataset.name)
+        row['Speedup'] = row['pandas (s)'] / row['numpy (s)']
+        row['Identical labels'] = all_labels['pandas'] == all_labels['numpy']
+        results.append(row)
+
+    results = pd.DataFrame(results)
+    print(results.to_string(index=False))
+    print('Total: pandas %.2fs, numpy %.2fs' % (results['pandas (s)'].sum(), results['numpy (s)'].sum()))
+
+
+if __name__ == '__main__':
+    main()
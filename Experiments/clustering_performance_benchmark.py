@@ -0,0 +1,187 @@
+import os, sys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+os.chdir(ROOT_DIR)
+
+from Clustering.AbstractClustering import AbstractClustering
+from Clustering.CassignmentStore import CassignmentStore
+from Clustering.CorrelationMatrixObjective import CorrelationMatrixObjective
+from Clustering.KShape import KShape
+from Clustering.ShapeBasedClustering import ShapeBasedClustering
+from Datasets.Dataset import Dataset
+from Utils.Utils import Utils
+
+from datetime import datetime
+from functools import wraps
+import json
+import multiprocessing
+import numpy as np
+import pandas as pd
+import resource
+from sklearn.metrics import adjusted_rand_score
+import tempfile
+import time
+
+# (number of time series, length of the time series) of the generated data sets. Can be overridden from the command line
+# with arguments formatted as NxL (e.g. python clustering_performance_benchmark.py 100x128 1000x256)
+SHAPES = [(100, 128), (500, 128), (1000, 256)]
+NB_FAMILIES = 8 # number of random-walk families (ground truth clusters) of each data set
+MAX_SHIFT = 4 # maximum number of time steps a family's member is shifted by
+NOISE = 0.1 # standard deviation of the steps of the random walk added to each family's member
+SEED = 0
+STAGES = ['kshape', 'confree_kclustering', 'sample_then_assign', 'cluster', 'apply_constraints']
+RESULTS_DIR = 'Experiments/results/'
+
+# methods whose calls are counted: (class, method's name, counter)
+COUNTED_METHODS = [
+    (KShape, 'fit', 'kshape_calls'),
+    (ShapeBasedClustering, '_cluster_timeseries', 'kshape_calls'),
+    (CorrelationMatrixObjective, '__call__', 'objective_calls'),
+    (CorrelationMatrixObjective, 'score_positions', 'objective_calls'),
+    (CorrelationMatrixObjective, 'score_pairs', 'objective_calls'),
+    (CorrelationMatrixObjective, 'score_merges', 'objective_calls'),
+    (CorrelationMatrixObjective, 'score_statistics', 'objective_calls'),
+    (AbstractClustering, '_get_dataset_mean_corr', 'objective_calls'),
+    (AbstractClustering, '_get_dataset_mean_ncc_score', 'objective_calls'),
+    (AbstractClustering, '_get_avg_ncc', 'objective_calls'),
+]
+
+class SyntheticDataset(Dataset):
+    """
+    Data set whose time series are generated in memory instead of being read from an archive.
+    """
+
+    def __init__(self, name, timeseries, clusterer):
+        self.rw_ds_filename = None
+        self.name = name
+        self.nb_timeseries, self.timeseries_length = timeseries.shape
+        self.clusterer = clusterer
+        self.cids = None
+        self._timeseries = timeseries # each row is a time series
+
+    def load_timeseries(self, transpose=False, tids=None, time_range=None):
+        timeseries = self._timeseries if tids is None else self._timeseries.loc[tids]
+        return timeseries if transpose else timeseries.T
+
+def generate_dataset(nb_series, length, rng):
+    """
+    Generates random-walk families: each family has a base random walk and its members are this base shifted in time,
+    plus a small random walk, scaled and offset. The family of each time series is the ground truth of the clustering.
+    """
+    bases = np.cumsum(rng.normal(size=(NB_FAMILIES, length)), axis=1)
+    truth = rng.randint(NB_FAMILIES, size=nb_series)
+    shifts = rng.randint(-MAX_SHIFT, MAX_SHIFT + 1, size=nb_series)
+    positions = (np.arange(length)[None, :] - shifts[:, None]) % length
+    members = np.take_along_axis(bases[truth], positions, axis=1)
+    noise = np.cumsum(rng.normal(scale=NOISE, size=(nb_series, length)), axis=1)
+    values = rng.uniform(0.5, 2., size=(nb_series, 1)) * (members + noise) + rng.normal(scale=5., size=(nb_series, 1))
+    return pd.DataFrame(values), truth
+
+def count_calls(counts):
+    """
+    Replaces the methods of COUNTED_METHODS by wrappers counting their calls. Calls made by a counted method to another
+    method of the same counter are not counted.
+    """
+    depths = {counter: 0 for _, _, counter in COUNTED_METHODS}
+    def wrap(method, counter):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            if depths[counter] == 0:
+                counts[counter] += 1
+            depths[counter] += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                depths[counter] -= 1
+        return wrapper
+    for cls, method_name, counter in COUNTED_METHODS:
+        counts[counter] = 0
+        setattr(cls, method_name, wrap(cls.__dict__[method_name], counter))
+
+def get_peak_memory_mb():
+    usages = [resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return max(usages) / 1024 # ru_maxrss is in KB on Linux
+
+def run_stage(stage, dataset, nb_families):
+    clusterer = ShapeBasedClustering()
+    timeseries = dataset.load_timeseries(transpose=True)
+    np.random.seed(SEED)
+    if stage == 'kshape':
+        labels, _ = KShape(seed=SEED).fit(nb_families, timeseries)
+    elif stage == 'confree_kclustering':
+        labels = clusterer._confree_cluster(timeseries, dataset.name)
+    elif stage == 'sample_then_assign':
+        labels = clusterer._sample_then_assign(timeseries, dataset.name)
+    elif stage == 'cluster':
+        clusterer.cluster(dataset)
+    elif stage == 'apply_constraints':
+        clusterer.apply_constraints([dataset], ShapeBasedClustering.CONF['MIN_NB_TS_PER_CLUSTER'],
+                                    ShapeBasedClustering.CONF['MAX_NB_TS_PER_CLUSTER'])
+    if stage in ('cluster', 'apply_constraints'):
+        cassignment = dataset.load_cassignment(clusterer).set_index('Time Series ID')
+        labels = cassignment.loc[timeseries.index, 'Cluster ID']
+    return np.asarray(labels)
+
+def run_stage_process(stage, dataset, truth, queue):
+    """
+    Runs a stage in its own process such that its peak memory and calls counts are not mixed with those of other stages.
+    Calls made by the worker processes of a stage (e.g. parallel clustering engine) are not counted.
+    """
+    counts = {}
+    count_calls(counts)
+    start_memory = get_peak_memory_mb()
+    start = time.time()
+    labels = run_stage(stage, dataset, len(np.unique(truth)))
+    wall_time = time.time() - start
+    queue.put({
+        'wall_time_s': wall_time,
+        'peak_memory_mb': get_peak_memory_mb(),
+        'memory_increase_mb': get_peak_memory_mb() - start_memory,
+        **counts,
+        'nb_clusters': int(len(np.unique(labels))),
+        'ari': float(adjusted_rand_score(truth, labels)),
+    })
+
+def run_benchmark(nb_series, length, rng):
+    timeseries, truth = generate_dataset(nb_series, length, rng)
+    dataset = SyntheticDataset('synthetic_%ix%i' % (nb_series, length), timeseries, ShapeBasedClustering())
+    context = multiprocessing.get_context('fork')
+    results = []
+    for stage in STAGES:
+        queue = context.Queue()
+        process = context.Process(target=run_stage_process, args=(stage, dataset, truth, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        results.append({'dataset': dataset.name, 'nb_series': nb_series, 'length': length, 'nb_families': NB_FAMILIES,
+                        'stage': stage, **result})
+        print('%s - %s: %.2fs, ARI %.3f' % (dataset.name, stage, result['wall_time_s'], result['ari']))
+    return results
+
+def main(args):
+    shapes = [tuple(int(v) for v in arg.split('x')) for arg in args] if len(args) > 0 else SHAPES
+    rng = np.random.RandomState(SEED)
+
+    # the clusters and checkpoints of the synthetic data sets are saved in a temporary directory
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        AbstractClustering.CLUSTERS_DIR = tmp_dir
+        ShapeBasedClustering.CASSIGNMENTS_STORE = CassignmentStore(os.path.join(tmp_dir, 'sbc_cassignments'))
+        ShapeBasedClustering.CHANGED_CLUSTERS_FILE = os.path.join(tmp_dir, 'sbc_changed_clusters.json')
+        results = [result for nb_series, length in shapes for result in run_benchmark(nb_series, length, rng)]
+
+    results_df = pd.DataFrame(results).drop(columns=['nb_series', 'length', 'nb_families'])
+    print(results_df.to_string(index=False, float_format='%.3f'))
+
+    Utils.create_dirs_if_not_exist([RESULTS_DIR])
+    timestamp = datetime.now()
+    results_filename = RESULTS_DIR + 'clustering_performance_benchmark_%s.json' % timestamp.strftime('%Y%m%d_%H%M%S')
+    # only the scalar parameters: the others are grid search settings and may contain non-JSON values (e.g. .inf)
+    clustering_conf = {k: v for k, v in ShapeBasedClustering.CONF.items() if not isinstance(v, (list, dict))}
+    with open(results_filename, 'w') as f:
+        json.dump({'timestamp': timestamp.isoformat(), 'seed': SEED, 'noise': NOISE, 'max_shift': MAX_SHIFT,
+                   'clustering_conf': clustering_conf, 'results': results}, f, indent=4)
+    print('Results saved to %s' % results_filename)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -10,6 +10,7 @@ import abc
 import os
 from os.path import normpath as normp
 
+from Utils.ArtifactsManifest import ArtifactsManifest
 from Utils.Utils import Utils
 from Utils.SingletonClass import SingletonClass
 
@@ -56,4 +57,17 @@ class AbstractFeaturesExtractor(SingletonClass, metaclass=abc.ABCMeta):
         True if the features have already been computed and saved as CSV, false otherwise.
         """
         features_filename = self._get_features_filename(dataset_name)
-        return os.path.isfile(features_filename)
\ No newline at end of file
+        return os.path.isfile(features_filename)
+
+    def get_inputs_hash(self, dataset):
+        """
+        Returns the hash of the inputs the data set's features are created from: the data set's archive and the features 
+        extractor's configuration entries which change the features (see INPUTS_CONF_KEYS).
+        
+        Keyword arguments: 
+        dataset -- Dataset object to which the features belong
+        
+        Return: 
+        Hash of the features' inputs (see ArtifactsManifest.hash_inputs)
+        """
+        return ArtifactsManifest.hash_inputs(dataset.get_archive_sha1(), ArtifactsManifest.get_conf_inputs(self))
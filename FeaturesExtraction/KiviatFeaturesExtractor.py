@@ -16,6 +16,7 @@ import pandas as pd
 import sys
 
 from FeaturesExtraction.AbstractFeaturesExtractor import AbstractFeaturesExtractor
+from Utils.ArtifactsManifest import ArtifactsManifest
 from Utils.Utils import Utils
 
 class KiviatFeaturesExtractor(AbstractFeaturesExtractor):
@@ -77,6 +78,19 @@ class KiviatFeaturesExtractor(AbstractFeaturesExtractor):
         raise Exception('The KiviatFeaturesExtractor is not capable of extracting features on time series that are not clustered.'
                       + ' Please use the "extract" method to extract features for a whole clustered data set.')
 
+    def get_inputs_hash(self, dataset):
+        """
+        Returns the hash of the inputs the data set's features are created from: the data set's archive and its clusters
+        (features are computed for each cluster).
+        
+        Keyword arguments: 
+        dataset -- Dataset object to which the features belong
+        
+        Return: 
+        Hash of the features' inputs (see ArtifactsManifest.hash_inputs)
+        """
+        return ArtifactsManifest.hash_inputs(dataset.get_archive_sha1(), dataset.get_cassignment_sha1(dataset.clusterer))
+
     def save_features(self, dataset_name, features):
         """
         Saves the given features to CSV.
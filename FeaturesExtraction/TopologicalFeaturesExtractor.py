@@ -27,6 +27,8 @@ class TopologicalFeaturesExtractor(AbstractFeaturesExtractor):
 
     FEATURES_FILENAMES_ID = '_topological'
     CONF = Utils.read_conf_file('topologicalfeaturesextractor')
+    # configuration entries which change the features (see get_inputs_hash)
+    INPUTS_CONF_KEYS = ['MAX_TIME_DELAY', 'MAX_EMBEDDING_DIM', 'STRIDE', 'MAX_PCA_COMPONENTS', 'HOMOLOGY_DIM']
 
 
     # constructor
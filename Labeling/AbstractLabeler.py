@@ -9,6 +9,7 @@ AbstractLabeler.py
 import abc
 import os
 
+from Utils.ArtifactsManifest import ArtifactsManifest
 from Utils.SingletonClass import SingletonClass
 
 class AbstractLabeler(SingletonClass, metaclass=abc.ABCMeta):
@@ -54,4 +55,18 @@ class AbstractLabeler(SingletonClass, metaclass=abc.ABCMeta):
         True if the labels have already been computed and saved as CSV, false otherwise.
         """
         labels_filename = self._get_labels_filename(dataset_name)
-        return os.path.isfile(labels_filename)
\ No newline at end of file
+        return os.path.isfile(labels_filename)
+
+    def get_inputs_hash(self, dataset):
+        """
+        Returns the hash of the inputs the data set's labels are created from: the data set's archive, its clusters and the 
+        labeler's configuration entries which change the saved labels (see INPUTS_CONF_KEYS).
+        
+        Keyword arguments: 
+        dataset -- Dataset object to which the labels belong
+        
+        Return: 
+        Hash of the labels' inputs (see ArtifactsManifest.hash_inputs)
+        """
+        return ArtifactsManifest.hash_inputs(dataset.get_archive_sha1(), dataset.get_cassignment_sha1(dataset.clusterer), 
+                                             ArtifactsManifest.get_conf_inputs(self))
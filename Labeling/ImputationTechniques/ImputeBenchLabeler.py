@@ -30,6 +30,9 @@ class ImputeBenchLabeler(AbstractLabeler):
     LABELS_DIR = normp('./Labeling/ImputationTechniques/labels/')
     LABELS_FILENAMES_ID = '_ibl'
     CONF = Utils.read_conf_file('imputebenchlabeler')
+    # configuration entries which change the saved benchmark results (see get_inputs_hash): the others are applied when the 
+    # labels are loaded
+    INPUTS_CONF_KEYS = ['ALGORITHMS_LIST', 'TS_SELECTION_FOR_BCHMK', 'NB_TS_FOR_BCHMK', 'BENCHMARK_SCENARIO', 'BENCHMARK_ERRORS']
 
     # create necessary directories if not there yet
     Utils.create_dirs_if_not_exist([LABELS_DIR])
@@ -66,25 +69,41 @@ class ImputeBenchLabeler(AbstractLabeler):
             updated_datasets.append(dataset)
         return updated_datasets
 
-    def label(self, dataset):
+    def label(self, dataset, cluster_ids=None):
         """
         Labels each cluster from the given data set using the ImputeBench benchmark.
         
         Keyword arguments:
         dataset -- Dataset object containing time series to label
+        cluster_ids -- list of the IDs of the clusters to label (e.g. the clusters changed by 
+                       ShapeBasedClustering.assign_new_timeseries). The saved labels of the other clusters are kept: 
+                       they must have been created with the current configuration (see 
+                       ArtifactsManifest.is_conf_up_to_date) (default None, if None, all clusters are labeled)
         
         Return:
         Updated Dataset object
         """
         tmp_labels = []
-        
-        # load time series
-        timeseries = dataset.load_timeseries(transpose=True)
-
-        print('Labeling %i clusters of %s.' % (dataset.load_cassignment(dataset.clusterer)['Cluster ID'].nunique(), dataset.name)) # TODO tmp print
+        kept_cids = set()
+        if cluster_ids is not None and self.are_labels_created(dataset.name):
+            # keep the labels of the unchanged clusters which still exist
+            cassignment = dataset.load_cassignment(dataset.clusterer)
+            previous_labels = pd.read_csv(self._get_labels_filename(dataset.name))
+            previous_labels = previous_labels[previous_labels['Cluster ID'].isin(cassignment['Cluster ID']) 
+                                              & ~previous_labels['Cluster ID'].isin(cluster_ids)]
+            tmp_labels.extend(previous_labels.itertuples(index=False, name=None))
+            kept_cids = set(previous_labels['Cluster ID'])
+        
+        # load time series (if only the clusters' time series are fed to the benchmark, each cluster is loaded on its own)
+        timeseries = dataset.load_timeseries(transpose=True) \
+                     if ImputeBenchLabeler.CONF['TS_SELECTION_FOR_BCHMK'] != 'CLUSTER' else None
+
+        print('Labeling %i clusters of %s.' % (dataset.load_cassignment(dataset.clusterer)['Cluster ID'].nunique() - len(kept_cids), dataset.name)) # TODO tmp print
 
         # for each cluster
         for cluster, cluster_id, _ in dataset.yield_all_clusters(timeseries):
+            if cluster_id in kept_cids:
+                continue
             print('Running benchmark for cluster %i (%s)' % (cluster_id, dataset.name))
             # label the cluster's time series
             benchmark_results = self._label_cluster(timeseries, cluster, cluster_id)
@@ -220,7 +239,8 @@ class ImputeBenchLabeler(AbstractLabeler):
         Labels the given cluster using the ImputeBench benchmark.
         
         Keyword arguments:
-        all_timeseries -- DataFrame containing all the time series of the cluster's data set (each row is a time series)
+        all_timeseries -- DataFrame containing all the time series of the cluster's data set (each row is a time series). 
+                          Not used (and can be None) if the time series selection strategy for the benchmark is CLUSTER.
         cluster -- DataFrame containing only the time series of the cluster (each row is a time series)
         cluster_id -- cluster ID
         
@@ -40,6 +40,9 @@ class KiviatRulesLabeler(AbstractLabeler):
             {'efficient': 0, 'large_ts': 1, 'irregular_ts': 3, 'mixed_corr': 4, 'high_corr': 3},
     }
     CONF = Utils.read_conf_file('kiviatruleslabeler')
+    # configuration entries which change the saved clusters' features (see get_inputs_hash): the rules are applied when the 
+    # labels are loaded
+    INPUTS_CONF_KEYS = []
 
     # create necessary directories if not there yet
     Utils.create_dirs_if_not_exist([LABELS_DIR])
@@ -0,0 +1,197 @@
+"""
+RecImpute - A Recommendation System of Imputation Techniques for Missing Values in Time Series,
+eXascale Infolab, University of Fribourg, Switzerland
+***
+ArtifactsManifest.py
+@author: @chacungu
+"""
+
+import hashlib
+import json
+import os
+from os.path import normpath as normp
+
+from Utils.SingletonClass import SingletonClass
+
+class ArtifactsManifest(SingletonClass):
+    """
+    Singleton class which records, for each artifact produced by the pipeline (a data set's clusters, labels or features),
+    a hash of the inputs it has been created from. An artifact is up to date if it exists and its inputs did not change
+    since it was created: only the outdated artifacts have to be created again.
+    """
+
+    MANIFEST_FILENAME = normp('./artifacts_manifest.json')
+
+
+    # constructor
+
+    def __new__(cls, *args, **kwargs):
+        if 'caller' in kwargs and kwargs['caller'] == 'get_instance':
+            return super(ArtifactsManifest, cls).__new__(cls)
+        raise Exception('Singleton class cannot be instantiated. Please use the static method "get_instance".')
+
+    def __init__(self, *args, **kwargs):
+        self._manifest = None
+
+
+    # public methods
+
+    def is_up_to_date(self, producer, dataset_name, inputs_hash, exists):
+        """
+        Checks whether an artifact is up to date. An existing artifact which has never been recorded (e.g. created before
+        the manifest was introduced) is considered up to date and is recorded with the given inputs' hash.
+
+        Keyword arguments:
+        producer -- clusterer, labeler or features extractor instance which creates the artifact
+        dataset_name -- name of the data set to which the artifact belongs
+        inputs_hash -- hash of the artifact's current inputs (see ArtifactsManifest.hash_inputs)
+        exists -- True if the artifact has been created and saved, False otherwise
+
+        Return:
+        True if the artifact exists and has been created from the given inputs, False otherwise
+        """
+        if not exists:
+            return False
+        recorded_hash = self._get_manifest().get(self._get_key(producer, dataset_name))
+        if recorded_hash is None:
+            self.record(producer, dataset_name, inputs_hash)
+            return True
+        return recorded_hash == inputs_hash
+
+    def is_conf_up_to_date(self, producer, dataset_name):
+        """
+        Checks whether an artifact has been created with the producer's current configuration (see get_conf_inputs).
+
+        Keyword arguments:
+        producer -- clusterer, labeler or features extractor instance which creates the artifact
+        dataset_name -- name of the data set to which the artifact belongs
+
+        Return:
+        True if the artifact has been recorded with the producer's current configuration, False otherwise
+        """
+        recorded_hash = self._get_manifest().get(self._get_conf_key(producer, dataset_name))
+        return recorded_hash == ArtifactsManifest.hash_inputs(ArtifactsManifest.get_conf_inputs(producer))
+
+    def record(self, producer, dataset_name, inputs_hash):
+        """
+        Records the hash of the inputs an artifact has just been created from, as well as the hash of the producer's 
+        configuration (see is_conf_up_to_date).
+
+        Keyword arguments:
+        producer -- clusterer, labeler or features extractor instance which created the artifact
+        dataset_name -- name of the data set to which the artifact belongs
+        inputs_hash -- hash of the artifact's inputs (see ArtifactsManifest.hash_inputs)
+
+        Return: -
+        """
+        manifest = self._get_manifest()
+        manifest[self._get_key(producer, dataset_name)] = inputs_hash
+        manifest[self._get_conf_key(producer, dataset_name)] = \
+            ArtifactsManifest.hash_inputs(ArtifactsManifest.get_conf_inputs(producer))
+        self._save_manifest(manifest)
+
+
+    # private methods
+
+    def _get_key(self, producer, dataset_name):
+        """
+        Returns the key identifying an artifact in the manifest.
+
+        Keyword arguments:
+        producer -- clusterer, labeler or features extractor instance which creates the artifact
+        dataset_name -- name of the data set to which the artifact belongs
+
+        Return:
+        Key of the artifact
+        """
+        return '%s/%s' % (producer.__class__.__name__, dataset_name)
+
+    def _get_conf_key(self, producer, dataset_name):
+        """
+        Returns the key identifying the hash of the configuration an artifact has been created with in the manifest.
+
+        Keyword arguments:
+        producer -- clusterer, labeler or features extractor instance which creates the artifact
+        dataset_name -- name of the data set to which the artifact belongs
+
+        Return:
+        Key of the artifact's configuration
+        """
+        return self._get_key(producer, dataset_name) + '#conf'
+
+    def _get_manifest(self):
+        """
+        Returns the manifest (loads it if it has not been loaded yet).
+
+        Keyword arguments: -
+
+        Return:
+        Dict with artifacts' key as keys and the hash of their inputs as values
+        """
+        if self._manifest is None:
+            try:
+                with open(ArtifactsManifest.MANIFEST_FILENAME, 'r') as f:
+                    self._manifest = json.load(f)
+            except FileNotFoundError:
+                self._manifest = {}
+        return self._manifest
+
+    def _save_manifest(self, manifest):
+        """
+        Saves (atomically) the manifest.
+
+        Keyword arguments:
+        manifest -- dict of the manifest to save
+
+        Return: -
+        """
+        tmp_filename = ArtifactsManifest.MANIFEST_FILENAME + '.tmp%i' % os.getpid()
+        with open(tmp_filename, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_filename, ArtifactsManifest.MANIFEST_FILENAME)
+
+
+    # static methods
+
+    @staticmethod
+    def get_conf_inputs(producer):
+        """
+        Returns the configuration entries an artifact depends on: the entries of the producer's CONF listed in its 
+        INPUTS_CONF_KEYS. The entries which only change how the artifact is created (e.g. number of workers, memory budget) 
+        are not listed: changing them does not make the artifacts outdated.
+
+        Keyword arguments:
+        producer -- clusterer, labeler or features extractor instance which creates the artifact
+
+        Return:
+        Dict of the configuration entries the artifact depends on (None if the producer has no configuration)
+        """
+        conf = getattr(producer, 'CONF', None)
+        if conf is None:
+            return None
+        return {key: conf[key] for key in producer.INPUTS_CONF_KEYS}
+
+    @staticmethod
+    def hash_inputs(*inputs):
+        """
+        Hashes the inputs of an artifact.
+
+        Keyword arguments:
+        inputs -- JSON-serializable inputs of the artifact (e.g. content hashes of the upstream files, configuration dicts)
+
+        Return:
+        SHA-1 hex digest of the inputs
+        """
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+    @classmethod
+    def get_instance(cls):
+        """
+        Returns the single instance of this class.
+
+        Keyword arguments: - (no args required, cls is provided automatically since this is a classmethod)
+
+        Return:
+        Single instance of this class.
+        """
+        return super().get_instance(cls)
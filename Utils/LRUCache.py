@@ -0,0 +1,158 @@
+"""
+RecImpute - A Recommendation System of Imputation Techniques for Missing Values in Time Series,
+eXascale Infolab, University of Fribourg, Switzerland
+***
+LRUCache.py
+@author: @chacungu
+"""
+
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import threading
+
+class LRUCache:
+    """
+    Least-recently-used cache bounded by the total size (in bytes) of its entries. Thread-safe.
+    """
+
+
+    # constructor
+
+    def __init__(self, max_bytes):
+        """
+        Initializes a LRUCache object.
+
+        Keyword arguments:
+        max_bytes -- maximum total size (in bytes) of the cached entries. Least-recently-used entries are evicted when exceeded.
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict() # key -> (value, size in bytes)
+        self._lock = threading.Lock()
+
+
+    # public methods
+
+    def get(self, key):
+        """
+        Returns the value cached with the given key and marks it as the most recently used.
+
+        Keyword arguments:
+        key -- hashable key of the entry
+
+        Return:
+        Cached value or None if the key is not cached
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """
+        Caches the given value. Evicts the least-recently-used entries until the total size fits the cache's bound.
+        Values larger than the bound are not cached.
+
+        Keyword arguments:
+        key -- hashable key of the entry
+        value -- value to cache
+
+        Return: -
+        """
+        size = LRUCache.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, condition=None):
+        """
+        Removes the entries whose key satisfy the given condition.
+
+        Keyword arguments:
+        condition -- function taking a key as argument and returning True if the entry must be removed
+                     (default None, if None, removes all entries)
+
+        Return: -
+        """
+        with self._lock:
+            for key in [k for k in self._entries.keys() if condition is None or condition(k)]:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def get_stats(self):
+        """
+        Returns the cache's statistics.
+
+        Keyword arguments: -
+
+        Return:
+        Dict with keys: hits, misses, evictions, nb_entries, current_bytes, max_bytes
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'nb_entries': len(self._entries),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+    # static methods
+
+    @staticmethod
+    def sizeof(value):
+        """
+        Estimates the memory used by a value. Memory-mapped arrays do not count since their pages are backed by a file.
+
+        Keyword arguments:
+        value -- Numpy ndarray, Pandas DataFrame/Series/Index, or tuple/list of those
+
+        Return:
+        Estimated size in bytes
+        """
+        if isinstance(value, np.ndarray):
+            return 0 if LRUCache._is_memory_mapped(value) else value.nbytes
+        if isinstance(value, pd.DataFrame):
+            if value.dtypes.nunique() == 1 and LRUCache._is_memory_mapped(value.to_numpy()): # view of a memory-mapped array
+                return int(value.index.memory_usage(deep=True))
+            return int(value.memory_usage(index=True, deep=True).sum())
+        if isinstance(value, pd.Series):
+            return int(value.memory_usage(index=True, deep=True))
+        if isinstance(value, pd.Index):
+            return int(value.memory_usage(deep=True))
+        if isinstance(value, (tuple, list)):
+            return sum(LRUCache.sizeof(v) for v in value)
+        return 0
+
+    @staticmethod
+    def _is_memory_mapped(array):
+        """
+        Checks if a Numpy array is (a view of) a memory-mapped array.
+
+        Keyword arguments:
+        array -- Numpy ndarray
+
+        Return:
+        True if the array's data is backed by a memory-mapped file, False otherwise
+        """
+        while isinstance(array, np.ndarray):
+            if isinstance(array, np.memmap):
+                return True
+            array = array.base
+        return False
@@ -31,6 +31,7 @@ from Labeling.ImputationTechniques.KiviatRulesLabeler import KiviatRulesLabeler
 from Training.ClfPipeline import ClfPipeline
 from Training.ModelsTrainer import ModelsTrainer
 from Training.TrainResults import TrainResults
+from Utils.ArtifactsManifest import ArtifactsManifest
 from Utils.Utils import Utils
 
 
@@ -264,6 +265,9 @@ def main(args):
     _valid_args = {
         '-mode': ['cluster', 'label', 'extract_features', 'train', 'eval', 'use'],
 
+        # *cluster* args
+        '-incremental': ['True', 'False'],
+
         # *train* args
         # '-lbl': LABELERS.keys(),
         # '-true_lbl': LABELERS.keys(),
@@ -300,7 +304,31 @@ def main(args):
         # init data sets
         datasets = Dataset.instantiate_from_dir(clusterer)
 
-        clusterer.cluster_all_datasets_seq(datasets)
+        # only cluster the data sets whose clusters are missing or have been created from different inputs
+        manifest = ArtifactsManifest.get_instance()
+        inputs_hashes = {dataset.name: clusterer.get_inputs_hash(dataset) for dataset in datasets}
+        outdated_datasets = [dataset for dataset in datasets 
+                             if not manifest.is_up_to_date(clusterer, dataset.name, inputs_hashes[dataset.name], 
+                                                           clusterer.are_clusters_created(dataset.name))]
+        print('%i data set(s) to cluster, %i up to date.' % (len(outdated_datasets), len(datasets) - len(outdated_datasets)))
+
+        if outdated_datasets and args.get('-incremental') == 'True':
+            # assign the new time series to the existing clusters: the other clusters keep their ID and labels. Only possible
+            # if the clusters have been created with the current configuration and their time series did not change
+            extendable_datasets = [dataset for dataset in outdated_datasets 
+                                   if manifest.is_conf_up_to_date(clusterer, dataset.name) 
+                                   and clusterer.can_assign_new_timeseries(dataset)]
+            outdated_datasets = [dataset for dataset in outdated_datasets if dataset not in extendable_datasets]
+            print('%i data set(s) updated incrementally, %i clustered again.' % (len(extendable_datasets), len(outdated_datasets)))
+            changed_cids = clusterer.assign_new_timeseries(extendable_datasets)
+            for dataset in extendable_datasets:
+                print('%s: %i cluster(s) changed or created.' % (dataset.name, len(changed_cids[dataset.name])))
+                manifest.record(clusterer, dataset.name, inputs_hashes[dataset.name])
+        if outdated_datasets:
+            # the clustered data sets' clusters get IDs after those of the up-to-date data sets, which are left unchanged
+            clustered_datasets = clusterer.cluster_all_datasets(outdated_datasets)
+            for dataset in clustered_datasets:
+                manifest.record(clusterer, dataset.name, inputs_hashes[dataset.name])
         print('Done.')
 
 
@@ -320,8 +348,18 @@ def main(args):
         # init data sets
         datasets = Dataset.instantiate_from_dir(clusterer)
 
-        # label the datasets' clusters
-        updated_datasets = labeler.label_all_datasets(datasets)
+        # label the datasets' clusters (only those whose labels are missing or have been created from different inputs)
+        manifest = ArtifactsManifest.get_instance()
+        for dataset in datasets:
+            inputs_hash = labeler.get_inputs_hash(dataset)
+            if not manifest.is_up_to_date(labeler, dataset.name, inputs_hash, labeler.are_labels_created(dataset.name)):
+                # only the clusters changed by an incremental clustering are labeled again (all clusters if there are none
+                # or if the previous labels were created with another labeler's configuration)
+                cluster_ids = clusterer.get_changed_cids(dataset.name) \
+                              if manifest.is_conf_up_to_date(labeler, dataset.name) else None
+                labeler.label(dataset, cluster_ids=cluster_ids)
+                manifest.record(labeler, dataset.name, inputs_hash) # recorded right away: labeling a data set can take hours
+                clusterer.clear_changed_cids(dataset.name)
 
         # if '-true_lbl' in args:
         #     true_labeler = LABELERS[args['-true_lbl']].get_instance()
@@ -350,10 +388,16 @@ def main(args):
         # init data sets
         datasets = Dataset.instantiate_from_dir(clusterer)
 
-        # extract the features of the datasets' time series
+        # extract the features of the datasets' time series (only those whose features are missing or have been created 
+        # from different inputs)
+        manifest = ArtifactsManifest.get_instance()
         for dataset in datasets:
             for features_extractor in features_extractors:
-                features_extractor.extract(dataset)
+                inputs_hash = features_extractor.get_inputs_hash(dataset)
+                if not manifest.is_up_to_date(features_extractor, dataset.name, inputs_hash, 
+                                              features_extractor.are_features_created(dataset.name)):
+                    features_extractor.extract(dataset)
+                    manifest.record(features_extractor, dataset.name, inputs_hash)
         print('Done.')
 
 